@@ -0,0 +1,422 @@
+"""
+Пакетный импорт наличных оплат (/api/admin/cash-payments/import).
+
+Наличные из офиса приходят таблицей. Вместо отдельного запроса на каждую строку файл
+проверяется целиком до записи (ошибка в любой строке — ничего не записывается), затем
+платежи записываются транзакциями по группам сделок (одна блокировка строки на сделку),
+вместе с распределениями по месяцам. Bitrix24 обновляется одним batch-запросом на 50 сделок,
+в Telegram уходит одно сводное уведомление.
+
+Формат строки — как у POST /api/admin/deals/{deal_id}/cash-payment:
+deal_id, amount или allocations (month_index + amount), payment_date, comment, idempotency_key.
+"""
+
+import csv
+import io
+import json
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.config import settings
+from models.deal import Deal
+from models.payment_log import PaymentLog
+
+logger = logging.getLogger(__name__)
+
+# Максимальная сумма одного платежа — защита от ошибок ввода (как в ручной отметке оплаты)
+CASH_PAYMENT_MAX_AMOUNT = 10_000_000
+
+# Колонки CSV (регистр не важен); month_index — если строка относится к конкретному месяцу графика
+CASH_IMPORT_COLUMNS = ("deal_id", "amount", "month_index", "payment_date", "comment", "idempotency_key")
+
+_IN_CHUNK = 500
+
+
+def _decode(content: bytes) -> str:
+    # Excel в русской локали сохраняет CSV в cp1251
+    try:
+        return content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return content.decode("cp1251")
+
+
+def parse_cash_import(content: bytes, content_type: Optional[str] = None) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    Разбирает файл импорта: JSON (список строк или {"rows": [...]}) или CSV с заголовком.
+
+    Returns:
+        [(номер строки, сырые поля)] — номер строки файла (для CSV с учётом заголовка), для JSON — позиция с 1
+
+    Raises:
+        ValueError: файл не разбирается или в нём нет колонки deal_id
+    """
+    text = _decode(content).strip()
+    if not text:
+        raise ValueError("Пустой файл импорта")
+
+    is_json = "json" in (content_type or "") or text[0] in "[{"
+    if is_json:
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise ValueError(f"Некорректный JSON: {e}")
+        if isinstance(data, dict):
+            data = data.get("rows")
+        if not isinstance(data, list) or not all(isinstance(r, dict) for r in data):
+            raise ValueError("JSON импорта — список строк или объект {\"rows\": [...]}")
+        return [(i + 1, row) for i, row in enumerate(data)]
+
+    try:
+        dialect = csv.Sniffer().sniff(text.split("\n", 1)[0], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(io.StringIO(text), dialect)
+    header = [h.strip().lower() for h in next(reader)]
+    if "deal_id" not in header:
+        raise ValueError(f"В CSV нет колонки deal_id. Колонки: {', '.join(CASH_IMPORT_COLUMNS)}")
+    rows = []
+    for values in reader:
+        if not any(v.strip() for v in values):
+            continue
+        rows.append((reader.line_num, {k: v.strip() for k, v in zip(header, values) if k}))
+    return rows
+
+
+def _parse_positive_int(value: Any, field: str) -> int:
+    if isinstance(value, bool):
+        raise ValueError(f"Некорректное значение {field}")
+    if isinstance(value, str):
+        value = value.replace(" ", "").replace("\u00a0", "").replace(",", ".")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Некорректное значение {field}: {value!r}")
+    if number != int(number):
+        raise ValueError(f"{field} должно быть целым числом рублей: {value!r}")
+    return int(number)
+
+
+def _parse_payment_date(value: Any) -> Optional[datetime]:
+    if value in (None, ""):
+        return None
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(str(value).strip(), fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Некорректная дата оплаты {value!r} (ожидается YYYY-MM-DD или ДД.ММ.ГГГГ)")
+
+
+def _normalize_row(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Поля строки импорта → платёж; ValueError с описанием первой ошибки в строке."""
+    deal_id = str(raw.get("deal_id") or "").strip()
+    if not deal_id:
+        raise ValueError("Не указан deal_id")
+
+    allocations: List[Tuple[int, int]] = []
+    raw_allocations = raw.get("allocations")
+    if raw_allocations:
+        if not isinstance(raw_allocations, list):
+            raise ValueError("allocations — список {month_index, amount}")
+        for a in raw_allocations:
+            if not isinstance(a, dict):
+                raise ValueError("allocations — список {month_index, amount}")
+            allocations.append((_parse_positive_int(a.get("month_index"), "month_index"),
+                                _parse_positive_int(a.get("amount"), "amount")))
+    elif raw.get("month_index") not in (None, ""):
+        allocations.append((_parse_positive_int(raw.get("month_index"), "month_index"),
+                            _parse_positive_int(raw.get("amount"), "amount")))
+
+    if allocations:
+        if any(amount <= 0 for _, amount in allocations):
+            raise ValueError("Сумма по месяцу должна быть > 0")
+        if any(month_index < 0 for month_index, _ in allocations):
+            raise ValueError("Некорректный month_index")
+        amount = sum(a for _, a in allocations)
+    else:
+        if raw.get("amount") in (None, ""):
+            raise ValueError("Укажите либо amount, либо allocations")
+        amount = _parse_positive_int(raw.get("amount"), "amount")
+
+    if amount <= 0:
+        raise ValueError("Сумма должна быть больше 0")
+    if amount > CASH_PAYMENT_MAX_AMOUNT:
+        raise ValueError(
+            f"Сумма платежа ({amount} ₽) превышает максимально допустимую ({CASH_PAYMENT_MAX_AMOUNT} ₽)"
+        )
+
+    idempotency_key = str(raw.get("idempotency_key") or "").strip() or None
+    return {
+        "deal_id": deal_id,
+        "amount": amount,
+        "allocations": allocations,
+        "payment_date": _parse_payment_date(raw.get("payment_date")),
+        "comment": str(raw.get("comment") or "").strip() or None,
+        "payment_id": f"cash_{idempotency_key}" if idempotency_key else None,
+    }
+
+
+def _payment_comment(allocations: List[Tuple[int, int]], comment: Optional[str]) -> Optional[str]:
+    """Комментарий платежа — краткое распределение по месяцам и комментарий, как при ручной отметке."""
+    alloc_summary = " | ".join(f"#{month_index + 1}:{amount}" for month_index, amount in allocations[:20])
+    if alloc_summary:
+        return (alloc_summary + (f" | {comment}" if comment else ""))[:500]
+    return comment[:500] if comment else None
+
+
+def _chunks(items: List[str], size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _validate(db, parsed: List[Tuple[int, Dict[str, Any]]]) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]], List[Dict[str, Any]], int]:
+    """
+    Проверяет все строки до записи.
+
+    Returns:
+        (платежи к записи, данные Bitrix24 для сделок, которых нет в БД, ошибки, число уже записанных платежей)
+    """
+    errors: List[Dict[str, Any]] = []
+    payments: List[Dict[str, Any]] = []
+    seen_payment_ids: Dict[str, int] = {}
+    for row_no, raw in parsed:
+        try:
+            payment = _normalize_row(raw)
+        except ValueError as e:
+            errors.append({"row": row_no, "deal_id": raw.get("deal_id"), "error": str(e)})
+            continue
+        payment["row"] = row_no
+        payment_id = payment["payment_id"]
+        if payment_id and payment_id in seen_payment_ids:
+            errors.append({
+                "row": row_no, "deal_id": payment["deal_id"],
+                "error": f"idempotency_key повторяется (строка {seen_payment_ids[payment_id]})",
+            })
+            continue
+        if payment_id:
+            seen_payment_ids[payment_id] = row_no
+        payments.append(payment)
+
+    # Платежи с ключом идемпотентности, которые уже записаны (повторная загрузка файла), пропускаем
+    existing = set()
+    for chunk in _chunks(list(seen_payment_ids), _IN_CHUNK):
+        existing.update(p for (p,) in db.query(PaymentLog.payment_id).filter(PaymentLog.payment_id.in_(chunk)))
+    skipped = sum(1 for p in payments if p["payment_id"] in existing)
+    payments = [p for p in payments if p["payment_id"] not in existing]
+
+    deal_ids = list(dict.fromkeys(p["deal_id"] for p in payments))
+    deals: Dict[str, Tuple[int, int]] = {}
+    for chunk in _chunks(deal_ids, _IN_CHUNK):
+        for deal_id, total, paid in db.query(Deal.deal_id, Deal.total_amount, Deal.paid_amount).filter(Deal.deal_id.in_(chunk)):
+            deals[str(deal_id)] = (int(total or 0), int(paid or 0))
+
+    # Сделок нет в БД — берём из Bitrix24 (одним batch на 25 сделок) и создадим при записи
+    new_deals: Dict[str, Dict[str, Any]] = {}
+    missing = [d for d in deal_ids if d not in deals]
+    if missing:
+        from bitrix.client import get_full_deals
+        from bitrix.parsing import parse_money_to_int, parse_int
+        try:
+            bitrix_deals = get_full_deals(missing)
+        except Exception as e:
+            logger.warning(f"Could not get deals from Bitrix24 for cash import: {e}")
+            bitrix_deals = {}
+        for deal_id in missing:
+            bitrix_deal = bitrix_deals.get(deal_id)
+            if not bitrix_deal:
+                continue
+            new_deals[deal_id] = {
+                "title": bitrix_deal.get("TITLE", ""),
+                "total_amount": parse_money_to_int(bitrix_deal.get("OPPORTUNITY")),
+                "term_months": parse_int(bitrix_deal.get("UF_TERM_MONTHS")),
+            }
+            deals[deal_id] = (new_deals[deal_id]["total_amount"], 0)
+
+    # Суммы по сделке проверяются вместе: все строки файла не должны превысить остаток
+    per_deal: Dict[str, int] = {}
+    for p in payments:
+        per_deal[p["deal_id"]] = per_deal.get(p["deal_id"], 0) + p["amount"]
+    deal_errors: Dict[str, str] = {}
+    for deal_id, amount in per_deal.items():
+        if deal_id not in deals:
+            deal_errors[deal_id] = "Рассрочка не найдена"
+            continue
+        total, paid = deals[deal_id]
+        remaining = total - paid
+        if total <= 0:
+            deal_errors[deal_id] = "У сделки не задана общая сумма (total_amount=0)"
+        elif remaining <= 0:
+            deal_errors[deal_id] = "Рассрочка уже полностью оплачена"
+        elif amount > remaining:
+            deal_errors[deal_id] = f"Сумма платежей по сделке в файле ({amount} ₽) превышает остаток ({remaining} ₽)"
+    for p in payments:
+        if p["deal_id"] in deal_errors:
+            errors.append({"row": p["row"], "deal_id": p["deal_id"], "error": deal_errors[p["deal_id"]]})
+
+    errors.sort(key=lambda e: e["row"])
+    return payments, new_deals, errors, skipped
+
+
+def _apply_deal_group(db, deal_ids: List[str], by_deal: Dict[str, List[Dict[str, Any]]],
+                      new_deals: Dict[str, Dict[str, Any]], created_by: Optional[str]) -> List[Dict[str, Any]]:
+    """Записывает платежи группы сделок в одной транзакции (строки сделок заблокированы до commit)."""
+    from models.cash_allocation import CashAllocation
+
+    locked = {
+        str(d.deal_id): d
+        for d in db.query(Deal).filter(Deal.deal_id.in_(deal_ids)).with_for_update().all()
+    }
+    for deal_id in deal_ids:
+        if deal_id not in locked and deal_id in new_deals:
+            deal = Deal(deal_id=deal_id, email=created_by, paid_amount=0, **new_deals[deal_id])
+            db.add(deal)
+            locked[deal_id] = deal
+    db.flush()
+
+    results = []
+    now = datetime.utcnow()
+    for deal_id in deal_ids:
+        deal = locked.get(deal_id)
+        payments = by_deal[deal_id]
+        amount = sum(p["amount"] for p in payments)
+        # Остаток перепроверяем под блокировкой — между проверкой и записью могла пройти другая оплата
+        if deal is None or amount > (deal.total_amount or 0) - (deal.paid_amount or 0):
+            raise ValueError(f"Остаток по сделке {deal_id} изменился во время импорта")
+        old_paid = int(deal.paid_amount or 0)
+        deal.paid_amount = old_paid + amount
+        for p in payments:
+            payment_id = p["payment_id"] or f"cash_{uuid.uuid4().hex[:16]}"
+            db.add(PaymentLog(
+                deal_id=deal_id,
+                payment_id=payment_id,
+                amount=p["amount"],
+                status="paid",
+                source="admin_cash",
+                comment=_payment_comment(p["allocations"], p["comment"]),
+                created_at=now,
+                payment_date=p["payment_date"] or now,
+            ))
+            for month_index, alloc_amount in p["allocations"]:
+                db.add(CashAllocation(deal_id=deal_id, payment_id=payment_id, month_index=month_index, amount=alloc_amount))
+        results.append({
+            "deal_id": deal_id,
+            "payments": len(payments),
+            "amount": amount,
+            "old_paid_amount": old_paid,
+            "new_paid_amount": int(deal.paid_amount),
+        })
+    db.commit()
+    return results
+
+
+def import_cash_payments(parsed: List[Tuple[int, Dict[str, Any]]], created_by: Optional[str] = None,
+                         dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Проверяет и записывает наличные оплаты из файла импорта.
+
+    Args:
+        parsed: Строки файла (parse_cash_import)
+        created_by: Идентификатор админа — записывается в email сделок, созданных из Bitrix24
+        dry_run: Только проверить, ничего не записывать
+
+    Returns:
+        {"success", "dry_run", "rows", "payments_created", "skipped_existing", "total_amount",
+         "deals": [{deal_id, payments, amount, old_paid_amount, new_paid_amount}], "errors": [...]}
+        Если errors не пуст на этапе проверки — ничего не записано.
+        Ошибки при записи (конкурентная оплата) откатывают только свою группу сделок.
+    """
+    from models.payment_log import SessionLocal
+
+    if len(parsed) > settings.CASH_IMPORT_MAX_ROWS:
+        raise ValueError(f"В файле {len(parsed)} строк, максимум {settings.CASH_IMPORT_MAX_ROWS}")
+
+    result: Dict[str, Any] = {
+        "success": False,
+        "dry_run": dry_run,
+        "rows": len(parsed),
+        "payments_created": 0,
+        "skipped_existing": 0,
+        "total_amount": 0,
+        "deals": [],
+        "errors": [],
+    }
+    db = SessionLocal()
+    try:
+        payments, new_deals, errors, skipped = _validate(db, parsed)
+        result["skipped_existing"] = skipped
+        if errors:
+            result["errors"] = errors
+            return result
+
+        by_deal: Dict[str, List[Dict[str, Any]]] = {}
+        for p in payments:
+            by_deal.setdefault(p["deal_id"], []).append(p)
+        if dry_run:
+            result["success"] = True
+            result["payments_created"] = len(payments)
+            result["total_amount"] = sum(p["amount"] for p in payments)
+            result["deals"] = [
+                {"deal_id": deal_id, "payments": len(items), "amount": sum(p["amount"] for p in items)}
+                for deal_id, items in by_deal.items()
+            ]
+            return result
+        db.rollback()  # закрываем читающую транзакцию до записи
+
+        # Сортировка — одинаковый порядок блокировок у параллельных импортов
+        deal_ids = sorted(by_deal)
+        for group in _chunks(deal_ids, max(1, settings.CASH_IMPORT_DEALS_PER_TRANSACTION)):
+            try:
+                result["deals"].extend(_apply_deal_group(db, group, by_deal, new_deals, created_by))
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Cash import: group of {len(group)} deals rolled back: {e}", exc_info=True)
+                for deal_id in group:
+                    for p in by_deal[deal_id]:
+                        result["errors"].append({"row": p["row"], "deal_id": deal_id, "error": f"Не записано: {e}"})
+    finally:
+        db.close()
+
+    applied = {d["deal_id"] for d in result["deals"]}
+    if applied:
+        from installments.service import invalidate_schedule_cache
+        from admin.deals_snapshot import invalidate_deals_snapshot
+        for deal_id in applied:
+            invalidate_schedule_cache(deal_id)
+        invalidate_deals_snapshot()
+
+    result["payments_created"] = sum(d["payments"] for d in result["deals"])
+    result["total_amount"] = sum(d["amount"] for d in result["deals"])
+    result["success"] = not result["errors"]
+    logger.info(
+        f"Cash import: {result['payments_created']} payments, {len(applied)} deals, "
+        f"{result['total_amount']} ₽, skipped {result['skipped_existing']}, errors {len(result['errors'])}"
+    )
+    return result
+
+
+def sync_cash_import_side_effects(result: Dict[str, Any], created_by: Optional[str] = None) -> None:
+    """
+    После импорта: оплаченные суммы в Bitrix24 (пакетно) и одно сводное уведомление в Telegram.
+    Не критично — данные уже в БД, ошибки только логируются.
+    """
+    deals = result.get("deals") or []
+    if not deals:
+        return
+    try:
+        from bitrix.client import update_paid_amounts
+        update_paid_amounts({d["deal_id"]: d["new_paid_amount"] for d in deals})
+    except Exception as e:
+        logger.warning(f"Error updating Bitrix24 after cash import: {e}")
+
+    try:
+        from notifications.telegram import send_telegram_notification, format_cash_import_notification
+        send_telegram_notification(format_cash_import_notification(
+            payments_count=result.get("payments_created", 0),
+            deals_count=len(deals),
+            total_amount=result.get("total_amount", 0),
+            admin=created_by,
+        ))
+    except Exception as e:
+        logger.warning(f"Failed to send Telegram notification for cash import: {e}")
@@ -0,0 +1,322 @@
+"""
+Пересборка таблицы deals из Bitrix24 без простоя (/api/admin/database/rebuild).
+
+В отличие от /api/admin/database/clear ничего не удаляется заранее: сделки загружаются из
+Bitrix24 (batch-запросами) в теневую таблицу deals_shadow в фоновом потоке, пока сервис
+работает с текущей таблицей. Затем одной короткой транзакцией изменения, сделанные за время
+сборки (оплаты, настройки), переносятся в теневую таблицу, и она подменяет deals
+переименованием. Журнал платежей (payment_logs, cash_allocations) не трогается. Строки сохраняют
+свои id, новые сделки из Bitrix24 получают id после всех существующих.
+
+Правила слияния — как в scripts/sync_bitrix_to_db.py: название, суммы, срок и взнос берутся
+из Bitrix24, оплаченная сумма — большая из локальной и Bitrix24, email — из Bitrix24, если он
+там есть; дата начала и день платежа графика — локальные. Сделки, которых нет в ответе
+Bitrix24, остаются как есть.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, MetaData, Table, bindparam, or_, select, text
+from sqlalchemy.schema import CreateIndex
+
+from models.deal import Deal, DEAL_LIST_INDEXES
+
+logger = logging.getLogger(__name__)
+
+SHADOW_TABLE = "deals_shadow"
+_OLD_TABLE = "deals_old"
+
+# Сделок на один вызов get_full_deals (внутри — batch-запросы по 25 сделок)
+_FETCH_CHUNK = 250
+_INSERT_CHUNK = 1000
+_SCHEDULE_CHUNK = 500
+# Запас по времени при поиске строк, изменённых во время сборки
+_CHANGED_MARGIN = timedelta(seconds=5)
+# Если из Bitrix24 не удалось получить больше этой доли сделок — пересборка отменяется
+_MAX_FETCH_FAILED_RATIO = 0.1
+
+_BITRIX_FIELDS = ("title", "email", "total_amount", "paid_amount", "initial_payment", "term_months")
+_SCHEDULE_FIELDS = ("total_amount", "term_months", "initial_payment", "schedule_start_date", "schedule_day")
+
+_STATE_LOCK = threading.Lock()
+_state: Dict[str, Any] = {"status": "idle"}
+_rebuild_thread: Optional[threading.Thread] = None
+
+
+def _shadow_table() -> Table:
+    """Теневая таблица со столбцами deals, без вторичных индексов (они создаются при подмене)."""
+    columns = [
+        Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+        for c in Deal.__table__.columns
+    ]
+    return Table(SHADOW_TABLE, MetaData(), *columns)
+
+
+def _bitrix_values(deal_id: str, full_deal: Dict[str, Any], listed_deal: Dict[str, Any]) -> Dict[str, Any]:
+    from bitrix.parsing import parse_money_to_int, parse_int
+
+    return {
+        "deal_id": deal_id,
+        "title": full_deal.get("TITLE") or listed_deal.get("TITLE") or "",
+        "email": full_deal.get("CONTACT_EMAIL") or "",
+        "total_amount": parse_money_to_int(full_deal.get("OPPORTUNITY")),
+        "paid_amount": parse_money_to_int(full_deal.get("UF_PAID_AMOUNT")),
+        "initial_payment": parse_money_to_int(full_deal.get("UF_INITIAL_PAYMENT")) or 0,
+        "term_months": parse_int(full_deal.get("UF_TERM_MONTHS")),
+    }
+
+
+def _merged_row(live: Optional[Dict[str, Any]], bitrix: Optional[Dict[str, Any]], now: datetime) -> Dict[str, Any]:
+    """Строка новой таблицы из текущей строки deals и данных Bitrix24 (любое из двух может отсутствовать)."""
+    if live is None:
+        return {**bitrix, "schedule_start_date": None, "schedule_day": 10, "created_at": now, "updated_at": now}
+    # id сохраняется: открытые сессии, запросы в процессе подмены и курсоры списка (sort, id)
+    # должны указывать на ту же сделку
+    row = dict(live)
+    if bitrix is None:
+        return row
+    row.update(
+        title=bitrix["title"],
+        email=bitrix["email"] or live.get("email"),
+        total_amount=bitrix["total_amount"],
+        term_months=bitrix["term_months"],
+        initial_payment=bitrix["initial_payment"],
+        # Оплаты записаны в локальный журнал — оплаченная сумма не уменьшается
+        paid_amount=max(int(live.get("paid_amount") or 0), bitrix["paid_amount"]),
+    )
+    if any(row[k] != live.get(k) for k in _BITRIX_FIELDS):
+        row["updated_at"] = now
+    return row
+
+
+def _schedule_changed(live: Optional[Dict[str, Any]], row: Dict[str, Any]) -> bool:
+    if live is None:
+        return row.get("schedule_start_date") is not None
+    return any(live.get(k) != row.get(k) for k in _SCHEDULE_FIELDS)
+
+
+def _set_state(**values) -> None:
+    with _STATE_LOCK:
+        _state.update(values)
+
+
+def rebuild_deals_from_bitrix(progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """
+    Собирает deals из Bitrix24 в теневой таблице и подменяет ею текущую.
+
+    Args:
+        progress: Вызывается с ключевыми словами phase/fetched/total по ходу сборки
+
+    Returns:
+        Статистика: сколько сделок в новой таблице, получено из Bitrix24, создано, обновлено и т.д.
+
+    Raises:
+        RuntimeError: Bitrix24 не вернул сделок, не отдал страницу списка или не удалось
+                      получить слишком многие сделки (текущая таблица в этом случае не меняется)
+        requests.RequestException: ошибка сети при получении списка сделок
+    """
+    from bitrix.client import get_all_installment_deals_paged, get_full_deals
+    from installments.service import regenerate_installment_schedules
+    from models.payment_log import engine
+
+    progress = progress or (lambda **kwargs: None)
+    started = time.perf_counter()
+
+    progress(phase="fetching", fetched=0, total=None)
+    # Весь список постранично; ошибка на любой странице прерывает пересборку (неполный список
+    # оставил бы часть сделок без обновления)
+    listed = {str(d.get("ID")): d for d in get_all_installment_deals_paged() if d.get("ID")}
+    if not listed:
+        raise RuntimeError("Bitrix24 не вернул ни одной сделки с рассрочкой — пересборка отменена, таблица deals не изменена")
+    deal_ids = list(listed)
+    full_deals: Dict[str, Dict[str, Any]] = {}
+    for start in range(0, len(deal_ids), _FETCH_CHUNK):
+        full_deals.update(get_full_deals(deal_ids[start:start + _FETCH_CHUNK], use_cache=False))
+        progress(phase="fetching", fetched=len(full_deals), total=len(deal_ids))
+    fetch_failed = len(deal_ids) - len(full_deals)
+    if fetch_failed > len(deal_ids) * _MAX_FETCH_FAILED_RATIO:
+        raise RuntimeError(
+            f"Не удалось получить из Bitrix24 {fetch_failed} из {len(deal_ids)} сделок — "
+            f"пересборка отменена, таблица deals не изменена"
+        )
+    bitrix = {deal_id: _bitrix_values(deal_id, deal, listed[deal_id]) for deal_id, deal in full_deals.items()}
+
+    # Сборка теневой таблицы — без блокировок deals, сервис продолжает работать
+    progress(phase="loading")
+    shadow = _shadow_table()
+    deals_table = Deal.__table__
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {SHADOW_TABLE}"))
+        shadow.create(conn)
+    snapshot_at = datetime.utcnow()
+    since = snapshot_at - _CHANGED_MARGIN
+    with engine.connect() as conn:
+        live = {str(r["deal_id"]): dict(r) for r in conn.execute(select(deals_table)).mappings()}
+
+    rows: List[Dict[str, Any]] = []
+    # Новые сделки из Bitrix24 получают id при подмене, после всех строк с сохранёнными id
+    new_rows: Dict[str, Dict[str, Any]] = {}
+    reschedule: Dict[str, Dict[str, Any]] = {}
+    updated = 0
+    for deal_id in list(dict.fromkeys(list(live) + list(bitrix))):
+        live_row = live.get(deal_id)
+        row = _merged_row(live_row, bitrix.get(deal_id), snapshot_at)
+        if live_row is None:
+            new_rows[deal_id] = row
+            continue
+        rows.append(row)
+        if row.get("updated_at") != live_row.get("updated_at"):
+            updated += 1
+        if _schedule_changed(live_row, row):
+            reschedule[deal_id] = row
+    with engine.begin() as conn:
+        for start in range(0, len(rows), _INSERT_CHUNK):
+            conn.execute(shadow.insert(), rows[start:start + _INSERT_CHUNK])
+
+    # Подмена одной транзакцией: строки, изменённые во время сборки, переносим заново, затем переименование
+    progress(phase="swapping")
+    swap_started = time.perf_counter()
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Запись в deals ждёт конца подмены, чтение идёт до переименования
+            conn.execute(text("LOCK TABLE deals IN EXCLUSIVE MODE"))
+        else:
+            # SQLite: блокировку на запись берёт первая записывающая команда — до чтения изменений
+            conn.execute(text(f"DELETE FROM {SHADOW_TABLE} WHERE 1 = 0"))
+
+        changed = [
+            dict(r) for r in conn.execute(
+                select(deals_table).where(or_(deals_table.c.updated_at >= since, deals_table.c.created_at >= since))
+            ).mappings()
+        ]
+        shadow_ids = {str(deal_id) for (deal_id,) in conn.execute(select(shadow.c.deal_id))}
+        to_update, to_insert = [], []
+        for live_row in changed:
+            deal_id = str(live_row["deal_id"])
+            row = _merged_row(live_row, bitrix.get(deal_id), datetime.utcnow())
+            # График в БД сейчас соответствует текущей строке (настройки перестраивают его сами)
+            if _schedule_changed(live_row, row):
+                reschedule[deal_id] = row
+            else:
+                reschedule.pop(deal_id, None)
+            new_rows.pop(deal_id, None)
+            if deal_id in shadow_ids:
+                to_update.append({f"b_{k}": v for k, v in row.items()})
+            else:
+                to_insert.append(row)
+        if to_update:
+            columns = [c.name for c in shadow.columns]
+            conn.execute(
+                shadow.update()
+                .where(shadow.c.deal_id == bindparam("b_deal_id"))
+                .values({c: bindparam(f"b_{c}") for c in columns if c != "deal_id"}),
+                to_update,
+            )
+        if to_insert:
+            conn.execute(shadow.insert(), to_insert)
+        if conn.dialect.name == "postgresql":
+            # Строки вставлены с явными id — последовательность теневой таблицы (после переименования —
+            # последовательность deals) продвигаем за max(id), иначе новые сделки получат занятые id
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{SHADOW_TABLE}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {SHADOW_TABLE}), false)"
+            ))
+        if new_rows:
+            conn.execute(shadow.insert(), list(new_rows.values()))
+
+        conn.execute(text(f"DROP TABLE IF EXISTS {_OLD_TABLE}"))
+        conn.execute(text(f"ALTER TABLE deals RENAME TO {_OLD_TABLE}"))
+        conn.execute(text(f"ALTER TABLE {SHADOW_TABLE} RENAME TO deals"))
+        conn.execute(text(f"DROP TABLE {_OLD_TABLE}"))
+        for index in list(deals_table.indexes) + list(DEAL_LIST_INDEXES):
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+    swap_ms = (time.perf_counter() - swap_started) * 1000
+
+    # Графики сделок, у которых изменились сумма, срок или взнос, — после подмены, пачками
+    # в отдельных транзакциях, чтобы не держать блокировку подмены
+    progress(phase="schedules")
+    from models.payment_log import SessionLocal
+    months = 0
+    reschedule_ids = list(reschedule)
+    for start in range(0, len(reschedule_ids), _SCHEDULE_CHUNK):
+        db = SessionLocal()
+        try:
+            # Текущие строки, а не собранные: сделку могли изменить уже после подмены
+            chunk = db.query(Deal).filter(Deal.deal_id.in_(reschedule_ids[start:start + _SCHEDULE_CHUNK])).all()
+            months += regenerate_installment_schedules(db, chunk)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    from installments.service import invalidate_schedule_cache
+    from admin.deals_snapshot import invalidate_deals_snapshot
+    invalidate_schedule_cache()
+    invalidate_deals_snapshot()
+
+    result = {
+        "deals": len(rows) + len(to_insert) + len(new_rows),
+        "from_bitrix": len(bitrix),
+        "created": len(new_rows) + len(to_insert),
+        "updated": updated,
+        "kept_local": len([d for d in live if d not in bitrix]),
+        "fetch_failed": fetch_failed,
+        "changed_during_rebuild": len(changed),
+        "schedules_regenerated": len(reschedule),
+        "schedule_months": months,
+        "swap_ms": round(swap_ms, 1),
+        "duration_seconds": round(time.perf_counter() - started, 2),
+    }
+    logger.info(f"Пересборка deals из Bitrix24 завершена: {result}")
+    return result
+
+
+def _run_rebuild() -> None:
+    try:
+        result = rebuild_deals_from_bitrix(progress=_set_state)
+        _set_state(status="done", phase=None, result=result, finished_at=datetime.utcnow().isoformat())
+    except Exception as e:
+        logger.error(f"Пересборка deals из Bitrix24 не удалась: {e}", exc_info=True)
+        _set_state(status="failed", error=str(e), finished_at=datetime.utcnow().isoformat())
+        try:
+            from models.payment_log import engine
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {SHADOW_TABLE}"))
+        except Exception as cleanup_error:
+            logger.warning(f"Не удалось удалить {SHADOW_TABLE}: {cleanup_error}")
+
+
+def start_deals_rebuild(started_by: Optional[str] = None) -> Tuple[bool, Dict[str, Any]]:
+    """
+    Запускает пересборку в фоновом потоке (одновременно — только одна).
+
+    Returns:
+        (запущена ли новая пересборка, текущее состояние)
+    """
+    global _rebuild_thread
+    with _STATE_LOCK:
+        if _state.get("status") == "running":
+            return False, dict(_state)
+        _state.clear()
+        _state.update(
+            status="running",
+            phase="fetching",
+            started_at=datetime.utcnow().isoformat(),
+            started_by=started_by,
+        )
+        _rebuild_thread = threading.Thread(target=_run_rebuild, name="deals-rebuild", daemon=True)
+        _rebuild_thread.start()
+        return True, dict(_state)
+
+
+def get_deals_rebuild_status() -> Dict[str, Any]:
+    """Состояние последней пересборки: status (idle/running/done/failed), phase, fetched/total, result или error."""
+    with _STATE_LOCK:
+        return dict(_state)
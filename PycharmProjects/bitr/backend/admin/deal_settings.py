@@ -0,0 +1,255 @@
+"""
+Настройки рассрочки (срок, сумма, взнос, день платежа, email, название) — одна сделка
+(PUT /api/admin/deals/{deal_id}/settings) и пакетно (PUT /api/admin/deals/settings).
+
+Пакетное обновление: сделки из БД — одним запросом, отсутствующие — одним batch-запросом
+к Bitrix24, все изменения — в одной транзакции, графики затронутых сделок перестраиваются
+за один проход (regenerate_installment_schedules).
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from core.config import settings
+from models.deal import Deal
+from bitrix.parsing import parse_int, parse_money_to_int
+
+logger = logging.getLogger(__name__)
+
+MAX_TERM_MONTHS = 120
+
+# Поля, от которых зависит сохранённый график платежей
+SCHEDULE_FIELDS = ("total_amount", "term_months", "initial_payment", "schedule_day")
+
+
+def deal_from_bitrix(deal_id: str, bitrix_deal: Dict[str, Any], email: Optional[str] = None) -> Deal:
+    """Локальная запись сделки по данным Bitrix24 (ещё не добавлена в сессию)."""
+    return Deal(
+        deal_id=str(deal_id),
+        title=str(bitrix_deal.get("TITLE") or ""),
+        email=(email or None),
+        total_amount=parse_money_to_int(bitrix_deal.get("OPPORTUNITY")),
+        paid_amount=parse_money_to_int(bitrix_deal.get("UF_PAID_AMOUNT")),
+        initial_payment=0,
+        term_months=parse_int(bitrix_deal.get("UF_TERM_MONTHS")),
+    )
+
+
+def _validate_settings(db_deal: Deal, request) -> None:
+    """Проверяет все поля до изменения сделки — при ошибке сделка остаётся нетронутой."""
+    if request.total_amount is not None:
+        if request.total_amount < 0:
+            raise ValueError("Общая сумма не может быть отрицательной")
+        # Не позволяем уменьшать общую сумму меньше чем уже оплачено
+        if request.total_amount < (db_deal.paid_amount or 0):
+            raise ValueError(
+                f"Общая сумма ({request.total_amount} ₽) не может быть меньше уже оплаченной суммы ({db_deal.paid_amount} ₽)"
+            )
+
+    if request.term_months is not None:
+        if request.term_months < 0:
+            raise ValueError("Срок не может быть отрицательным")
+        if request.term_months > MAX_TERM_MONTHS:
+            raise ValueError(f"Срок не может превышать {MAX_TERM_MONTHS} месяцев")
+
+    if request.initial_payment is not None:
+        if request.initial_payment < 0:
+            raise ValueError("Первоначальный взнос не может быть отрицательным")
+        # Если задана общая сумма (или уже есть в БД) — не даём ставить взнос больше total
+        total_for_check = request.total_amount if request.total_amount is not None else (db_deal.total_amount or 0)
+        if total_for_check > 0 and request.initial_payment > total_for_check:
+            raise ValueError(
+                f"Первоначальный взнос ({request.initial_payment} ₽) не может быть больше общей суммы ({total_for_check} ₽)"
+            )
+
+    if request.schedule_day is not None and (request.schedule_day < 1 or request.schedule_day > 31):
+        raise ValueError("День платежа должен быть от 1 до 31")
+
+    if request.email:
+        from core.security import validate_email
+        if not validate_email(request.email):
+            raise ValueError("Некорректный email адрес")
+
+    if all(getattr(request, field) is None for field in SCHEDULE_FIELDS + ("email", "title")):
+        raise ValueError("Не указаны поля для обновления")
+
+
+def apply_deal_settings(db_deal: Deal, request) -> List[str]:
+    """
+    Проверяет и применяет настройки к сделке (без commit и без перестройки графика).
+
+    Args:
+        db_deal: Сделка из БД
+        request: Объект с полями total_amount, term_months, initial_payment, schedule_day, email, title
+                 (None — поле не меняется)
+
+    Returns:
+        Список изменённых полей для лога ("term_months=12", ...)
+
+    Raises:
+        ValueError: некорректное значение (сделка не изменена)
+    """
+    _validate_settings(db_deal, request)
+
+    updated_fields = []
+    prev_term_months = int(getattr(db_deal, "term_months", 0) or 0)
+
+    if request.total_amount is not None:
+        db_deal.total_amount = request.total_amount
+        updated_fields.append(f"total_amount={request.total_amount}")
+
+    if request.term_months is not None:
+        db_deal.term_months = request.term_months
+        updated_fields.append(f"term_months={request.term_months}")
+        # Если график создаётся впервые (term 0 -> >0) или база графика ещё не фиксировалась — фиксируем сейчас.
+        if request.term_months > 0 and (
+            prev_term_months <= 0 or getattr(db_deal, "schedule_start_date", None) is None
+        ):
+            if getattr(db_deal, "schedule_start_date", None) is None:
+                db_deal.schedule_start_date = datetime.utcnow()
+            if getattr(db_deal, "schedule_day", None) in (None, 0):
+                db_deal.schedule_day = 10
+            updated_fields.append("schedule_start_date=now")
+        # Если срок сбрасывается в 0, очищаем schedule_start_date и schedule_day
+        elif request.term_months == 0:
+            db_deal.schedule_start_date = None
+            db_deal.schedule_day = None
+
+    # Первоначальный взнос: параметр расчёта графика (installment_amount = total_amount - initial_payment).
+    # ВАЖНО: initial_payment НЕ является фактом оплаты и НЕ должен менять paid_amount автоматически.
+    if request.initial_payment is not None:
+        db_deal.initial_payment = int(request.initial_payment)
+        updated_fields.append(f"initial_payment={int(request.initial_payment)}")
+
+    if request.schedule_day is not None:
+        db_deal.schedule_day = int(request.schedule_day)
+        updated_fields.append(f"schedule_day={request.schedule_day}")
+
+    if request.email is not None:
+        db_deal.email = request.email or None
+        updated_fields.append(f"email={request.email}")
+
+    if request.title is not None:
+        db_deal.title = request.title or ""
+        updated_fields.append(f"title={request.title}")
+
+    return updated_fields
+
+
+def changes_schedule(request) -> bool:
+    """Изменились параметры графика — сохранённый график нужно перестроить."""
+    return any(getattr(request, field) is not None for field in SCHEDULE_FIELDS)
+
+
+def deal_settings_summary(db_deal: Deal) -> Dict[str, Any]:
+    return {
+        "deal_id": db_deal.deal_id,
+        "title": db_deal.title,
+        "email": db_deal.email,
+        "total_amount": db_deal.total_amount,
+        "paid_amount": db_deal.paid_amount,
+        "initial_payment": getattr(db_deal, "initial_payment", 0) or 0,
+        "term_months": db_deal.term_months,
+    }
+
+
+def update_deals_settings(db, updates: list, atomic: bool = False) -> Dict[str, Any]:
+    """
+    Пакетное обновление настроек сделок в одной транзакции.
+
+    Args:
+        db: Сессия БД
+        updates: Объекты с deal_id и полями настроек (как в apply_deal_settings)
+        atomic: Если хотя бы одна строка не прошла проверку — не записывать ничего
+
+    Returns:
+        {"success", "applied", "updated", "failed", "schedules_regenerated",
+         "results": [{"deal_id", "success", "updated_fields" | "error", "deal"}]}
+        Результаты — в порядке строк запроса.
+
+    Raises:
+        ValueError: строк больше DEAL_SETTINGS_BULK_MAX_ROWS
+    """
+    from installments.service import regenerate_installment_schedules
+
+    if len(updates) > settings.DEAL_SETTINGS_BULK_MAX_ROWS:
+        raise ValueError(f"В запросе {len(updates)} сделок, максимум {settings.DEAL_SETTINGS_BULK_MAX_ROWS}")
+
+    deal_ids = list(dict.fromkeys(str(u.deal_id).strip() for u in updates if str(u.deal_id or "").strip()))
+    deals: Dict[str, Deal] = {}
+    for start in range(0, len(deal_ids), 500):
+        for db_deal in db.query(Deal).filter(Deal.deal_id.in_(deal_ids[start:start + 500])):
+            deals[str(db_deal.deal_id)] = db_deal
+
+    # Сделок нет в БД — создаём из Bitrix24, как при обновлении одной сделки (одним batch на 25 сделок)
+    missing = [d for d in deal_ids if d not in deals]
+    bitrix_deals: Dict[str, Dict[str, Any]] = {}
+    if missing:
+        try:
+            from bitrix.client import get_full_deals
+            bitrix_deals = get_full_deals(missing)
+        except Exception as e:
+            logger.warning(f"Could not get deals {missing[:10]} from Bitrix24 to create local records: {e}")
+
+    results: List[Dict[str, Any]] = []
+    seen = set()
+    changed: Dict[str, Deal] = {}
+    reschedule: Dict[str, Deal] = {}
+    for u in updates:
+        deal_id = str(u.deal_id or "").strip()
+        try:
+            if not deal_id:
+                raise ValueError("Не указан deal_id")
+            if deal_id in seen:
+                raise ValueError("Сделка повторяется в запросе")
+            seen.add(deal_id)
+            db_deal = deals.get(deal_id)
+            is_new = db_deal is None
+            if is_new:
+                if deal_id not in bitrix_deals:
+                    raise ValueError("Рассрочка не найдена")
+                db_deal = deal_from_bitrix(deal_id, bitrix_deals[deal_id], u.email)
+            updated_fields = apply_deal_settings(db_deal, u)
+        except ValueError as e:
+            results.append({"deal_id": deal_id, "success": False, "error": str(e)})
+            continue
+        if is_new:
+            db.add(db_deal)
+        changed[deal_id] = db_deal
+        if changes_schedule(u):
+            reschedule[deal_id] = db_deal
+        results.append({"deal_id": deal_id, "success": True, "updated_fields": updated_fields})
+
+    failed = sum(1 for r in results if not r["success"])
+    result: Dict[str, Any] = {
+        "success": failed == 0,
+        "applied": False,
+        "updated": 0,
+        "failed": failed,
+        "schedules_regenerated": 0,
+        "results": results,
+    }
+    if not changed or (atomic and failed):
+        db.rollback()
+        return result
+
+    db.flush()
+    regenerate_installment_schedules(db, list(reschedule.values()))
+    db.commit()
+
+    from installments.service import invalidate_schedule_cache
+    from admin.deals_snapshot import invalidate_deals_snapshot
+    for deal_id in changed:
+        invalidate_schedule_cache(deal_id)
+    invalidate_deals_snapshot()
+
+    for r in results:
+        if r["success"]:
+            r["deal"] = deal_settings_summary(changed[r["deal_id"]])
+    result.update(applied=True, updated=len(changed), schedules_regenerated=len(reschedule))
+    logger.info(
+        f"Bulk settings update: {len(changed)} deals updated, {failed} failed, "
+        f"{len(reschedule)} schedules regenerated"
+    )
+    return result
@@ -0,0 +1,274 @@
+"""
+Постраничный список сделок для админки (/api/admin/deals?limit=...).
+
+Список, фильтры, поиск и сортировка берутся из локальной копии сделок (таблица deals) —
+стоимость запроса не зависит от размера портфеля. Bitrix24 запрашивается только для
+строк текущей страницы (одним batch-запросом через get_full_deals), просрочка — по
+сохранённому графику (installment_schedule) тоже только для этих строк.
+"""
+
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, case, func, not_, or_, select
+from sqlalchemy.orm import Session
+
+from models.deal import Deal
+
+logger = logging.getLogger(__name__)
+
+DEALS_PAGE_DEFAULT_LIMIT = 50
+DEALS_PAGE_MAX_LIMIT = 500
+DEALS_DEFAULT_SORT = "-created_at"
+
+DEAL_STATUSES = ("paid", "active", "pending", "overdue")
+
+_TOTAL = func.coalesce(Deal.total_amount, 0)
+_PAID = func.coalesce(Deal.paid_amount, 0)
+_INITIAL = func.coalesce(Deal.initial_payment, 0)
+
+# Ключи сортировки — те же выражения, что в индексах models.deal.DEAL_LIST_INDEXES
+_SORT_KEYS = {
+    "created_at": Deal.created_at,
+    "total_amount": _TOTAL,
+    "paid_amount": _PAID,
+    "remaining_amount": _TOTAL - _PAID,
+    "title": func.coalesce(Deal.title, ""),
+}
+
+
+def _parse_sort(sort: Optional[str]) -> Tuple[str, bool]:
+    """'-created_at' → ('created_at', True): имя ключа и сортировка по убыванию."""
+    sort = (sort or DEALS_DEFAULT_SORT).strip()
+    descending = sort.startswith("-")
+    key = sort.lstrip("-+")
+    if key not in _SORT_KEYS:
+        raise ValueError(f"Неизвестная сортировка '{key}'. Допустимо: {', '.join(_SORT_KEYS)} (с '-' — по убыванию)")
+    return key, descending
+
+
+def encode_deals_cursor(sort: str, value, row_id: int) -> str:
+    """Курсор keyset-пагинации по (ключ сортировки, id); сортировка записана в курсор."""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, int(row_id)], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_deals_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    """
+    Разбирает курсор пагинации
+
+    Raises:
+        ValueError: если курсор некорректный или выдан для другой сортировки
+    """
+    try:
+        cursor_sort, value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        row_id = int(row_id)
+    except Exception:
+        raise ValueError("Некорректный курсор пагинации")
+    if cursor_sort != sort:
+        raise ValueError("Курсор выдан для другой сортировки — начните с первой страницы")
+    if sort.lstrip("-+") == "created_at":
+        value = datetime.fromisoformat(value)
+    return value, row_id
+
+
+def _split_filter(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    return [v.strip() for v in str(value).split(",") if v.strip()]
+
+
+def _status_condition(statuses: List[str]):
+    """Условие на статус сделки — по тем же правилам, что строки списка (_deal_status)."""
+    unknown = [s for s in statuses if s not in DEAL_STATUSES]
+    if unknown:
+        raise ValueError(f"Неизвестный статус '{unknown[0]}'. Допустимо: {', '.join(DEAL_STATUSES)}")
+
+    is_paid = and_(_TOTAL > 0, _PAID >= _TOTAL)
+    conditions = []
+    if "paid" in statuses:
+        conditions.append(is_paid)
+    if set(statuses) & {"active", "pending", "overdue"}:
+        from installments.reports import overdue_by_deal
+        overdue_ids = select(overdue_by_deal().subquery().c.deal_id)
+        is_overdue = and_(not_(is_paid), Deal.deal_id.in_(overdue_ids))
+        if "overdue" in statuses:
+            conditions.append(is_overdue)
+        if "active" in statuses:
+            conditions.append(and_(not_(is_paid), not_(is_overdue), or_(_PAID > 0, _TOTAL <= 0)))
+        if "pending" in statuses:
+            conditions.append(and_(not_(is_paid), not_(is_overdue), _PAID <= 0, _TOTAL > 0))
+    return or_(*conditions)
+
+
+def apply_deal_filters(query, q: Optional[str] = None, status: Optional[str] = None,
+                       only_installments: bool = False):
+    """
+    Применяет фильтры к запросу по deals.
+
+    - q: подстрока в названии, email/телефоне или ID сделки (без учёта регистра)
+    - status: paid / active / pending / overdue, одно значение или несколько через запятую
+    - only_installments: только сделки с суммой рассрочки (total_amount - initial_payment) > 0
+    """
+    q = (q or "").strip()
+    if q:
+        pattern = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        query = query.filter(or_(
+            Deal.title.ilike(pattern, escape="\\"),
+            Deal.email.ilike(pattern, escape="\\"),
+            Deal.deal_id.like(pattern, escape="\\"),
+        ))
+    statuses = _split_filter(status)
+    if statuses:
+        query = query.filter(_status_condition(statuses))
+    if only_installments:
+        query = query.filter(_TOTAL > _INITIAL)
+    return query
+
+
+def _deal_status(total_amount: int, paid_amount: int, overdue_amount: int) -> str:
+    if total_amount > 0 and paid_amount >= total_amount:
+        return "paid"
+    if overdue_amount > 0:
+        return "overdue"
+    if paid_amount > 0:
+        return "active"
+    if total_amount > 0:
+        return "pending"
+    return "active"  # Если сумма неизвестна, считаем активной
+
+
+def _deal_row(deal: Deal, bitrix_deal: Optional[dict], overdue: Tuple[int, int]) -> Dict[str, Any]:
+    bitrix_deal = bitrix_deal or {}
+    total_amount = int(deal.total_amount or 0)
+    paid_amount = int(deal.paid_amount or 0)
+    overdue_amount, overdue_months = overdue
+    return {
+        "deal_id": deal.deal_id,
+        "title": deal.title or bitrix_deal.get("TITLE") or "",
+        "email": deal.email,
+        "total_amount": total_amount,
+        "paid_amount": paid_amount,
+        "initial_payment": int(deal.initial_payment or 0),
+        "remaining_amount": max(0, total_amount - paid_amount),
+        "term_months": int(deal.term_months or 0),
+        "status": _deal_status(total_amount, paid_amount, overdue_amount),
+        "overdue_amount": overdue_amount,
+        "overdue_months": overdue_months,
+        "created_at": deal.created_at.isoformat() if deal.created_at else None,
+        # Дополнительные поля из Bitrix24 (None, если Bitrix24 не запрашивался или недоступен)
+        "contact_id": bitrix_deal.get("CONTACT_ID"),
+        "assigned_by_id": bitrix_deal.get("ASSIGNED_BY_ID"),
+        "stage_id": bitrix_deal.get("STAGE_ID"),
+        "date_create": bitrix_deal.get("DATE_CREATE"),
+        "date_modify": bitrix_deal.get("DATE_MODIFY"),
+        "begindate": bitrix_deal.get("BEGINDATE"),
+        "closedate": bitrix_deal.get("CLOSEDATE"),
+        "currency_id": bitrix_deal.get("CURRENCY_ID", "RUB"),
+        "comments": bitrix_deal.get("COMMENTS"),
+        "source_id": bitrix_deal.get("SOURCE_ID"),
+        "company_id": bitrix_deal.get("COMPANY_ID"),
+        "category_id": bitrix_deal.get("CATEGORY_ID"),
+    }
+
+
+def _deals_totals(query) -> Dict[str, int]:
+    """Итоги по отфильтрованному набору — одним агрегатом. Метрики рассрочки — как на дашборде админки."""
+    installment_amount = _TOTAL - _INITIAL
+    is_installment = and_(installment_amount > 0, func.coalesce(Deal.term_months, 0) > 0)
+    paid_installment = case((_PAID <= 0, 0), (_PAID >= installment_amount, installment_amount), else_=_PAID)
+    row = query.with_entities(
+        func.count(Deal.id),
+        func.count(case((is_installment, 1))),
+        func.coalesce(func.sum(case((is_installment, installment_amount), else_=0)), 0),
+        func.coalesce(func.sum(case((is_installment, paid_installment), else_=0)), 0),
+    ).one()
+    count, installments_count, installment_total, installment_paid = (int(v or 0) for v in row)
+    return {
+        "count": count,
+        "installments_count": installments_count,
+        "installment_total": installment_total,
+        "installment_paid": installment_paid,
+        "installment_remaining": installment_total - installment_paid,
+    }
+
+
+def list_deals_page(
+    db: Session,
+    cursor: Optional[str] = None,
+    limit: int = DEALS_PAGE_DEFAULT_LIMIT,
+    sort: Optional[str] = None,
+    q: Optional[str] = None,
+    status: Optional[str] = None,
+    only_installments: bool = False,
+    enrich: bool = True,
+    include_totals: bool = True,
+) -> Dict[str, Any]:
+    """
+    Страница списка сделок из локальной БД.
+
+    Args:
+        db: Сессия БД
+        cursor: Курсор следующей страницы (из next_cursor предыдущего ответа)
+        limit: Размер страницы (не больше DEALS_PAGE_MAX_LIMIT)
+        sort: Ключ сортировки (created_at, total_amount, paid_amount, remaining_amount, title), '-' — по убыванию
+        q, status, only_installments: Фильтры (см. apply_deal_filters)
+        enrich: Дополнить строки страницы данными из Bitrix24 (стадия, контакт, даты)
+        include_totals: Посчитать итоги по всему отфильтрованному набору
+
+    Returns:
+        {"items": [...], "next_cursor": str | None, "has_more": bool, "sort": str, "totals": {...} | None}
+
+    Raises:
+        ValueError: некорректные курсор, сортировка или статус
+    """
+    limit = max(1, min(int(limit or DEALS_PAGE_DEFAULT_LIMIT), DEALS_PAGE_MAX_LIMIT))
+    sort_key, descending = _parse_sort(sort)
+    sort_name = f"-{sort_key}" if descending else sort_key
+    sort_expr = _SORT_KEYS[sort_key]
+
+    filtered = apply_deal_filters(db.query(Deal), q=q, status=status, only_installments=only_installments)
+
+    query = filtered
+    if cursor:
+        value, row_id = decode_deals_cursor(cursor, sort_name)
+        if descending:
+            query = query.filter(or_(sort_expr < value, and_(sort_expr == value, Deal.id < row_id)))
+        else:
+            query = query.filter(or_(sort_expr > value, and_(sort_expr == value, Deal.id > row_id)))
+    order = (sort_expr.desc(), Deal.id.desc()) if descending else (sort_expr.asc(), Deal.id.asc())
+    rows = query.add_columns(sort_expr.label("sort_value")).order_by(*order).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_deals_cursor(sort_name, rows[-1].sort_value, rows[-1][0].id) if has_more and rows else None
+    deals = [row[0] for row in rows]
+    deal_ids = [d.deal_id for d in deals]
+
+    overdue = {}
+    if deal_ids:
+        from installments.reports import overdue_by_deal
+        for row in db.execute(overdue_by_deal(deal_ids=deal_ids)).all():
+            overdue[str(row.deal_id)] = (int(row.overdue_amount or 0), int(row.overdue_months or 0))
+
+    bitrix_deals = {}
+    if enrich and deal_ids:
+        try:
+            from bitrix.client import get_full_deals
+            bitrix_deals = get_full_deals(deal_ids)
+        except Exception as e:
+            # Данные Bitrix24 — дополнительные, страницу отдаём и без них
+            logger.warning(f"Не удалось получить данные Bitrix24 для страницы списка сделок: {e}")
+
+    return {
+        "items": [_deal_row(d, bitrix_deals.get(str(d.deal_id)), overdue.get(str(d.deal_id), (0, 0))) for d in deals],
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+        "sort": sort_name,
+        "totals": _deals_totals(filtered) if include_totals else None,
+    }
@@ -0,0 +1,293 @@
+"""
+Снимок объединённого списка сделок (Bitrix24 + локальная БД) для /api/admin/deals без параметров.
+
+Объединение — полный список рассрочек из Bitrix24, все сделки БД и расчёт просрочки по портфелю —
+дорогое, а раньше выполнялось на каждое открытие списка каждым админом. Теперь список строится
+в фоновом потоке (раз в ADMIN_DEALS_SNAPSHOT_INTERVAL_SECONDS и после записи платежей/настроек)
+и читается из памяти без обращения к Bitrix24.
+
+Запись (invalidate_deals_snapshot) помечает снимок устаревшим — stale_since — и будит поток;
+после пересборки метка снимается. Неудачная сборка (в том числе пустой список из Bitrix24 вместо
+непустого снимка) оставляет прежний снимок с отметкой stale_since. Читатель всегда сразу получает последний готовый снимок
+вместе с built_at / stale_since. Только самый первый запрос после старта ждёт сборки.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.deal import Deal
+from bitrix.parsing import parse_int, parse_money_to_int
+
+logger = logging.getLogger(__name__)
+
+_snapshot: Optional[Dict[str, Any]] = None  # {"deals": [...], "built_at": float, "build_ms": int}
+_stale_since: Optional[float] = None
+_state_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+_refresh_event = threading.Event()
+_refresher_stop = threading.Event()
+_refresher_thread: Optional[threading.Thread] = None
+
+
+def build_merged_deals(db: Session) -> List[Dict[str, Any]]:
+    """
+    Получает все рассрочки из Bitrix24 и локальной БД.
+    Объединяет данные для отображения в админке.
+    """
+    from bitrix.client import get_all_installment_deals, get_full_deals
+
+    # Получаем все рассрочки из Bitrix24
+    bitrix_deals = get_all_installment_deals()
+    logger.info(f"Found {len(bitrix_deals)} deals in Bitrix24")
+
+    # Получаем все сделки из локальной БД
+    db_deals = db.query(Deal).all()
+    db_deals_dict = {deal.deal_id: deal for deal in db_deals}
+    logger.info(f"Found {len(db_deals)} deals in local DB")
+
+    # ВАЖНО: crm.deal.list может не отдавать UF_* поля (term/paid и т.д.).
+    # Для отображения корректного срока/оплаты, когда сделки ещё нет в нашей БД,
+    # подтягиваем полные данные через crm.deal.get — batch-запросами, только для сделок без записи в БД
+    # (иначе источник истины — БД)
+    missing_ids = [d.get("ID") for d in bitrix_deals if d.get("ID") and d.get("ID") not in db_deals_dict]
+    full_deals = {}
+    if missing_ids:
+        try:
+            full_deals = get_full_deals(missing_ids)
+        except Exception as e:
+            logger.warning(f"Не удалось получить полные данные для {len(missing_ids)} сделок: {e}")
+
+    # Объединяем данные
+    result = []
+    for bitrix_deal in bitrix_deals:
+        deal_id = bitrix_deal.get("ID")
+        db_deal = db_deals_dict.get(deal_id)
+        full_deal = full_deals.get(str(deal_id)) if db_deal is None else None
+
+        # Получаем сумму из Bitrix24, проверяем разные варианты
+        opportunity = bitrix_deal.get("OPPORTUNITY")
+        if opportunity is None or opportunity == "" or opportunity == 0:
+            # Если OPPORTUNITY пустое, пытаемся взять из full_deal
+            if full_deal:
+                opportunity = full_deal.get("OPPORTUNITY", "0")
+
+        # Используем данные из БД для paid_amount и term_months (источник истины)
+        if db_deal:
+            paid_amount = db_deal.paid_amount
+            term_months = db_deal.term_months
+            initial_payment = int(getattr(db_deal, "initial_payment", 0) or 0)
+        else:
+            # Если записи нет, берём реальные значения из Bitrix (через full_deal).
+            # Это важно, иначе term_months будет 0 и фронт может скрывать сделки.
+            paid_amount = parse_money_to_int((full_deal or {}).get("UF_PAID_AMOUNT"))
+            term_months = parse_int((full_deal or {}).get("UF_TERM_MONTHS"))
+            initial_payment = 0
+
+        # Преобразуем сумму в число (ничего не выдумываем)
+        # Если full_deal есть, он обычно точнее (OPPORTUNITY может быть строкой/пустым в list)
+        if full_deal and full_deal.get("OPPORTUNITY") not in (None, "", 0):
+            total_amount = parse_money_to_int(full_deal.get("OPPORTUNITY"))
+        else:
+            total_amount = parse_money_to_int(opportunity)
+
+        # Определяем статус на основе процента оплаты
+        if total_amount > 0 and paid_amount >= total_amount:
+            deal_status = "paid"
+        elif paid_amount > 0:
+            deal_status = "active"
+        elif total_amount > 0:
+            deal_status = "pending"
+        else:
+            deal_status = "active"  # Если сумма неизвестна, считаем активной
+
+        result.append({
+            "deal_id": deal_id,
+            "title": (bitrix_deal.get("TITLE") or (full_deal or {}).get("TITLE") or ""),
+            "email": db_deal.email if db_deal else None,
+            "total_amount": total_amount,
+            "paid_amount": paid_amount,
+            "initial_payment": initial_payment,
+            "remaining_amount": max(0, total_amount - paid_amount),
+            "term_months": term_months,
+            "status": deal_status,
+            # Дополнительные поля из Bitrix24
+            "contact_id": bitrix_deal.get("CONTACT_ID"),
+            "assigned_by_id": bitrix_deal.get("ASSIGNED_BY_ID"),
+            "stage_id": bitrix_deal.get("STAGE_ID"),
+            "date_create": bitrix_deal.get("DATE_CREATE"),
+            "date_modify": bitrix_deal.get("DATE_MODIFY"),
+            "begindate": bitrix_deal.get("BEGINDATE"),
+            "closedate": bitrix_deal.get("CLOSEDATE"),
+            "currency_id": bitrix_deal.get("CURRENCY_ID", "RUB"),
+            "comments": bitrix_deal.get("COMMENTS"),
+            "source_id": bitrix_deal.get("SOURCE_ID"),
+            "company_id": bitrix_deal.get("COMPANY_ID"),
+            "category_id": bitrix_deal.get("CATEGORY_ID")
+        })
+
+    _apply_overdue_status(db, result)
+    return result
+
+
+def _apply_overdue_status(db: Session, rows: list) -> None:
+    """
+    Добавляет к строкам списка сделок overdue_amount / overdue_months и ставит статус "overdue",
+    если есть просроченные месяцы. Источник — сохранённый график (overdue_by_deal), как и у
+    постраничного списка (admin/deals_list.py), чтобы статус не зависел от режима запроса.
+    """
+    if not rows:
+        return
+    from installments.reports import overdue_by_deal
+
+    overdue = {
+        str(r.deal_id): (int(r.overdue_amount or 0), int(r.overdue_months or 0))
+        for r in db.execute(overdue_by_deal()).all()
+    }
+    for row in rows:
+        amount, months = overdue.get(str(row["deal_id"]), (0, 0))
+        row["overdue_amount"] = amount
+        row["overdue_months"] = months
+        if amount > 0 and row["status"] != "paid":
+            row["status"] = "overdue"
+
+
+def rebuild_deals_snapshot(only_if_missing: bool = False) -> bool:
+    """
+    Пересобирает снимок. Одновременно идёт не больше одной сборки.
+
+    Args:
+        only_if_missing: Собрать, только если снимка ещё нет (первые запросы после старта ждут
+            одну общую сборку, а не запускают каждый свою)
+
+    Returns:
+        True, если снимок собран (или уже был), False при ошибке
+    """
+    global _snapshot, _stale_since
+    with _build_lock:
+        if only_if_missing:
+            with _state_lock:
+                if _snapshot is not None:
+                    return True
+        started_at = time.time()
+        started = time.perf_counter()
+        from models.payment_log import SessionLocal
+        db = SessionLocal()
+        try:
+            deals = build_merged_deals(db)
+        except Exception as e:
+            # Старый снимок остаётся (с отметкой stale_since, если была запись)
+            logger.error(f"Снимок списка сделок: ошибка сборки: {e}", exc_info=True)
+            return False
+        finally:
+            db.close()
+        build_ms = int((time.perf_counter() - started) * 1000)
+        with _state_lock:
+            # get_all_installment_deals при таймауте/ошибке сети возвращает [], а не исключение:
+            # пустой список вместо непустого снимка считаем неудачной сборкой
+            if not deals and _snapshot is not None and _snapshot["deals"]:
+                if _stale_since is None:
+                    _stale_since = started_at
+                logger.error(
+                    f"Снимок списка сделок: Bitrix24 вернул пустой список, оставляем прежний снимок "
+                    f"({len(_snapshot['deals'])} сделок)"
+                )
+                return False
+            _snapshot = {"deals": deals, "built_at": started_at, "build_ms": build_ms}
+            # Запись во время сборки могла не попасть в снимок — тогда он остаётся устаревшим
+            if _stale_since is not None and _stale_since < started_at:
+                _stale_since = None
+        logger.info(f"Снимок списка сделок собран за {build_ms} мс ({len(deals)} сделок)")
+        return True
+
+
+def invalidate_deals_snapshot() -> None:
+    """Помечает снимок устаревшим (после записи платежа/настроек) и запускает фоновую пересборку."""
+    global _stale_since
+    with _state_lock:
+        if _stale_since is None:
+            _stale_since = time.time()
+    _refresh_event.set()
+
+
+def request_deals_snapshot_refresh() -> None:
+    """Запросить пересборку в фоне (кнопка «обновить» в админке), не дожидаясь её."""
+    _refresh_event.set()
+
+
+def get_deals_snapshot() -> Dict[str, Any]:
+    """
+    Последний готовый снимок: {"deals", "built_at", "stale_since", "refreshing"}.
+    Ждёт сборки только если снимка ещё нет (первый запрос после старта).
+
+    Raises:
+        RuntimeError: снимка нет и собрать его не удалось
+    """
+    with _state_lock:
+        snapshot = _snapshot
+    if snapshot is None:
+        rebuild_deals_snapshot(only_if_missing=True)
+        with _state_lock:
+            snapshot = _snapshot
+        if snapshot is None:
+            raise RuntimeError("Не удалось получить список сделок из Bitrix24")
+    with _state_lock:
+        stale_since = _stale_since
+    return {
+        "deals": snapshot["deals"],
+        "built_at": snapshot["built_at"],
+        "stale_since": stale_since,
+        "refreshing": _build_lock.locked(),
+    }
+
+
+def _refresher_loop(interval_seconds: int, debounce_seconds: float):
+    logger.info(f"Снимок списка сделок: фоновое обновление запущено (интервал {interval_seconds} сек)")
+    # Первая сборка — сразу после старта, чтобы первый админ не ждал Bitrix24
+    rebuild_deals_snapshot(only_if_missing=True)
+    while not _refresher_stop.is_set():
+        _refresh_event.wait(interval_seconds)
+        if _refresher_stop.is_set():
+            break
+        if _refresh_event.is_set():
+            # Серия записей подряд (импорт, несколько оплат) — одна пересборка
+            if _refresher_stop.wait(debounce_seconds):
+                break
+            _refresh_event.clear()
+        try:
+            rebuild_deals_snapshot()
+        except Exception as e:
+            logger.error(f"Снимок списка сделок: ошибка фонового обновления: {e}", exc_info=True)
+    logger.info("Снимок списка сделок: фоновое обновление остановлено")
+
+
+def start_deals_snapshot_refresher():
+    """Запускает фоновую пересборку снимка (первая сборка — сразу, не дожидаясь запроса)."""
+    global _refresher_thread
+    if _refresher_thread and _refresher_thread.is_alive():
+        return
+    _refresher_stop.clear()
+    _refresher_thread = threading.Thread(
+        target=_refresher_loop,
+        args=(
+            max(10, int(settings.ADMIN_DEALS_SNAPSHOT_INTERVAL_SECONDS)),
+            max(0.0, float(settings.ADMIN_DEALS_SNAPSHOT_DEBOUNCE_SECONDS)),
+        ),
+        name="admin-deals-snapshot",
+        daemon=True,
+    )
+    _refresher_thread.start()
+
+
+def stop_deals_snapshot_refresher():
+    global _refresher_thread
+    _refresher_stop.set()
+    _refresh_event.set()
+    if _refresher_thread:
+        _refresher_thread.join(timeout=5)
+        _refresher_thread = None
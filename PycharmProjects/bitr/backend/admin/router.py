@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
 from pydantic import BaseModel
@@ -7,11 +7,15 @@ from datetime import datetime, timedelta
 from models.payment_log import get_db, PaymentLog
 from models.deal import Deal
 from bitrix.client import get_all_installment_deals, get_installment_deal
-from installments.service import normalize_deal
+from installments.service import normalize_deal, invalidate_schedule_cache
+from admin.deals_snapshot import invalidate_deals_snapshot
 from payments.logger import log_payment
 from core.security import require_admin
+from core.responses import FastJSONResponse, server_timing_header
 from bitrix.parsing import parse_int, parse_money_to_int
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -35,9 +39,18 @@ class DealSettingsRequest(BaseModel):
     total_amount: Optional[int] = None
     term_months: Optional[int] = None
     initial_payment: Optional[int] = None
+    schedule_day: Optional[int] = None  # день месяца для платежа (1..31)
     email: Optional[str] = None
     title: Optional[str] = None
 
+class DealSettingsBulkItem(DealSettingsRequest):
+    deal_id: str
+
+class DealSettingsBulkRequest(BaseModel):
+    updates: List[DealSettingsBulkItem]
+    # Если хотя бы одна строка не прошла проверку — не записывать ничего
+    atomic: bool = False
+
 class DealResponse(BaseModel):
     deal_id: str
     title: str
@@ -50,109 +63,59 @@ class DealResponse(BaseModel):
 
 @router.get("/deals")
 def get_all_deals(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    q: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    only_installments: bool = False,
+    enrich: bool = True,
+    include_totals: Optional[bool] = None,
+    refresh: bool = False,
     db: Session = Depends(get_db),
     user = Depends(require_admin)
 ):
     """
     Получает все рассрочки из Bitrix24 и локальной БД.
     Объединяет данные для отображения в админке.
+
+    С любым из параметров limit / cursor / sort / q / status — постранично из локальной БД
+    (admin.deals_list), Bitrix24 запрашивается только для строк страницы:
+    - sort: created_at, total_amount, paid_amount, remaining_amount, title; '-' — по убыванию (по умолчанию -created_at)
+    - q: поиск по названию, email/телефону и ID сделки
+    - status: paid / active / pending / overdue (через запятую)
+    - cursor: next_cursor из предыдущего ответа
+    - include_totals: итоги по отфильтрованному набору (по умолчанию — только на первой странице)
+
+    Без них — полный объединённый список из снимка (admin.deals_snapshot) с заголовками
+    X-Snapshot-Built-At / X-Snapshot-Stale-Since; refresh=true — пересобрать снимок в фоне.
     """
+    if any(v is not None for v in (limit, cursor, sort, q, status_filter)):
+        from admin.deals_list import list_deals_page, DEALS_PAGE_DEFAULT_LIMIT
+        logger.info(f"Admin {user.identifier} requested deals page (sort={sort}, q={q}, status={status_filter})")
+        try:
+            return list_deals_page(
+                db,
+                cursor=cursor,
+                limit=limit or DEALS_PAGE_DEFAULT_LIMIT,
+                sort=sort,
+                q=q,
+                status=status_filter,
+                only_installments=only_installments,
+                enrich=enrich,
+                include_totals=(cursor is None) if include_totals is None else include_totals,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     logger.info(f"Admin {user.email} requested all deals")
-    
+
+    # Полный список — из снимка (admin.deals_snapshot): Bitrix24 не запрашивается на каждое открытие
+    from admin.deals_snapshot import get_deals_snapshot, request_deals_snapshot_refresh
+    if refresh:
+        request_deals_snapshot_refresh()
     try:
-        # Получаем все рассрочки из Bitrix24
-        bitrix_deals = get_all_installment_deals()
-        logger.info(f"Found {len(bitrix_deals)} deals in Bitrix24")
-        
-        # Получаем все сделки из локальной БД
-        db_deals = db.query(Deal).all()
-        db_deals_dict = {deal.deal_id: deal for deal in db_deals}
-        logger.info(f"Found {len(db_deals)} deals in local DB")
-        
-        # Объединяем данные
-        result = []
-        for bitrix_deal in bitrix_deals:
-            deal_id = bitrix_deal.get("ID")
-            db_deal = db_deals_dict.get(deal_id)
-            
-            # ВАЖНО: crm.deal.list может не отдавать UF_* поля (term/paid и т.д.).
-            # Для отображения корректного срока/оплаты, когда сделки ещё нет в нашей БД,
-            # подтягиваем полные данные через crm.deal.get.
-            full_deal = None
-            try:
-                import bitrix.client as bitrix_client
-                # Запрашиваем full_deal только если нет записи в БД (иначе источник истины — БД)
-                if db_deal is None:
-                    full_deal = bitrix_client._get_full_deal(deal_id)
-            except Exception as e:
-                logger.warning(f"Не удалось получить полные данные для сделки {deal_id}: {e}")
-                full_deal = None
-
-            # Получаем сумму из Bitrix24, проверяем разные варианты
-            opportunity = bitrix_deal.get("OPPORTUNITY")
-            if opportunity is None or opportunity == "" or opportunity == 0:
-                # Если OPPORTUNITY пустое, пытаемся взять из full_deal
-                if full_deal:
-                    opportunity = full_deal.get("OPPORTUNITY", "0")
-                    logger.debug(f"Получены полные данные для сделки {deal_id}, OPPORTUNITY: {opportunity}")
-            
-            # Используем данные из БД для paid_amount и term_months (источник истины)
-            if db_deal:
-                paid_amount = db_deal.paid_amount
-                term_months = db_deal.term_months
-                initial_payment = int(getattr(db_deal, "initial_payment", 0) or 0)
-            else:
-                # Если записи нет, берём реальные значения из Bitrix (через full_deal).
-                # Это важно, иначе term_months будет 0 и фронт может скрывать сделки.
-                paid_amount = parse_money_to_int((full_deal or {}).get("UF_PAID_AMOUNT"))
-                term_months = parse_int((full_deal or {}).get("UF_TERM_MONTHS"))
-                initial_payment = 0
-            
-            # Преобразуем сумму в число (ничего не выдумываем)
-            # Если full_deal есть, он обычно точнее (OPPORTUNITY может быть строкой/пустым в list)
-            if full_deal and full_deal.get("OPPORTUNITY") not in (None, "", 0):
-                total_amount = parse_money_to_int(full_deal.get("OPPORTUNITY"))
-            else:
-                total_amount = parse_money_to_int(opportunity)
-            
-            # Определяем статус на основе процента оплаты
-            if total_amount > 0 and paid_amount >= total_amount:
-                deal_status = "paid"
-            elif paid_amount > 0:
-                deal_status = "active"
-            elif total_amount > 0:
-                deal_status = "pending"
-            else:
-                deal_status = "active"  # Если сумма неизвестна, считаем активной
-            
-            result.append({
-                "deal_id": deal_id,
-                "title": (bitrix_deal.get("TITLE") or (full_deal or {}).get("TITLE") or ""),
-                "email": db_deal.email if db_deal else None,
-                "total_amount": total_amount,
-                "paid_amount": paid_amount,
-                "initial_payment": initial_payment,
-                "remaining_amount": max(0, total_amount - paid_amount),
-                "term_months": term_months,
-                "status": deal_status,
-                # Дополнительные поля из Bitrix24
-                "contact_id": bitrix_deal.get("CONTACT_ID"),
-                "assigned_by_id": bitrix_deal.get("ASSIGNED_BY_ID"),
-                "stage_id": bitrix_deal.get("STAGE_ID"),
-                "date_create": bitrix_deal.get("DATE_CREATE"),
-                "date_modify": bitrix_deal.get("DATE_MODIFY"),
-                "begindate": bitrix_deal.get("BEGINDATE"),
-                "closedate": bitrix_deal.get("CLOSEDATE"),
-                "currency_id": bitrix_deal.get("CURRENCY_ID", "RUB"),
-                "comments": bitrix_deal.get("COMMENTS"),
-                "source_id": bitrix_deal.get("SOURCE_ID"),
-                "company_id": bitrix_deal.get("COMPANY_ID"),
-                "category_id": bitrix_deal.get("CATEGORY_ID")
-            })
-        
-        logger.info(f"Returning {len(result)} deals to admin")
-        return result
-        
+        snapshot = get_deals_snapshot()
     except Exception as e:
         logger.error(f"Error getting all deals: {e}", exc_info=True)
         raise HTTPException(
@@ -160,6 +123,12 @@ def get_all_deals(
             detail=f"Ошибка при получении списка рассрочек: {str(e)}"
         )
 
+    headers = {"X-Snapshot-Built-At": datetime.utcfromtimestamp(snapshot["built_at"]).isoformat() + "Z"}
+    if snapshot["stale_since"] is not None:
+        headers["X-Snapshot-Stale-Since"] = datetime.utcfromtimestamp(snapshot["stale_since"]).isoformat() + "Z"
+    logger.info(f"Returning {len(snapshot['deals'])} deals to admin")
+    return FastJSONResponse(content=snapshot["deals"], headers=headers)
+
 @router.get("/bitrix/test")
 def test_bitrix_data_endpoint(
     db: Session = Depends(get_db),
@@ -344,31 +313,292 @@ def export_all_deals_endpoint(
             detail=f"Ошибка при экспорте данных: {str(e)}"
         )
 
+_DEAL_EXPORT_COLUMNS = [
+    "deal_id", "title", "email", "total_amount", "paid_amount", "initial_payment",
+    "remaining_amount", "term_months", "schedule_start_date", "schedule_day",
+    "status", "created_at", "updated_at",
+]
+
+def _deal_export_row(deal: Deal) -> dict:
+    total_amount = deal.total_amount or 0
+    paid_amount = deal.paid_amount or 0
+    if total_amount > 0 and paid_amount >= total_amount:
+        deal_status = "paid"
+    elif paid_amount > 0:
+        deal_status = "active"
+    elif total_amount > 0:
+        deal_status = "pending"
+    else:
+        deal_status = "active"
+    return {
+        "deal_id": deal.deal_id,
+        "title": deal.title,
+        "email": deal.email,
+        "total_amount": total_amount,
+        "paid_amount": paid_amount,
+        "initial_payment": deal.initial_payment or 0,
+        "remaining_amount": max(0, total_amount - paid_amount),
+        "term_months": deal.term_months,
+        "schedule_start_date": deal.schedule_start_date.isoformat() if deal.schedule_start_date else None,
+        "schedule_day": deal.schedule_day,
+        "status": deal_status,
+        "created_at": deal.created_at.isoformat() if deal.created_at else None,
+        "updated_at": deal.updated_at.isoformat() if deal.updated_at else None,
+    }
+
+@router.get("/export/deals")
+def stream_deals_export_endpoint(
+    format: str = "csv",
+    user = Depends(require_admin)
+):
+    """
+    Потоковая выгрузка сделок из локальной БД в CSV или NDJSON.
+    В отличие от /deals/export не обращается к Bitrix24 и не собирает результат в памяти.
+    """
+    from core.export import stream_export
+    logger.info(f"Admin {user.identifier} streaming deals export ({format})")
+    return stream_export(
+        lambda db: db.query(Deal).order_by(Deal.id.asc()),
+        _deal_export_row,
+        columns=_DEAL_EXPORT_COLUMNS,
+        fmt=format,
+        filename="deals"
+    )
+
+@router.get("/export/summary")
+def export_summary_endpoint(
+    db: Session = Depends(get_db),
+    user = Depends(require_admin)
+):
+    """
+    Итоги по портфелю для экспорта и KPI: сделки по статусам и суммы, платежи по источникам.
+    Считаются одним сгруппированным SQL-запросом по локальной БД, без Bitrix24 и без выборки всех строк.
+    Сами строки — потоком: /export/deals, /export/allocations, /api/payments/logs/export.
+    """
+    from installments.reports import build_export_summary
+    logger.info(f"Admin {user.identifier} requested export summary")
+    summary = build_export_summary(db)
+    summary["rows"] = {
+        "deals": "/api/admin/export/deals",
+        "allocations": "/api/admin/export/allocations",
+        "payments": "/api/payments/logs/export",
+    }
+    return summary
+
+@router.get("/export/allocations")
+def stream_allocations_export_endpoint(
+    format: str = "csv",
+    deal_id: Optional[str] = None,
+    user = Depends(require_admin)
+):
+    """
+    Потоковая выгрузка распределений наличных платежей по месяцам графика (CSV или NDJSON).
+    """
+    from core.export import stream_export
+    from models.cash_allocation import CashAllocation
+
+    columns = (
+        CashAllocation.id,
+        CashAllocation.deal_id,
+        CashAllocation.payment_id,
+        CashAllocation.month_index,
+        CashAllocation.amount,
+        CashAllocation.created_at,
+    )
+
+    def build_query(db: Session):
+        query = db.query(*columns)
+        if deal_id:
+            query = query.filter(CashAllocation.deal_id == deal_id)
+        return query.order_by(CashAllocation.id.asc())
+
+    logger.info(f"Admin {user.identifier} streaming allocations export ({format})")
+    return stream_export(
+        build_query,
+        lambda row: {
+            "id": row.id,
+            "deal_id": row.deal_id,
+            "payment_id": row.payment_id,
+            "month_index": row.month_index,
+            "amount": row.amount,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        },
+        columns=[c.key for c in columns],
+        fmt=format,
+        filename=f"allocations_{deal_id}" if deal_id else "allocations"
+    )
+
+@router.get("/schedule/due")
+def get_due_installments(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    db: Session = Depends(get_db),
+    user = Depends(require_admin)
+):
+    """
+    Плановые платежи по всем сделкам с датой в диапазоне [date_from, date_to) из installment_schedule.
+    По умолчанию — текущий месяц. Даты в формате YYYY-MM-DD.
+    """
+    from models.installment_schedule import InstallmentSchedule
+
+    try:
+        today = datetime.utcnow()
+        start = datetime.strptime(date_from, "%Y-%m-%d") if date_from else datetime(today.year, today.month, 1)
+        if date_to:
+            end = datetime.strptime(date_to, "%Y-%m-%d")
+        else:
+            end = datetime(start.year + 1, 1, 1) if start.month == 12 else datetime(start.year, start.month + 1, 1)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректная дата. Ожидается формат YYYY-MM-DD"
+        )
+
+    rows = (
+        db.query(
+            InstallmentSchedule.deal_id,
+            InstallmentSchedule.month_index,
+            InstallmentSchedule.due_date,
+            InstallmentSchedule.amount,
+            Deal.title,
+            Deal.email,
+        )
+        .outerjoin(Deal, Deal.deal_id == InstallmentSchedule.deal_id)
+        .filter(InstallmentSchedule.due_date >= start, InstallmentSchedule.due_date < end)
+        .order_by(InstallmentSchedule.due_date.asc(), InstallmentSchedule.deal_id.asc())
+        .all()
+    )
+    items = [
+        {
+            "deal_id": r.deal_id,
+            "title": r.title,
+            "email": r.email,
+            "month_index": r.month_index,
+            "due_date": r.due_date.strftime("%d.%m.%Y"),
+            "amount": r.amount,
+        }
+        for r in rows
+    ]
+    return {
+        "date_from": start.strftime("%Y-%m-%d"),
+        "date_to": end.strftime("%Y-%m-%d"),
+        "count": len(items),
+        "total_amount": sum(i["amount"] for i in items),
+        "items": items,
+    }
+
+@router.get("/reports/aging")
+def get_aging_report_endpoint(
+    months_ahead: int = 12,
+    refresh: bool = False,
+    db: Session = Depends(get_db),
+    user = Depends(require_admin)
+):
+    """
+    Просрочка по корзинам (0-30, 31-60, 61-90, 90+ дней), общая просрочка и ожидаемые поступления
+    по месяцам по всем сделкам с сохранённым графиком. Считается в SQL, кэшируется на короткое время
+    (refresh=true — пересчитать).
+    """
+    from installments.reports import get_aging_report
+    if months_ahead < 1 or months_ahead > 60:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="months_ahead должен быть от 1 до 60"
+        )
+    logger.info(f"Admin {user.identifier} requested aging report")
+    return get_aging_report(db, months_ahead=months_ahead, refresh=refresh)
+
+# Параллельные запросы деталей сделки (Bitrix24 и БД): общий пул, чтобы не создавать потоки на каждый запрос
+_DETAILS_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="admin-deal-details")
+
+def _timed(timings: dict, name: str, fn, *args):
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timings[name] = (time.perf_counter() - started) * 1000
+
+def _fetch_bitrix_deal(deal_id: str) -> Optional[dict]:
+    """Сделка и её контакт из Bitrix24 одним batch-запросом."""
+    try:
+        from bitrix.client import get_full_deals
+        return get_full_deals([deal_id], use_cache=False).get(str(deal_id)) or None
+    except Exception as e:
+        logger.warning(f"Could not get deal from Bitrix24: {e}")
+        return None
+
+def _load_db_deal_with_schedule(deal_id: str) -> tuple:
+    """Сделка из БД (с фиксацией базовой даты графика) и сохранённый график — в своей сессии."""
+    from models.payment_log import SessionLocal
+    db = SessionLocal()
+    try:
+        db_deal = db.query(Deal).filter(Deal.deal_id == deal_id).first()
+        if not db_deal:
+            return None, None
+        # Фиксируем базовую дату графика (один раз), чтобы он не зависел от DATE_CREATE в Bitrix
+        try:
+            if (db_deal.term_months or 0) > 0 and getattr(db_deal, "schedule_start_date", None) is None:
+                db_deal.schedule_start_date = datetime.utcnow()
+                if getattr(db_deal, "schedule_day", None) in (None, 0):
+                    db_deal.schedule_day = 10
+                db.commit()
+                db.refresh(db_deal)
+        except Exception:
+            db.rollback()
+
+        # Сохранённый график (installment_schedule) — даты и суммы платежей
+        schedule_rows = None
+        try:
+            from installments.service import load_installment_schedule
+            schedule_rows = load_installment_schedule(db, db_deal)
+        except Exception as e:
+            logger.debug(f"Could not load installment schedule for deal {deal_id}: {e}")
+        # Атрибуты нужны после закрытия сессии
+        db.expunge(db_deal)
+        return db_deal, schedule_rows
+    finally:
+        db.close()
+
+def _load_cash_allocations(deal_id: str) -> Optional[list]:
+    from models.payment_log import SessionLocal
+    from models.cash_allocation import CashAllocation
+    db = SessionLocal()
+    try:
+        alloc_rows = db.query(CashAllocation).filter(CashAllocation.deal_id == str(deal_id)).all()
+        return [
+            {"month_index": a.month_index, "amount": a.amount, "payment_id": a.payment_id}
+            for a in alloc_rows
+        ]
+    except Exception as e:
+        logger.debug(f"Could not load cash allocations for deal {deal_id}: {e}")
+        return None
+    finally:
+        db.close()
+
 @router.get("/deals/{deal_id}")
 def get_deal_details(
     deal_id: str,
-    db: Session = Depends(get_db),
+    response: Response,
     user = Depends(require_admin)
 ):
     """
     Получает детальную информацию о рассрочке для админки.
+
+    Bitrix24 (сделка + контакт одним batch), сделка с графиком из БД и распределения оплат
+    запрашиваются параллельно — время ответа определяется самым медленным источником.
+    Время каждого источника — в заголовке Server-Timing.
     """
     logger.info(f"Admin {user.email} requested deal {deal_id}")
+    started = time.perf_counter()
+    timings: dict = {}
     
     try:
-        # Получаем данные из Bitrix24
-        # Сначала пытаемся найти по deal_id
-        bitrix_deal = None
-        try:
-            # Используем внутреннюю функцию через импорт
-            import bitrix.client as bitrix_client
-            bitrix_deal = bitrix_client._get_full_deal(deal_id)
-        except Exception as e:
-            logger.warning(f"Could not get deal from Bitrix24: {e}")
-            pass
-        
-        # Если не нашли, ищем в локальной БД
-        db_deal = db.query(Deal).filter(Deal.deal_id == deal_id).first()
+        bitrix_future = _DETAILS_POOL.submit(_timed, timings, "bitrix", _fetch_bitrix_deal, deal_id)
+        db_deal_future = _DETAILS_POOL.submit(_timed, timings, "db_deal", _load_db_deal_with_schedule, deal_id)
+        alloc_future = _DETAILS_POOL.submit(_timed, timings, "allocations", _load_cash_allocations, deal_id)
+        bitrix_deal = bitrix_future.result()
+        db_deal, schedule_rows = db_deal_future.result()
+        allocations = alloc_future.result()
         
         if not bitrix_deal and not db_deal:
             raise HTTPException(
@@ -378,7 +608,7 @@ def get_deal_details(
         
         # Объединяем данные
         if bitrix_deal:
-            deal_data = bitrix_deal.copy()
+            deal_data = bitrix_deal
         else:
             # Создаем структуру из данных БД
             deal_data = {
@@ -394,17 +624,6 @@ def get_deal_details(
             deal_data["UF_PAID_AMOUNT"] = str(db_deal.paid_amount)
             deal_data["UF_TERM_MONTHS"] = str(db_deal.term_months)
             deal_data["initial_payment"] = int(getattr(db_deal, "initial_payment", 0) or 0)
-            # Фиксируем базовую дату графика (один раз), чтобы он не зависел от DATE_CREATE в Bitrix
-            try:
-                if (db_deal.term_months or 0) > 0 and getattr(db_deal, "schedule_start_date", None) is None:
-                    db_deal.schedule_start_date = datetime.utcnow()
-                    if getattr(db_deal, "schedule_day", None) in (None, 0):
-                        db_deal.schedule_day = 10
-                    db.commit()
-                    db.refresh(db_deal)
-            except Exception:
-                db.rollback()
-
             deal_data["SCHEDULE_START_DATE"] = (
                 db_deal.schedule_start_date.isoformat() if getattr(db_deal, "schedule_start_date", None) else None
             )
@@ -414,26 +633,25 @@ def get_deal_details(
                 deal_data["EMAIL"] = db_deal.email
             if not deal_data.get("TITLE") and db_deal.title:
                 deal_data["TITLE"] = db_deal.title
+            if schedule_rows is not None:
+                deal_data["SCHEDULE_ROWS"] = schedule_rows
         
-        # Подтягиваем распределения наличных платежей по месяцам (если есть)
-        try:
-            from models.cash_allocation import CashAllocation
-            alloc_rows = db.query(CashAllocation).filter(CashAllocation.deal_id == str(deal_id)).all()
-            deal_data["CASH_ALLOCATIONS"] = [
-                {"month_index": a.month_index, "amount": a.amount, "payment_id": a.payment_id}
-                for a in alloc_rows
-            ]
-        except Exception as e:
-            logger.debug(f"Could not load cash allocations for deal {deal_id}: {e}")
+        # Распределения наличных платежей по месяцам (если есть)
+        if allocations is not None:
+            deal_data["CASH_ALLOCATIONS"] = allocations
 
         # Нормализуем для фронтенда
+        normalize_started = time.perf_counter()
         normalized = normalize_deal(deal_data)
+        timings["normalize"] = (time.perf_counter() - normalize_started) * 1000
         
         # Добавляем email и title в нормализованные данные
         if db_deal:
             normalized["deal"]["email"] = db_deal.email
             normalized["deal"]["title"] = db_deal.title
         
+        timings["total"] = (time.perf_counter() - started) * 1000
+        response.headers["Server-Timing"] = server_timing_header(timings)
         return normalized
         
     except HTTPException:
@@ -482,7 +700,7 @@ def record_cash_payment(
     
     # Проверка максимальной суммы платежа (защита от ошибок ввода)
     # Максимальная сумма - 10 миллионов рублей (разумный лимит)
-    MAX_PAYMENT_AMOUNT = 10_000_000
+    from admin.cash_import import CASH_PAYMENT_MAX_AMOUNT as MAX_PAYMENT_AMOUNT
     if total_amount > MAX_PAYMENT_AMOUNT:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -643,6 +861,8 @@ def record_cash_payment(
         db.commit()
         db.refresh(db_deal)
         db.refresh(log_entry)
+        invalidate_schedule_cache(deal_id)
+        invalidate_deals_snapshot()
         
         logger.info(f"Updated paid_amount: {old_paid} + {total_amount} = {new_paid} for deal {deal_id}")
         
@@ -700,6 +920,76 @@ def record_cash_payment(
             detail=f"Ошибка при записи оплаты наличными: {str(e)}"
         )
 
+@router.post("/cash-payments/import")
+async def import_cash_payments(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    dry_run: bool = False,
+    user = Depends(require_admin)
+):
+    """
+    Пакетный импорт наличных оплат из CSV или JSON.
+
+    Тело: CSV (text/csv), файл в multipart-поле file или JSON — список строк в формате
+    ручной отметки оплаты. Все строки проверяются до записи: при ошибках ничего не записывается
+    и возвращается 400 со списком ошибок по строкам. dry_run=true — только проверка.
+    """
+    from fastapi.concurrency import run_in_threadpool
+    from admin.cash_import import parse_cash_import, import_cash_payments as run_import, sync_cash_import_side_effects
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Приложите файл в поле file")
+        content_type = upload.content_type or ""
+        if (upload.filename or "").lower().endswith(".json"):
+            content_type = "application/json"
+        content = await upload.read()
+    else:
+        content = await request.body()
+
+    created_by = user.email or user.phone or user.identifier
+    logger.info(f"Admin {created_by} importing cash payments ({len(content)} bytes, dry_run={dry_run})")
+    try:
+        parsed = parse_cash_import(content, content_type)
+        result = await run_in_threadpool(run_import, parsed, created_by, dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if result["errors"] and not result["deals"]:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
+    if not dry_run:
+        background_tasks.add_task(sync_cash_import_side_effects, result, created_by)
+    return result
+
+@router.post("/database/rebuild", status_code=status.HTTP_202_ACCEPTED)
+def rebuild_database(
+    user = Depends(require_admin)
+):
+    """
+    Запускает пересборку таблицы deals из Bitrix24 в фоне (теневая таблица и подмена).
+    Сервис работает всё время пересборки, журнал платежей не трогается.
+    """
+    from admin.db_rebuild import start_deals_rebuild
+
+    started, state = start_deals_rebuild(started_by=user.email or user.phone or user.identifier)
+    if not started:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=state)
+    logger.warning(f"Admin {user.email} started deals rebuild from Bitrix24")
+    return state
+
+
+@router.get("/database/rebuild")
+def get_rebuild_status(
+    user = Depends(require_admin)
+):
+    """Состояние пересборки таблицы deals (status, phase, fetched/total, result или error)."""
+    from admin.db_rebuild import get_deals_rebuild_status
+    return get_deals_rebuild_status()
+
+
 @router.post("/database/clear")
 def clear_database(
     user = Depends(require_admin),
@@ -707,7 +997,8 @@ def clear_database(
 ):
     """
     Очищает все таблицы базы данных и автоматически заполняет данными из Bitrix24.
-    ОПАСНАЯ ОПЕРАЦИЯ! Использовать только для тестирования или полного сброса.
+    ОПАСНАЯ ОПЕРАЦИЯ! Использовать только для тестирования или полного сброса:
+    пока идёт синхронизация, сделок в БД нет. Для обновления данных — POST /database/rebuild.
     """
     logger.warning(f"Admin {user.email} is clearing the database")
     
@@ -716,17 +1007,22 @@ def clear_database(
         from models.payment_log import PaymentLog
         
         # Очищаем таблицы в правильном порядке (сначала зависимые)
+        from models.installment_schedule import InstallmentSchedule
+        db.query(InstallmentSchedule).delete()
         deleted_allocations = db.query(CashAllocation).delete()
         deleted_logs = db.query(PaymentLog).delete()
         deleted_deals = db.query(Deal).delete()
         
         db.commit()
+        invalidate_schedule_cache()
+        invalidate_deals_snapshot()
         
         logger.warning(f"Database cleared: {deleted_deals} deals, {deleted_logs} payment logs, {deleted_allocations} allocations")
         
         # Автоматически заполняем БД данными из Bitrix24
         logger.info("Начало автоматической синхронизации данных из Bitrix24...")
         sync_result = sync_bitrix_to_db(db)
+        invalidate_deals_snapshot()
         
         return {
             "success": True,
@@ -772,6 +1068,7 @@ def sync_bitrix_to_db(db: Session) -> dict:
         
         success_count = 0
         error_count = 0
+        created_deals = []
         
         for bitrix_deal in bitrix_deals:
             deal_id = bitrix_deal.get("ID")
@@ -825,12 +1122,18 @@ def sync_bitrix_to_db(db: Session) -> dict:
                     updated_at=datetime.utcnow()
                 )
                 db.add(db_deal)
+                created_deals.append(db_deal)
                 success_count += 1
                 
             except Exception as e:
                 logger.error(f"Ошибка при синхронизации сделки {deal_id}: {e}")
                 error_count += 1
         
+        # График в installment_schedule — по тем же правилам, что при изменении настроек
+        # (у новых сделок без даты начала строк нет)
+        from installments.service import regenerate_installment_schedules
+        db.flush()
+        regenerate_installment_schedules(db, created_deals)
         db.commit()
         
         logger.info(f"Синхронизация завершена: успешно {success_count}, ошибок {error_count}")
@@ -913,6 +1216,44 @@ def test_telegram_notification(
             "error": str(e)
         }
 
+@router.put("/deals/settings")
+def update_deals_settings_bulk(
+    request: DealSettingsBulkRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    user = Depends(require_admin)
+):
+    """
+    Пакетно обновляет настройки многих рассрочек (например, новый срок для линейки продуктов).
+
+    Все изменения — в одной транзакции, результат проверки — по каждой строке.
+    atomic=true — при ошибке в любой строке ничего не записывается (400).
+    """
+    from admin.deal_settings import update_deals_settings
+
+    logger.info(f"Admin {user.email} updating settings for {len(request.updates)} deals")
+    try:
+        result = update_deals_settings(db, request.updates, atomic=request.atomic)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error updating deals settings: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при обновлении настроек рассрочек: {str(e)}"
+        )
+
+    if not result["applied"] and result["failed"]:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=result)
+
+    # Оплаченные суммы в Bitrix24 — как при обновлении одной сделки, но batch-запросами после ответа
+    from bitrix.client import update_paid_amounts
+    paid_amounts = {r["deal_id"]: r["deal"]["paid_amount"] or 0 for r in result["results"] if r["success"]}
+    background_tasks.add_task(update_paid_amounts, paid_amounts)
+    return result
+
+
 @router.put("/deals/{deal_id}/settings")
 def update_deal_settings(
     deal_id: str,
@@ -923,12 +1264,15 @@ def update_deal_settings(
     """
     Обновляет настройки рассрочки (срок, сумма, email, название).
     """
+    from admin.deal_settings import apply_deal_settings, changes_schedule, deal_from_bitrix, deal_settings_summary
+
     logger.info(f"Admin {user.email} updating settings for deal {deal_id}")
     
     try:
         # Получаем сделку из БД (если нет — создаём из Bitrix24, чтобы настройки можно было сохранять)
         db_deal = db.query(Deal).filter(Deal.deal_id == deal_id).first()
-        if not db_deal:
+        is_new = db_deal is None
+        if is_new:
             bitrix_deal = None
             try:
                 import bitrix.client as bitrix_client
@@ -941,113 +1285,26 @@ def update_deal_settings(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="Рассрочка не найдена"
                 )
-
-            db_deal = Deal(
-                deal_id=str(deal_id),
-                title=str(bitrix_deal.get("TITLE") or ""),
-                email=(request.email or None),
-                total_amount=parse_money_to_int(bitrix_deal.get("OPPORTUNITY")),
-                paid_amount=parse_money_to_int(bitrix_deal.get("UF_PAID_AMOUNT")),
-                initial_payment=0,
-                term_months=parse_int(bitrix_deal.get("UF_TERM_MONTHS")),
-            )
-            db.add(db_deal)
-            db.commit()
-            db.refresh(db_deal)
-        
-        # Обновляем поля, если они указаны
-        updated_fields = []
-        prev_term_months = int(getattr(db_deal, "term_months", 0) or 0) if db_deal else 0
+            db_deal = deal_from_bitrix(deal_id, bitrix_deal, request.email)
         
-        if request.total_amount is not None:
-            if request.total_amount < 0:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Общая сумма не может быть отрицательной"
-                )
-            # Не позволяем уменьшать общую сумму меньше чем уже оплачено
-            if request.total_amount < db_deal.paid_amount:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Общая сумма ({request.total_amount} ₽) не может быть меньше уже оплаченной суммы ({db_deal.paid_amount} ₽)"
-                )
-            db_deal.total_amount = request.total_amount
-            updated_fields.append(f"total_amount={request.total_amount}")
+        # Проверяем и применяем поля, если они указаны
+        try:
+            updated_fields = apply_deal_settings(db_deal, request)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        if is_new:
+            db.add(db_deal)
+            db.flush()
         
-        if request.term_months is not None:
-            if request.term_months < 0:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Срок не может быть отрицательным"
-                )
-            if request.term_months > 120:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Срок не может превышать 120 месяцев"
-                )
-            db_deal.term_months = request.term_months
-            updated_fields.append(f"term_months={request.term_months}")
-            # Если график создаётся впервые (term 0 -> >0) или база графика ещё не фиксировалась — фиксируем сейчас.
-            try:
-                if request.term_months > 0 and (
-                    prev_term_months <= 0 or getattr(db_deal, "schedule_start_date", None) is None
-                ):
-                    if getattr(db_deal, "schedule_start_date", None) is None:
-                        db_deal.schedule_start_date = datetime.utcnow()
-                    if getattr(db_deal, "schedule_day", None) in (None, 0):
-                        db_deal.schedule_day = 10
-                    updated_fields.append("schedule_start_date=now")
-                # Если срок сбрасывается в 0, очищаем schedule_start_date и schedule_day
-                elif request.term_months == 0:
-                    if hasattr(db_deal, "schedule_start_date"):
-                        db_deal.schedule_start_date = None
-                    if hasattr(db_deal, "schedule_day"):
-                        db_deal.schedule_day = None
-            except Exception:
-                pass
+        # Параметры графика изменились — перестраиваем сохранённый график в той же транзакции
+        if changes_schedule(request):
+            from installments.service import regenerate_installment_schedule
+            regenerate_installment_schedule(db, db_deal)
 
-        # Первоначальный взнос: параметр расчёта графика (installment_amount = total_amount - initial_payment).
-        # ВАЖНО: initial_payment НЕ является фактом оплаты и НЕ должен менять paid_amount автоматически.
-        if request.initial_payment is not None:
-            if request.initial_payment < 0:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Первоначальный взнос не может быть отрицательным"
-                )
-            # Если задана общая сумма (или уже есть в БД) — не даём ставить взнос больше total
-            total_for_check = request.total_amount if request.total_amount is not None else (db_deal.total_amount or 0)
-            if total_for_check > 0 and request.initial_payment > total_for_check:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Первоначальный взнос ({request.initial_payment} ₽) не может быть больше общей суммы ({total_for_check} ₽)"
-                )
-
-            new_initial = int(request.initial_payment)
-            db_deal.initial_payment = new_initial
-            updated_fields.append(f"initial_payment={new_initial}")
-        
-        if request.email is not None:
-            from core.security import validate_email
-            if request.email and not validate_email(request.email):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Некорректный email адрес"
-                )
-            db_deal.email = request.email or None
-            updated_fields.append(f"email={request.email}")
-        
-        if request.title is not None:
-            db_deal.title = request.title or ""
-            updated_fields.append(f"title={request.title}")
-        
-        if not updated_fields:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Не указаны поля для обновления"
-            )
-        
         db.commit()
         db.refresh(db_deal)
+        invalidate_schedule_cache(deal_id)
+        invalidate_deals_snapshot()
         
         logger.info(f"Successfully updated deal {deal_id} settings: {', '.join(updated_fields)}")
         
@@ -1064,15 +1321,7 @@ def update_deal_settings(
             "success": True,
             "deal_id": deal_id,
             "updated_fields": updated_fields,
-            "deal": {
-                "deal_id": db_deal.deal_id,
-                "title": db_deal.title,
-                "email": db_deal.email,
-                "total_amount": db_deal.total_amount,
-                "paid_amount": db_deal.paid_amount,
-                "initial_payment": getattr(db_deal, "initial_payment", 0) or 0,
-                "term_months": db_deal.term_months
-            }
+            "deal": deal_settings_summary(db_deal)
         }
         
     except HTTPException:
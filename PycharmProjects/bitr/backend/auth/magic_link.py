@@ -3,12 +3,32 @@ from typing import Optional
 from jose import jwt, JWTError
 from core.config import settings
 from datetime import datetime, timedelta
+from collections import OrderedDict
 import logging
+import math
+import threading
+import time
+import uuid
+from core.ratelimit import TokenBucketLimiter, client_ip
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
+# Ограничение запросов magic link: на идентификатор и на IP (перебор телефонов с одного адреса)
+_IDENTIFIER_LIMITER = TokenBucketLimiter(settings.LOGIN_RATE_IDENTIFIER_BURST, settings.LOGIN_RATE_IDENTIFIER_PER_MINUTE)
+_IP_LIMITER = TokenBucketLimiter(settings.LOGIN_RATE_IP_BURST, settings.LOGIN_RATE_IP_PER_MINUTE)
+
+def _check_rate_limit(limiter: TokenBucketLimiter, key: str, what: str) -> None:
+    allowed, wait = limiter.acquire(key)
+    if not allowed:
+        logger.warning(f"Слишком много запросов magic link ({what}: {key}), повтор через {wait:.0f} сек")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Слишком много попыток входа. Попробуйте позже.",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))}
+        )
+
 def create_magic_token(identifier: str, identifier_type: str = "email"):
     """
     Создает JWT токен для magic link.
@@ -44,6 +64,65 @@ def create_admin_token(identifier: str, identifier_type: str = "phone"):
     return jwt.encode(payload, settings.JWT_SECRET, algorithm="HS256")
 
 
+# Использованные refresh-токены (jti → exp): при обновлении токен заменяется новым,
+# повторное предъявление старого отклоняется
+_USED_REFRESH_JTI: "OrderedDict[str, float]" = OrderedDict()
+_USED_REFRESH_LOCK = threading.Lock()
+_USED_REFRESH_MAX_SIZE = 100_000
+
+
+def create_session_tokens(identifier: str, identifier_type: str, is_admin: bool, claims: dict) -> dict:
+    """
+    Пара токенов сессии.
+
+    access — короткий (ACCESS_TOKEN_TTL_MINUTES), несёт deal_id/deal_ids/contact_id: get_current_user
+    принимает его без обращения к БД и Bitrix24. refresh — длинный (REFRESH_TOKEN_TTL_DAYS), одноразовый,
+    обменивается на новую пару через /api/auth/refresh.
+
+    Args:
+        claims: deal_id, deal_ids, contact_id и verified_at (unix-время последней проверки рассрочки)
+    """
+    now = datetime.utcnow()
+    base = {
+        "sub": identifier,
+        "type": identifier_type,
+        "is_admin": bool(is_admin),
+        "deal_id": claims.get("deal_id"),
+        "deal_ids": list(claims.get("deal_ids") or []),
+        "contact_id": claims.get("contact_id"),
+        "verified_at": int(claims.get("verified_at") or time.time()),
+        "iat": now,
+    }
+    access = {**base, "token_use": "access", "exp": now + timedelta(minutes=settings.ACCESS_TOKEN_TTL_MINUTES)}
+    refresh = {
+        **base,
+        "token_use": "refresh",
+        "jti": uuid.uuid4().hex,
+        "exp": now + timedelta(days=settings.REFRESH_TOKEN_TTL_DAYS),
+    }
+    return {
+        "access_token": jwt.encode(access, settings.JWT_SECRET, algorithm="HS256"),
+        "refresh_token": jwt.encode(refresh, settings.JWT_SECRET, algorithm="HS256"),
+        "token_type": "bearer",
+        "expires_in": settings.ACCESS_TOKEN_TTL_MINUTES * 60,
+    }
+
+
+def _mark_refresh_used(jti: str, exp) -> bool:
+    """Отмечает refresh-токен использованным. False — его уже предъявляли."""
+    now = time.time()
+    with _USED_REFRESH_LOCK:
+        if jti in _USED_REFRESH_JTI:
+            return False
+        _USED_REFRESH_JTI[jti] = float(exp or now)
+        # Истёкшие токены и так не пройдут проверку подписи/срока — их можно забыть
+        while _USED_REFRESH_JTI and next(iter(_USED_REFRESH_JTI.values())) < now:
+            _USED_REFRESH_JTI.popitem(last=False)
+        while len(_USED_REFRESH_JTI) > _USED_REFRESH_MAX_SIZE:
+            _USED_REFRESH_JTI.popitem(last=False)
+    return True
+
+
 @router.post("/admin/login")
 async def admin_login(request: Request):
     """
@@ -95,11 +174,9 @@ def verify_token(token: str):
     Используется для проверки токена из magic link.
     """
     try:
-        payload = jwt.decode(
-            token,
-            settings.JWT_SECRET,
-            algorithms=["HS256"]
-        )
+        from core.security import decode_token
+        # Тот же кэш, что в get_current_user: первый запрос после входа не проверяет подпись заново
+        payload = decode_token(token)
         email = payload.get("sub")
         if not email:
             raise HTTPException(
@@ -122,6 +199,42 @@ def verify_token(token: str):
             detail=f"Неверный или истекший токен: {str(e)}"
         )
 
+def _find_user_deal_id(identifier: str, identifier_type: str) -> Optional[str]:
+    """
+    ID сделки пользователя — проверка перед отправкой ссылки.
+    Сначала индекс идентификатор → сделка (кэш и локальная БД), Bitrix24 — только если там ничего нет.
+    """
+    from core.identity import is_known_missing, remember_identity, remember_missing, resolve_local_deal
+    from models.payment_log import SessionLocal
+
+    db = SessionLocal()
+    try:
+        db_deal = resolve_local_deal(db, identifier, identifier_type)
+        if db_deal:
+            return str(db_deal.deal_id)
+    except Exception as e:
+        logger.warning(f"Ошибка при поиске сделки {identifier} в локальной БД: {e}")
+    finally:
+        db.close()
+
+    # Недавно искали и не нашли — не повторяем поиск в Bitrix24 (для телефона он перебирает весь портфель)
+    if is_known_missing(identifier, identifier_type):
+        logger.info(f"Рассрочка для {identifier} не найдена ранее (кэш), Bitrix24 не запрашиваем")
+        return None
+
+    from bitrix.client import get_installment_deal, get_installment_deal_by_phone
+    if identifier_type == "phone":
+        deal = get_installment_deal_by_phone(identifier)
+    else:
+        deal = get_installment_deal(identifier)
+    logger.info(f"Результат поиска рассрочки в Bitrix24 для {identifier}: {'найдена' if deal else 'не найдена'}")
+    if not deal:
+        remember_missing(identifier, identifier_type)
+        return None
+    # Запоминаем сделку пользователя: дальнейшие запросы (/my, оплата, повторный вход) найдут её без Bitrix24
+    remember_identity(identifier, identifier_type, deal.get("ID"))
+    return deal.get("ID")
+
 @router.post("/magic-link")
 async def send_magic_link(request: Request):
     """
@@ -131,11 +244,16 @@ async def send_magic_link(request: Request):
     - Query параметры: ?phone=... или ?email=...
     - Body JSON: {"phone": "..."} или {"email": "..."}
     
-    ВАЖНО: Проверяет, что пользователь существует в Bitrix24.
+    ВАЖНО: Проверяет, что у пользователя есть рассрочка (локальная БД, затем Bitrix24).
+    Ссылка отправляется фоновой очередью (notifications/magic_link.py) — ответ не ждёт email/SMS.
     """
-    from bitrix.client import get_installment_deal, get_installment_deal_by_phone
     from fastapi import HTTPException, status
+    from fastapi.concurrency import run_in_threadpool
+    from core.identity import _identity_key
+    from notifications.magic_link import enqueue_magic_link
     import re
+
+    _check_rate_limit(_IP_LIMITER, client_ip(request), "IP")
     
     # Получаем параметры из query
     phone = request.query_params.get("phone")
@@ -152,7 +270,6 @@ async def send_magic_link(request: Request):
     
     identifier = None
     identifier_type = None
-    deal = None
     
     # Определяем, что введено: телефон или email
     print(f"DEBUG: phone={phone}, email={email}")
@@ -171,17 +288,12 @@ async def send_magic_link(request: Request):
             identifier = normalized_phone
             identifier_type = "phone"
             logger.info(f"Телефон прошел валидацию, ищем рассрочку для {identifier}")
-            # Проверяем по телефону
-            deal = get_installment_deal_by_phone(normalized_phone)
-            logger.info(f"Результат поиска рассрочки по телефону {normalized_phone}: {'найдена' if deal else 'не найдена'}")
         else:
             logger.warning(f"Телефон {phone} (нормализованный: {normalized_phone}) не прошел валидацию regex")
     elif email:
         if '@' in email:
             identifier = email
             identifier_type = "email"
-            # Проверяем по email
-            deal = get_installment_deal(email)
     
     if not identifier:
         raise HTTPException(
@@ -189,7 +301,12 @@ async def send_magic_link(request: Request):
             detail="Укажите телефон или email для входа. Используйте query параметр (?phone=... или ?email=...) или body JSON ({\"phone\": \"...\"} или {\"email\": \"...\"})"
         )
     
-    if not deal:
+    # Один номер в разных записях (+7..., 8..., с пробелами) — одна корзина
+    _check_rate_limit(_IDENTIFIER_LIMITER, ":".join(_identity_key(identifier, identifier_type)), "идентификатор")
+
+    # БД и Bitrix24 — синхронные, не блокируем event loop
+    deal_id = await run_in_threadpool(_find_user_deal_id, identifier, identifier_type)
+    if not deal_id:
         if identifier:
             identifier_display = f"телефон {phone}" if identifier_type == "phone" else f"email {email}"
             logger.warning(f"Рассрочка не найдена для {identifier_display} (identifier: {identifier})")
@@ -204,10 +321,11 @@ async def send_magic_link(request: Request):
     token = create_magic_token(identifier, identifier_type)
     link = f"{settings.FRONTEND_URL}/auth/magic?token={token}"
 
-    # TODO: Подключить отправку email/SMS
-    # Сейчас просто логируем
-    logger.info(f"Magic link для {identifier_type} {identifier}: {link}")
-    print(f"MAGIC LINK для {identifier_type} {identifier}: {link}")
+    if not enqueue_magic_link(identifier, identifier_type, link):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Не удалось отправить ссылку для входа. Попробуйте позже."
+        )
 
     identifier_display = phone if identifier_type == "phone" else email
     return {
@@ -217,3 +335,115 @@ async def send_magic_link(request: Request):
         "link": link if settings.ENVIRONMENT == "development" else None
     }
 
+def _session_claims(identifier: str, identifier_type: str, is_admin: bool) -> Optional[dict]:
+    """
+    Проверяет рассрочку пользователя и собирает claims сессии.
+    Вызывается при выдаче сессии и при её обновлении (не чаще SESSION_REVERIFY_MINUTES), не на каждый запрос.
+
+    Returns:
+        claims или None, если рассрочки нет (для админа — пустые claims)
+    """
+    deal_id = _find_user_deal_id(identifier, identifier_type)
+    if not deal_id:
+        if not is_admin:
+            return None
+        return {"deal_id": None, "deal_ids": [], "contact_id": None, "verified_at": time.time()}
+
+    deal_ids = [str(deal_id)]
+    contact_id = None
+    try:
+        # Все сделки контакта и CONTACT_ID — batch-запросы с кэшем; без Bitrix24 сессия получит только deal_id
+        from bitrix.client import find_installment_deal_ids, get_full_deals
+        deal_ids = list(dict.fromkeys(deal_ids + (find_installment_deal_ids(identifier, identifier_type) or [])))
+        contact_id = (get_full_deals([deal_id]).get(str(deal_id)) or {}).get("CONTACT_ID")
+    except Exception as e:
+        logger.warning(f"Не удалось получить сделки и контакт {identifier} из Bitrix24 для сессии: {e}")
+    return {
+        "deal_id": str(deal_id),
+        "deal_ids": deal_ids,
+        "contact_id": str(contact_id) if contact_id else None,
+        "verified_at": time.time(),
+    }
+
+async def _read_token_from_body(request: Request, field: str) -> Optional[str]:
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    return body.get(field) if isinstance(body, dict) else None
+
+@router.post("/session")
+async def create_session(request: Request):
+    """
+    Обменивает токен из magic link на сессию: {"access_token", "refresh_token", "token_type", "expires_in"}.
+    Body JSON: {"token": "..."}
+    """
+    from core.security import decode_token, is_admin_identifier
+    from fastapi.concurrency import run_in_threadpool
+
+    token = await _read_token_from_body(request, "token")
+    if not token:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Укажите token из ссылки для входа")
+    try:
+        payload = decode_token(token)
+    except JWTError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Неверный или истекший токен: {str(e)}"
+        )
+    identifier = payload.get("sub")
+    if not identifier or payload.get("token_use"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Нужен токен из ссылки для входа")
+    identifier_type = payload.get("type", "email")
+    is_admin = bool(payload.get("is_admin")) or is_admin_identifier(identifier, identifier_type)
+
+    claims = await run_in_threadpool(_session_claims, identifier, identifier_type, is_admin)
+    if claims is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Рассрочка не найдена. Обратитесь к администратору."
+        )
+    logger.info(f"Сессия создана для {identifier}: сделки {claims['deal_ids']}, контакт {claims['contact_id']}")
+    return create_session_tokens(identifier, identifier_type, is_admin, claims)
+
+@router.post("/refresh")
+async def refresh_session(request: Request):
+    """
+    Обновляет сессию: refresh-токен меняется на новую пару токенов (старый больше не принимается).
+    Рассрочка проверяется заново, если с прошлой проверки прошло SESSION_REVERIFY_MINUTES.
+    Body JSON: {"refresh_token": "..."}
+    """
+    from core.security import decode_token, is_admin_identifier
+    from fastapi.concurrency import run_in_threadpool
+
+    token = await _read_token_from_body(request, "refresh_token")
+    if not token:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Укажите refresh_token")
+    try:
+        payload = decode_token(token)
+    except JWTError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Неверный или истекший refresh-токен: {str(e)}"
+        )
+    identifier = payload.get("sub")
+    if not identifier or payload.get("token_use") != "refresh" or not payload.get("jti"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный refresh-токен")
+    if not _mark_refresh_used(payload["jti"], payload.get("exp")):
+        logger.warning(f"Повторное использование refresh-токена для {identifier}")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh-токен уже использован")
+
+    identifier_type = payload.get("type", "email")
+    is_admin = bool(payload.get("is_admin")) or is_admin_identifier(identifier, identifier_type)
+    verified_at = float(payload.get("verified_at") or 0)
+    if time.time() - verified_at >= settings.SESSION_REVERIFY_MINUTES * 60:
+        claims = await run_in_threadpool(_session_claims, identifier, identifier_type, is_admin)
+        if claims is None:
+            logger.warning(f"Рассрочка для {identifier} больше не найдена, сессия не обновлена")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Рассрочка не найдена. Войдите заново."
+            )
+    else:
+        claims = {k: payload.get(k) for k in ("deal_id", "deal_ids", "contact_id", "verified_at")}
+    return create_session_tokens(identifier, identifier_type, is_admin, claims)
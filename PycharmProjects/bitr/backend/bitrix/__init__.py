@@ -4,6 +4,8 @@ from .client import (
     get_installment_deal_by_phone,
     get_all_installment_deals,
     update_paid_amount,
+    get_full_deals,
+    find_installment_deal_ids,
     _get_full_deal
 )
 
@@ -21,6 +23,8 @@ __all__ = [
     'get_installment_deal_by_phone',
     'get_all_installment_deals',
     'update_paid_amount',
+    'get_full_deals',
+    'find_installment_deal_ids',
     '_get_full_deal',
     'verify_contact_exists'
 ]
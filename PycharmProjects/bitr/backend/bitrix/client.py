@@ -1,11 +1,68 @@
 import requests
 from core.config import settings
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Iterable
 import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
 from bitrix.parsing import enrich_project_fields_inplace
 
+try:
+    import httpx
+except ImportError:  # httpx — необязательная зависимость (неблокирующие запросы в async-коде)
+    httpx = None
+
 logger = logging.getLogger(__name__)
 
+_ASYNC_SSL_CONTEXT = None
+_ASYNC_CLIENT = None  # Общий httpx.AsyncClient (пул соединений), открывается при старте приложения
+
+# Bitrix24 выполняет не больше 50 команд в одном batch-запросе
+_BATCH_MAX_COMMANDS = 50
+
+# Полные данные сделок (crm.deal.get + имя/телефон контакта) — см. get_full_deals
+_FULL_DEAL_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_FULL_DEAL_CACHE_LOCK = threading.Lock()
+_FULL_DEAL_CACHE_MAX_SIZE = 2048
+
+# Идентификатор (email/телефон) → ID сделок рассрочки контакта — см. find_installment_deal_ids
+_CONTACT_DEALS_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
+_CONTACT_DEALS_CACHE_LOCK = threading.Lock()
+_CONTACT_DEALS_CACHE_MAX_SIZE = 10_000
+
+
+def _phone_search_variants(phone: str) -> Tuple[str, List[str]]:
+    """
+    Варианты записи телефона для поиска контакта: Bitrix24 хранит телефоны в разных форматах.
+
+    Returns:
+        (нормализованный телефон — только цифры, варианты для фильтра PHONE)
+    """
+    # Нормализуем телефон (убираем пробелы, скобки, дефисы, плюсы)
+    cleaned = phone.replace(" ", "").replace("(", "").replace(")", "").replace("-", "").replace("+", "").strip()
+
+    # Варианты для поиска: с +7, без +7, с 8, только цифры
+    search_variants = []
+    if cleaned.startswith("7"):
+        search_variants.append(f"+7{cleaned[1:]}")
+        search_variants.append(f"7{cleaned[1:]}")
+        search_variants.append(cleaned[1:])  # Без первой 7
+    elif cleaned.startswith("8"):
+        search_variants.append(f"+7{cleaned[1:]}")
+        search_variants.append(f"7{cleaned[1:]}")
+        search_variants.append(cleaned)
+    else:
+        search_variants.append(f"+7{cleaned}")
+        search_variants.append(f"7{cleaned}")
+        search_variants.append(cleaned)
+
+    # Также добавляем исходный номер для поиска
+    if phone not in search_variants:
+        search_variants.insert(0, phone)
+    return cleaned, search_variants
+
+
 def get_installment_deal(email: str) -> Optional[Dict[str, Any]]:
     """
     Получает данные о рассрочке из Bitrix24 по email пользователя.
@@ -114,27 +171,7 @@ def get_installment_deal_by_phone(phone: str) -> Optional[Dict[str, Any]]:
     Bitrix24 может хранить телефоны в разных форматах, поэтому пробуем разные варианты поиска.
     """
     try:
-        # Нормализуем телефон (убираем пробелы, скобки, дефисы, плюсы)
-        cleaned = phone.replace(" ", "").replace("(", "").replace(")", "").replace("-", "").replace("+", "").strip()
-        
-        # Варианты для поиска: с +7, без +7, с 8, только цифры
-        search_variants = []
-        if cleaned.startswith("7"):
-            search_variants.append(f"+7{cleaned[1:]}")
-            search_variants.append(f"7{cleaned[1:]}")
-            search_variants.append(cleaned[1:])  # Без первой 7
-        elif cleaned.startswith("8"):
-            search_variants.append(f"+7{cleaned[1:]}")
-            search_variants.append(f"7{cleaned[1:]}")
-            search_variants.append(cleaned)
-        else:
-            search_variants.append(f"+7{cleaned}")
-            search_variants.append(f"7{cleaned}")
-            search_variants.append(cleaned)
-        
-        # Также добавляем исходный номер для поиска
-        if phone not in search_variants:
-            search_variants.insert(0, phone)
+        cleaned, search_variants = _phone_search_variants(phone)
         
         logger.info(f"Поиск контакта по телефону {phone}, нормализованный: {cleaned}, варианты поиска: {search_variants}")
         
@@ -415,31 +452,14 @@ def _get_full_deal(deal_id: str) -> Dict[str, Any]:
                     timeout=5
                 )
                 if contact_res.status_code == 200:
-                    contact = contact_res.json().get("result", {})
-                    # Формируем имя контакта
-                    first_name = contact.get("NAME") or ""
-                    last_name = contact.get("LAST_NAME") or ""
-                    full_name = f"{first_name} {last_name}".strip()
-                    if full_name:
-                        deal["CONTACT_NAME"] = full_name
-                    # Телефон контакта (берем первый VALUE)
-                    phone_val = ""
-                    contact_phone = contact.get("PHONE")
-                    if isinstance(contact_phone, list) and contact_phone:
-                        first = contact_phone[0]
-                        if isinstance(first, dict):
-                            phone_val = first.get("VALUE") or ""
-                        else:
-                            phone_val = str(first)
-                    elif isinstance(contact_phone, str):
-                        phone_val = contact_phone
-                    if phone_val:
-                        deal["CONTACT_PHONE"] = phone_val
+                    _apply_contact_fields(deal, contact_res.json().get("result", {}))
             except Exception as e:
                 logger.debug(f"Не удалось получить имя контакта {contact_id}: {e}")
 
         # Нормализуем проектные поля (enum/date/string) в единые ключи
         enrich_project_fields_inplace(deal)
+        if deal:
+            _remember_full_deal(deal_id, deal)
         
         return deal
         
@@ -466,6 +486,338 @@ def _get_full_deal(deal_id: str) -> Dict[str, Any]:
         )
         return {}
 
+def _apply_contact_fields(deal: Dict[str, Any], contact: Dict[str, Any]) -> None:
+    """Добавляет в сделку имя (CONTACT_NAME), первый телефон (CONTACT_PHONE) и email (CONTACT_EMAIL) контакта."""
+    if not isinstance(contact, dict):
+        return
+    # Формируем имя контакта
+    first_name = contact.get("NAME") or ""
+    last_name = contact.get("LAST_NAME") or ""
+    full_name = f"{first_name} {last_name}".strip()
+    if full_name:
+        deal["CONTACT_NAME"] = full_name
+    # Телефон контакта (берем первый VALUE)
+    phone_val = ""
+    contact_phone = contact.get("PHONE")
+    if isinstance(contact_phone, list) and contact_phone:
+        first = contact_phone[0]
+        if isinstance(first, dict):
+            phone_val = first.get("VALUE") or ""
+        else:
+            phone_val = str(first)
+    elif isinstance(contact_phone, str):
+        phone_val = contact_phone
+    if phone_val:
+        deal["CONTACT_PHONE"] = phone_val
+
+    # Email контакта (берем первый VALUE)
+    contact_email = contact.get("EMAIL")
+    if isinstance(contact_email, list) and contact_email:
+        first = contact_email[0]
+        email_val = (first.get("VALUE") or "") if isinstance(first, dict) else str(first)
+    else:
+        email_val = contact_email if isinstance(contact_email, str) else ""
+    if email_val:
+        deal["CONTACT_EMAIL"] = email_val
+
+
+def _remember_full_deal(deal_id, deal: Dict[str, Any]) -> None:
+    # Храним копию: вызывающий код дополняет сделку данными из БД (UF_PAID_AMOUNT, TITLE и т.п.)
+    key = str(deal_id)
+    with _FULL_DEAL_CACHE_LOCK:
+        _FULL_DEAL_CACHE[key] = (dict(deal), time.time())
+        _FULL_DEAL_CACHE.move_to_end(key)
+        while len(_FULL_DEAL_CACHE) > _FULL_DEAL_CACHE_MAX_SIZE:
+            _FULL_DEAL_CACHE.popitem(last=False)
+
+
+def _get_cached_full_deal(deal_id) -> Optional[Dict[str, Any]]:
+    key = str(deal_id)
+    with _FULL_DEAL_CACHE_LOCK:
+        entry = _FULL_DEAL_CACHE.get(key)
+        if not entry:
+            return None
+        deal, ts = entry
+        if (time.time() - ts) >= settings.BITRIX_DEAL_CACHE_TTL_SECONDS:
+            _FULL_DEAL_CACHE.pop(key, None)
+            return None
+        return dict(deal)
+
+
+def invalidate_full_deal(deal_id=None) -> None:
+    """Сбрасывает кэш полных данных сделки (или всех сделок, если deal_id не указан)."""
+    with _FULL_DEAL_CACHE_LOCK:
+        if deal_id is None:
+            _FULL_DEAL_CACHE.clear()
+        else:
+            _FULL_DEAL_CACHE.pop(str(deal_id), None)
+
+
+def _call_batch(cmd: Dict[str, str], timeout: int = 30) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Выполняет до 50 команд Bitrix24 одним запросом (метод batch).
+    Команда — строка "метод?параметры"; в параметрах можно ссылаться на результат
+    предыдущей команды: $result[имя_команды][ПОЛЕ].
+
+    Returns:
+        (результаты по именам команд, ошибки по именам команд)
+    """
+    url = f"{settings.BITRIX_WEBHOOK_URL}/batch"
+    res = requests.post(url, json={"halt": 0, "cmd": cmd}, timeout=timeout)
+    res.raise_for_status()
+    return _batch_result(res.json())
+
+
+def get_full_deals(deal_ids: Iterable, use_cache: bool = True) -> Dict[str, Dict[str, Any]]:
+    """
+    Полные данные нескольких сделок (как _get_full_deal) за один batch-запрос к Bitrix24.
+
+    Сделки, которые есть в кэше (BITRIX_DEAL_CACHE_TTL_SECONDS), не запрашиваются.
+    Для остальных в одном batch идут crm.deal.get и crm.contact.get по CONTACT_ID сделки,
+    так что число запросов к Bitrix24 не зависит от числа сделок (до 25 сделок на batch).
+
+    Returns:
+        {deal_id: сделка}; сделок, которые не удалось получить, в словаре нет.
+        Словари — копии, кэш они не затрагивают, их можно менять.
+    """
+    deals: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    for deal_id in dict.fromkeys(str(d) for d in deal_ids if d):
+        cached = _get_cached_full_deal(deal_id) if use_cache else None
+        if cached is not None:
+            deals[deal_id] = cached
+        else:
+            missing.append(deal_id)
+
+    per_batch = _BATCH_MAX_COMMANDS // 2
+    for start in range(0, len(missing), per_batch):
+        chunk = missing[start:start + per_batch]
+        cmd = {}
+        for deal_id in chunk:
+            cmd[f"deal_{deal_id}"] = f"crm.deal.get?{urlencode({'id': deal_id})}"
+            cmd[f"contact_{deal_id}"] = f"crm.contact.get?ID=$result[deal_{deal_id}][CONTACT_ID]"
+        try:
+            results, errors = _call_batch(cmd)
+        except requests.RequestException as e:
+            logger.error(
+                f"Ошибка сети при пакетном получении сделок {chunk} из Bitrix24. "
+                f"status_code: {getattr(e.response, 'status_code', 'N/A') if hasattr(e, 'response') else 'N/A'}, "
+                f"error: {e}"
+            )
+            continue
+        except Exception as e:
+            logger.error(
+                f"Неожиданная ошибка при пакетном получении сделок {chunk} из Bitrix24. "
+                f"Тип ошибки: {type(e).__name__}, error: {e}",
+                exc_info=True
+            )
+            continue
+
+        for deal_id in chunk:
+            deal = results.get(f"deal_{deal_id}")
+            if not isinstance(deal, dict) or not deal:
+                logger.warning(
+                    f"Сделка {deal_id} не получена из Bitrix24 в batch: {errors.get(f'deal_{deal_id}')}"
+                )
+                continue
+            # У сделки без контакта crm.contact.get вернёт ошибку — это нормально
+            _apply_contact_fields(deal, results.get(f"contact_{deal_id}") or {})
+            enrich_project_fields_inplace(deal)
+            _remember_full_deal(deal_id, deal)
+            deals[deal_id] = deal
+
+    if missing:
+        logger.info(
+            f"Полные данные сделок: {len(deals)} шт., из них запрошено в Bitrix24 {len(missing)}, "
+            f"остальные из кэша"
+        )
+    return deals
+
+
+def _contact_deals_key(identifier: str, identifier_type: str) -> tuple:
+    return (identifier_type or "email", identifier.strip().lower())
+
+
+def _get_cached_contact_deals(key: tuple) -> Optional[List[str]]:
+    with _CONTACT_DEALS_CACHE_LOCK:
+        entry = _CONTACT_DEALS_CACHE.get(key)
+    if entry and (time.time() - entry[1]) < settings.BITRIX_DEAL_CACHE_TTL_SECONDS:
+        return list(entry[0])
+    return None
+
+
+def _contact_deals_batch(identifier: str, identifier_type: str) -> Dict[str, str]:
+    """Команды batch: контакт по email / каждому варианту телефона и сделки "Рассрочка" этого контакта."""
+    if identifier_type == "phone":
+        variants = _phone_search_variants(identifier)[1]
+        contact_filters = [{"filter[PHONE]": v} for v in variants]
+    else:
+        contact_filters = [{"filter[EMAIL]": identifier}]
+
+    deal_params = urlencode({
+        "filter[TYPE_PAYMENT]": "Рассрочка",
+        "order[DATE_CREATE]": "DESC",
+        "select[0]": "ID",
+    })
+    cmd = {}
+    for i, contact_filter in enumerate(contact_filters):
+        cmd[f"contact_{i}"] = f"crm.contact.list?{urlencode({**contact_filter, 'select[0]': 'ID'})}"
+        cmd[f"deals_{i}"] = f"crm.deal.list?filter[CONTACT_ID]=$result[contact_{i}][0][ID]&{deal_params}"
+    return cmd
+
+
+def _parse_contact_deals(identifier: str, key: tuple, cmd: Dict[str, str], results: Dict[str, Any]) -> List[str]:
+    deal_ids: List[str] = []
+    for i in range(len(cmd) // 2):
+        # Список сделок учитываем только для найденного контакта: без контакта
+        # ссылка $result пустая и фильтр по CONTACT_ID ничего не значит
+        if not results.get(f"contact_{i}"):
+            continue
+        contact_id = results[f"contact_{i}"][0].get("ID")
+        deal_ids = [str(d["ID"]) for d in (results.get(f"deals_{i}") or []) if d.get("ID")]
+        logger.info(f"Найден контакт {contact_id} для {identifier}, сделок рассрочки: {len(deal_ids)}")
+        break
+    else:
+        logger.info(f"Контакт не найден в Bitrix24 для {identifier}")
+
+    if deal_ids:
+        with _CONTACT_DEALS_CACHE_LOCK:
+            _CONTACT_DEALS_CACHE[key] = (tuple(deal_ids), time.time())
+            _CONTACT_DEALS_CACHE.move_to_end(key)
+            while len(_CONTACT_DEALS_CACHE) > _CONTACT_DEALS_CACHE_MAX_SIZE:
+                _CONTACT_DEALS_CACHE.popitem(last=False)
+    return deal_ids
+
+
+def _batch_result(data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    data = data.get("result") or {}
+    # PHP отдаёт пустой ассоциативный массив как [] — приводим к dict
+    results = data.get("result") or {}
+    errors = data.get("result_error") or {}
+    return (results if isinstance(results, dict) else {}), (errors if isinstance(errors, dict) else {})
+
+
+def find_installment_deal_ids(identifier: str, identifier_type: str = "email",
+                              use_cache: bool = True) -> Optional[List[str]]:
+    """
+    ID всех сделок с типом оплаты "Рассрочка" у контакта с этим email/телефоном (новые первыми).
+
+    get_installment_deal / get_installment_deal_by_phone берут только последнюю сделку (limit 1).
+    Здесь поиск контакта (для телефона — по всем вариантам записи) и список его сделок идут
+    одним batch-запросом: список сделок ссылается на найденный контакт через $result.
+
+    Returns:
+        Список ID (пустой, если контакт или сделки не найдены) или None при ошибке Bitrix24
+    """
+    if not identifier:
+        return []
+    key = _contact_deals_key(identifier, identifier_type)
+    if use_cache:
+        cached = _get_cached_contact_deals(key)
+        if cached is not None:
+            return cached
+
+    cmd = _contact_deals_batch(identifier, identifier_type)
+    try:
+        results, _ = _call_batch(cmd, timeout=10)
+    except requests.RequestException as e:
+        logger.error(
+            f"Ошибка сети при поиске сделок рассрочки для {identifier} в Bitrix24. "
+            f"status_code: {getattr(e.response, 'status_code', 'N/A') if hasattr(e, 'response') else 'N/A'}, "
+            f"error: {e}"
+        )
+        return None
+    except Exception as e:
+        logger.error(
+            f"Неожиданная ошибка при поиске сделок рассрочки для {identifier}. "
+            f"Тип ошибки: {type(e).__name__}, error: {e}",
+            exc_info=True
+        )
+        return None
+    return _parse_contact_deals(identifier, key, cmd, results)
+
+
+def _async_ssl_context():
+    # Создание SSL-контекста (загрузка сертификатов) занимает десятки мс и блокирует event loop —
+    # делаем его один раз на процесс
+    global _ASYNC_SSL_CONTEXT
+    if _ASYNC_SSL_CONTEXT is None:
+        _ASYNC_SSL_CONTEXT = httpx.create_ssl_context()
+    return _ASYNC_SSL_CONTEXT
+
+
+async def start_async_client() -> None:
+    """Открывает общий httpx.AsyncClient — соединения с Bitrix24 переиспользуются между запросами."""
+    global _ASYNC_CLIENT
+    if httpx is not None and _ASYNC_CLIENT is None:
+        _ASYNC_CLIENT = httpx.AsyncClient(timeout=10, verify=_async_ssl_context())
+
+
+async def close_async_client() -> None:
+    global _ASYNC_CLIENT
+    client, _ASYNC_CLIENT = _ASYNC_CLIENT, None
+    if client is not None:
+        await client.aclose()
+
+
+async def _async_post(url: str, payload: Dict[str, Any]):
+    if _ASYNC_CLIENT is not None:
+        return await _ASYNC_CLIENT.post(url, json=payload)
+    # Вне приложения (скрипты) общего клиента нет — клиент на один запрос
+    async with httpx.AsyncClient(timeout=10, verify=_async_ssl_context()) as client:
+        return await client.post(url, json=payload)
+
+
+async def find_installment_deal_ids_async(identifier: str, identifier_type: str = "email",
+                                          use_cache: bool = True) -> Optional[List[str]]:
+    """
+    find_installment_deal_ids без блокировки event loop (httpx.AsyncClient).
+    Без httpx — тот же синхронный запрос в пуле потоков.
+    """
+    if not identifier:
+        return []
+    key = _contact_deals_key(identifier, identifier_type)
+    if use_cache:
+        cached = _get_cached_contact_deals(key)
+        if cached is not None:
+            return cached
+
+    if httpx is None:
+        from fastapi.concurrency import run_in_threadpool
+        return await run_in_threadpool(find_installment_deal_ids, identifier, identifier_type, False)
+
+    cmd = _contact_deals_batch(identifier, identifier_type)
+    try:
+        res = await _async_post(f"{settings.BITRIX_WEBHOOK_URL}/batch", {"halt": 0, "cmd": cmd})
+        res.raise_for_status()
+        results, _ = _batch_result(res.json())
+    except httpx.HTTPError as e:
+        logger.error(f"Ошибка сети при поиске сделок рассрочки для {identifier} в Bitrix24 (async): {e!r}")
+        return None
+    except Exception as e:
+        logger.error(
+            f"Неожиданная ошибка при поиске сделок рассрочки для {identifier} (async). "
+            f"Тип ошибки: {type(e).__name__}, error: {e}",
+            exc_info=True
+        )
+        return None
+    return _parse_contact_deals(identifier, key, cmd, results)
+
+
+# Поля crm.deal.list для списка рассрочек.
+# ВАЖНО: UF_TERM_MONTHS и UF_PAID_AMOUNT НЕ возвращаются в crm.deal.list
+# Это особенность Bitrix24 API - пользовательские поля часто не включены в список
+# Для получения этих полей нужно использовать crm.deal.get для каждой сделки
+# Однако, мы используем локальную БД как источник истины для этих полей
+_INSTALLMENT_LIST_SELECT = (
+    "ID", "TITLE", "OPPORTUNITY", "CONTACT_ID", "ASSIGNED_BY_ID", "STAGE_ID", "DATE_CREATE",
+    "DATE_MODIFY", "BEGINDATE", "CLOSEDATE", "CURRENCY_ID", "COMMENTS", "SOURCE_ID",
+    "COMPANY_ID", "CATEGORY_ID",
+)
+# Размер страницы crm.deal.list (фиксирован в Bitrix24)
+_LIST_PAGE_SIZE = 50
+
+
 def get_all_installment_deals() -> List[Dict[str, Any]]:
     """
     Получает все сделки с типом оплаты "Рассрочка" из Bitrix24.
@@ -486,27 +838,7 @@ def get_all_installment_deals() -> List[Dict[str, Any]]:
             "filter": {
                 "TYPE_PAYMENT": "Рассрочка"
             },
-            "select": [
-                "ID",
-                "TITLE",
-                "OPPORTUNITY",
-                "CONTACT_ID",
-                "ASSIGNED_BY_ID",
-                "STAGE_ID",
-                "DATE_CREATE",
-                "DATE_MODIFY",
-                "BEGINDATE",
-                "CLOSEDATE",
-                "CURRENCY_ID",
-                # ВАЖНО: UF_TERM_MONTHS и UF_PAID_AMOUNT НЕ возвращаются в crm.deal.list
-                # Это особенность Bitrix24 API - пользовательские поля часто не включены в список
-                # Для получения этих полей нужно использовать crm.deal.get для каждой сделки
-                # Однако, мы используем локальную БД как источник истины для этих полей
-                "COMMENTS",
-                "SOURCE_ID",
-                "COMPANY_ID",
-                "CATEGORY_ID"
-            ],
+            "select": list(_INSTALLMENT_LIST_SELECT),
             "order": {"DATE_CREATE": "DESC"}
         }
         
@@ -542,6 +874,60 @@ def get_all_installment_deals() -> List[Dict[str, Any]]:
         return []
 
 
+def get_all_installment_deals_paged() -> List[Dict[str, Any]]:
+    """
+    Все сделки с типом оплаты "Рассрочка" — постранично, до конца списка.
+
+    get_all_installment_deals отдаёт одну страницу crm.deal.list (50 сделок) и при ошибке
+    возвращает []. Здесь первая страница запрашивается обычным запросом (из неё берётся total),
+    остальные — batch-запросами по 50 страниц (start = 50, 100, ...). Сортировка по ID, чтобы
+    сделки, созданные во время обхода, не сдвигали страницы.
+
+    Returns:
+        Сделки (без пользовательских полей UF_*), без повторов
+
+    Raises:
+        requests.RequestException, RuntimeError: страницу не удалось получить — неполный
+            список не возвращается
+    """
+    url = f"{settings.BITRIX_WEBHOOK_URL}/crm.deal.list"
+    res = requests.post(url, json={
+        "filter": {"TYPE_PAYMENT": "Рассрочка"},
+        "select": list(_INSTALLMENT_LIST_SELECT),
+        "order": {"ID": "ASC"},
+        "start": 0,
+    }, timeout=30)
+    res.raise_for_status()
+    data = res.json()
+    if "result" not in data:
+        raise RuntimeError(f"crm.deal.list: {data.get('error_description') or data.get('error') or data}")
+    pages = [data.get("result") or []]
+    total = int(data.get("total") or 0)
+
+    params = {"filter[TYPE_PAYMENT]": "Рассрочка", "order[ID]": "ASC"}
+    params.update({f"select[{i}]": field for i, field in enumerate(_INSTALLMENT_LIST_SELECT)})
+    starts = list(range(_LIST_PAGE_SIZE, total, _LIST_PAGE_SIZE)) if "next" in data else []
+    for i in range(0, len(starts), _BATCH_MAX_COMMANDS):
+        chunk = starts[i:i + _BATCH_MAX_COMMANDS]
+        cmd = {f"page_{start}": f"crm.deal.list?{urlencode({**params, 'start': start})}" for start in chunk}
+        results, errors = _call_batch(cmd)
+        for start in chunk:
+            page = results.get(f"page_{start}")
+            if page is None or f"page_{start}" in errors:
+                raise RuntimeError(
+                    f"crm.deal.list: страница start={start} не получена: {errors.get(f'page_{start}')}"
+                )
+            pages.append(page)
+
+    deals: Dict[str, Dict[str, Any]] = {}
+    for page in pages:
+        for deal in page:
+            if deal.get("ID"):
+                deals.setdefault(str(deal["ID"]), deal)
+    logger.info(f"Все сделки с рассрочкой из Bitrix24: {len(deals)} (total {total}, страниц {len(pages)})")
+    return list(deals.values())
+
+
 def update_paid_amount(deal_id: str, amount: int, max_retries: int = 3, retry_delay: float = 1.0):
     """
     Обновляет оплаченную сумму в Bitrix24 с retry логикой.
@@ -576,6 +962,7 @@ def update_paid_amount(deal_id: str, amount: int, max_retries: int = 3, retry_de
             # Проверяем ответ от Bitrix24
             result = res.json()
             if result.get("result") is True:
+                invalidate_full_deal(deal_id)
                 logger.info(
                     f"Успешно обновлена оплаченная сумма в Bitrix24 для сделки {deal_id}: {amount} "
                     f"(попытка {attempt + 1}/{max_retries})"
@@ -629,3 +1016,49 @@ def update_paid_amount(deal_id: str, amount: int, max_retries: int = 3, retry_de
         f"Не удалось обновить Bitrix24 для сделки {deal_id} после {max_retries} попыток"
     )
     return False
+
+
+def update_paid_amounts(amounts: Dict[str, int], max_retries: int = 3, retry_delay: float = 1.0) -> Dict[str, bool]:
+    """
+    Обновляет оплаченную сумму нескольких сделок в Bitrix24 пакетно (до 50 сделок на batch-запрос).
+
+    Args:
+        amounts: {deal_id: новая общая оплаченная сумма}
+        max_retries: Попыток на batch при сетевой ошибке
+        retry_delay: Задержка между попытками в секундах
+
+    Returns:
+        {deal_id: True, если обновление успешно}
+    """
+    amounts = {str(deal_id): int(amount) for deal_id, amount in amounts.items()}
+    updated: Dict[str, bool] = {deal_id: False for deal_id in amounts}
+    deal_ids = list(amounts)
+    for start in range(0, len(deal_ids), _BATCH_MAX_COMMANDS):
+        chunk = deal_ids[start:start + _BATCH_MAX_COMMANDS]
+        cmd = {
+            f"update_{deal_id}": "crm.deal.update?" + urlencode({"id": deal_id, "fields[UF_PAID_AMOUNT]": amounts[deal_id]})
+            for deal_id in chunk
+        }
+        for attempt in range(max_retries):
+            try:
+                results, errors = _call_batch(cmd)
+            except Exception as e:
+                logger.warning(
+                    f"Ошибка пакетного обновления оплаченной суммы в Bitrix24 для {len(chunk)} сделок "
+                    f"(попытка {attempt + 1}/{max_retries}): {e}"
+                )
+                if attempt < max_retries - 1:
+                    time.sleep(retry_delay * (attempt + 1))
+                continue
+            for deal_id in chunk:
+                if results.get(f"update_{deal_id}") is True:
+                    updated[deal_id] = True
+                    invalidate_full_deal(deal_id)
+                else:
+                    logger.warning(
+                        f"Bitrix24 не обновил оплаченную сумму сделки {deal_id}: {errors.get(f'update_{deal_id}')}"
+                    )
+            break
+
+    logger.info(f"Пакетное обновление оплаченной суммы в Bitrix24: {sum(updated.values())} из {len(updated)} сделок")
+    return updated
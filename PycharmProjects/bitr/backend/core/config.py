@@ -7,8 +7,78 @@ class Settings(BaseSettings):
     YOOKASSA_SECRET: str
     FRONTEND_URL: str
     YOOKASSA_WEBHOOK_URL: Optional[str] = None  # URL для webhook (если не указан, используется из настроек магазина)
+    YOOKASSA_API_URL: Optional[str] = None  # Базовый URL API ЮKassa (для локального fake-сервера, например http://127.0.0.1:8081/v3)
     JWT_SECRET: str = "super-secret"
-    
+    # Окно (сек), в котором повторный запрос оплаты той же суммы по той же сделке без ключа
+    # идемпотентности получает тот же платеж ЮKassa (защита от двойных кликов и ретраев)
+    PAYMENT_IDEMPOTENCY_WINDOW_SECONDS: int = 600
+    # Время жизни кэша идентификатор (email/телефон) → сделка
+    IDENTITY_CACHE_TTL_SECONDS: int = 3600
+    # Сколько помнить, что у идентификатора нет рассрочки (повторный вход не идёт в Bitrix24), 0 — не помнить
+    IDENTITY_NEGATIVE_TTL_SECONDS: int = 300
+    # Ограничение /api/auth/magic-link (token bucket): запас запросов и пополнение в минуту,
+    # отдельно на идентификатор (email/телефон) и на IP; 0 в *_BURST — без ограничения
+    LOGIN_RATE_IDENTIFIER_BURST: int = 5
+    LOGIN_RATE_IDENTIFIER_PER_MINUTE: float = 2
+    LOGIN_RATE_IP_BURST: int = 20
+    LOGIN_RATE_IP_PER_MINUTE: float = 10
+    # Сколько /api/installment/my отвечает 304 по запомненному DATE_MODIFY сделки, не обращаясь к Bitrix24
+    BITRIX_SNAPSHOT_TTL_SECONDS: int = 120
+    # Сколько живут в кэше полные данные сделок и список сделок контакта из Bitrix24 (/api/installment/deals)
+    BITRIX_DEAL_CACHE_TTL_SECONDS: int = 60
+    # Снимок полного списка сделок в админке (/api/admin/deals без параметров): плановая пересборка
+    # и задержка пересборки после записи (серия оплат/настроек — одна пересборка)
+    ADMIN_DEALS_SNAPSHOT_INTERVAL_SECONDS: int = 300
+    ADMIN_DEALS_SNAPSHOT_DEBOUNCE_SECONDS: float = 2.0
+    # Пакетный импорт наличных оплат (/api/admin/cash-payments/import): максимум строк в файле
+    # и сколько сделок записывается в одной транзакции
+    CASH_IMPORT_MAX_ROWS: int = 5000
+    CASH_IMPORT_DEALS_PER_TRANSACTION: int = 200
+    # Пакетное обновление настроек сделок (PUT /api/admin/deals/settings): максимум сделок в запросе
+    DEAL_SETTINGS_BULK_MAX_ROWS: int = 5000
+    # Размер пула потоков для sync-эндпоинтов и зависимостей (по умолчанию в AnyIO — 40)
+    THREADPOOL_SIZE: int = 40
+    # Поиск телефона перебором всех сделок Bitrix24 при проверке старых magic-токенов: сколько
+    # одновременно (отдельные потоки, не из THREADPOOL_SIZE) и сколько ждать ответа до 503
+    PHONE_FALLBACK_CONCURRENCY: int = 4
+    PHONE_FALLBACK_TIMEOUT_SECONDS: float = 20
+    # Время жизни кэша отчётов по портфелю (aging и т.п.), 0 — без кэша
+    REPORTS_CACHE_TTL_SECONDS: int = 60
+
+    # Сверка зависших pending-платежей с ЮKassa (на случай потерянных webhook)
+    RECONCILE_ENABLED: bool = True
+    RECONCILE_INTERVAL_SECONDS: int = 600  # Как часто запускать сверку
+    RECONCILE_MIN_AGE_MINUTES: int = 15  # Проверяем только платежи старше N минут (свежие ещё ждут webhook)
+    RECONCILE_BATCH_SIZE: int = 100  # Размер страницы pending-платежей
+    RECONCILE_CONCURRENCY: int = 5  # Параллельных запросов к ЮKassa
+
+    # SSE-поток /api/payments/events: как часто сверяться с БД (события других воркеров) и
+    # сколько максимум держать соединение открытым
+    PAYMENT_EVENTS_POLL_SECONDS: int = 5
+    PAYMENT_EVENTS_MAX_SECONDS: int = 300
+
+    # Сессия после входа по magic link (/api/auth/session): короткий access-токен с deal_id/contact_id
+    # (запросы не проверяют пользователя ни в БД, ни в Bitrix24) и refresh-токен для его обновления
+    ACCESS_TOKEN_TTL_MINUTES: int = 15
+    REFRESH_TOKEN_TTL_DAYS: int = 30
+    SESSION_REVERIFY_MINUTES: int = 60  # Не чаще чем раз в N минут обновление сессии заново проверяет рассрочку
+
+    # Доставка magic link фоновой очередью (notifications/magic_link.py).
+    # Отправщик для email и для телефона: log — только в лог (локально), smtp — email, http — SMS-шлюз
+    MAGIC_LINK_EMAIL_SENDER: str = "log"
+    MAGIC_LINK_SMS_SENDER: str = "log"
+    MAGIC_LINK_MAX_ATTEMPTS: int = 3  # Попыток отправки одной ссылки
+    MAGIC_LINK_RETRY_DELAY_SECONDS: float = 2.0  # Задержка перед повтором (удваивается с каждой попыткой)
+    MAGIC_LINK_QUEUE_SIZE: int = 1000
+    SMTP_HOST: Optional[str] = None
+    SMTP_PORT: int = 587
+    SMTP_USER: Optional[str] = None
+    SMTP_PASSWORD: Optional[str] = None
+    SMTP_FROM: Optional[str] = None
+    SMTP_USE_TLS: bool = True
+    SMS_GATEWAY_URL: Optional[str] = None  # POST {"to": телефон, "text": текст}
+    SMS_GATEWAY_TOKEN: Optional[str] = None  # Передаётся как Authorization: Bearer
+
     # Production настройки
     ALLOWED_ORIGINS: Optional[str] = None  # Через запятую для нескольких доменов
     ENVIRONMENT: str = "development"  # development, production
@@ -0,0 +1,125 @@
+"""
+Потоковый экспорт выборок из БД в CSV / NDJSON.
+
+Строки читаются серверным курсором (Query.yield_per) и сразу отдаются клиенту
+через StreamingResponse, поэтому память не растёт с объёмом истории,
+а первые байты уходят до того, как выборка прочитана целиком.
+"""
+
+import csv
+import io
+import json
+import logging
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Query, Session
+
+from models.payment_log import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "ndjson")
+EXPORT_YIELD_PER = 1000
+# Сколько строк копим перед отправкой чанка (меньше системных вызовов, чем по строке)
+_ROWS_PER_CHUNK = 200
+
+_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+
+def validate_export_format(fmt: str) -> str:
+    fmt = (fmt or "csv").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неподдерживаемый формат экспорта: {fmt}. Допустимо: {', '.join(EXPORT_FORMATS)}"
+        )
+    return fmt
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _iter_csv(rows: Iterator[Dict[str, Any]], columns: List[str]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    # BOM — чтобы Excel корректно открывал кириллицу
+    buf.write("\ufeff")
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow([_csv_value(row.get(c)) for c in columns])
+        pending += 1
+        if pending >= _ROWS_PER_CHUNK:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+            pending = 0
+    yield buf.getvalue()
+
+
+def _iter_ndjson(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    chunk: List[str] = []
+    for row in rows:
+        chunk.append(json.dumps(row, ensure_ascii=False, default=str))
+        if len(chunk) >= _ROWS_PER_CHUNK:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+
+def stream_export(
+    build_query: Callable[[Session], Query],
+    row_to_dict: Callable[[Any], Dict[str, Any]],
+    columns: List[str],
+    fmt: str,
+    filename: str,
+) -> StreamingResponse:
+    """
+    Возвращает StreamingResponse с выгрузкой в CSV или NDJSON.
+
+    Args:
+        build_query: Строит запрос по сессии (сессия открывается внутри генератора,
+            чтобы жить ровно столько, сколько идёт отдача ответа)
+        row_to_dict: Преобразует строку выборки в dict
+        columns: Порядок колонок CSV
+        fmt: "csv" или "ndjson"
+        filename: Имя файла без расширения (символы кроме [A-Za-z0-9_-] заменяются на "_")
+    """
+    fmt = validate_export_format(fmt)
+    # Имя может содержать параметры запроса (deal_id) — в заголовок попадает только безопасный набор символов
+    filename = _UNSAFE_FILENAME_CHARS.sub("_", filename) or "export"
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        db = SessionLocal()
+        count = 0
+        try:
+            for row in build_query(db).yield_per(EXPORT_YIELD_PER):
+                count += 1
+                yield row_to_dict(row)
+        except Exception as e:
+            logger.error(f"Ошибка потокового экспорта {filename} после {count} строк: {e}", exc_info=True)
+            raise
+        finally:
+            db.close()
+        logger.info(f"Экспорт {filename}.{fmt}: {count} строк")
+
+    body = _iter_csv(rows(), columns) if fmt == "csv" else _iter_ndjson(rows())
+    return StreamingResponse(
+        body,
+        media_type=_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'}
+    )
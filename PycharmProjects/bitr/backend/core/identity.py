@@ -0,0 +1,163 @@
+"""
+Кэш соответствия идентификатора пользователя (email/телефон) сделке.
+
+Позволяет находить сделку пользователя в локальной БД без цепочки запросов
+к Bitrix24 (контакт → сделка → полная сделка → контакт). Кэш заполняется
+каждый раз, когда сделка пользователя найдена (вход, /my, создание платежа).
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.deal import Deal
+
+logger = logging.getLogger(__name__)
+
+_IDENTITY_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
+_IDENTITY_LOCK = threading.Lock()
+_IDENTITY_MAX_SIZE = 10_000
+
+# Идентификаторы, для которых рассрочка не найдена ни в БД, ни в Bitrix24 (короткий TTL).
+# Защищает Bitrix24 от повторных поисков по опечаткам и переборам при входе.
+_MISSING_CACHE: "OrderedDict[tuple, float]" = OrderedDict()
+_MISSING_MAX_SIZE = 50_000
+
+
+def _identity_key(identifier: str, identifier_type: str) -> Optional[tuple]:
+    if not identifier:
+        return None
+    if identifier_type == "phone":
+        digits = "".join([c for c in identifier if c.isdigit()])
+        # сравниваем по последним 10 цифрам (без кода страны)
+        norm = digits[-10:] if len(digits) >= 10 else digits
+    else:
+        norm = identifier.strip().lower()
+    if not norm:
+        return None
+    return (identifier_type or "email", norm)
+
+
+def remember_identity(identifier: str, identifier_type: str, deal_id) -> None:
+    """Запоминает, что идентификатору соответствует сделка deal_id."""
+    key = _identity_key(identifier, identifier_type)
+    if not key or not deal_id:
+        return
+    with _IDENTITY_LOCK:
+        _IDENTITY_CACHE[key] = (str(deal_id), time.time())
+        _IDENTITY_CACHE.move_to_end(key)
+        while len(_IDENTITY_CACHE) > _IDENTITY_MAX_SIZE:
+            _IDENTITY_CACHE.popitem(last=False)
+        _MISSING_CACHE.pop(key, None)
+
+
+def remember_missing(identifier: str, identifier_type: str) -> None:
+    """Запоминает, что у идентификатора нет рассрочки (на IDENTITY_NEGATIVE_TTL_SECONDS)."""
+    key = _identity_key(identifier, identifier_type)
+    if not key or settings.IDENTITY_NEGATIVE_TTL_SECONDS <= 0:
+        return
+    with _IDENTITY_LOCK:
+        _MISSING_CACHE[key] = time.time()
+        _MISSING_CACHE.move_to_end(key)
+        while len(_MISSING_CACHE) > _MISSING_MAX_SIZE:
+            _MISSING_CACHE.popitem(last=False)
+
+
+def is_known_missing(identifier: str, identifier_type: str) -> bool:
+    """True, если недавно проверяли и рассрочки у идентификатора не нашли."""
+    key = _identity_key(identifier, identifier_type)
+    if not key:
+        return False
+    with _IDENTITY_LOCK:
+        ts = _MISSING_CACHE.get(key)
+        if ts is None:
+            return False
+        if (time.time() - ts) >= settings.IDENTITY_NEGATIVE_TTL_SECONDS:
+            _MISSING_CACHE.pop(key, None)
+            return False
+        return True
+
+
+def forget_identity(identifier: str, identifier_type: str) -> None:
+    key = _identity_key(identifier, identifier_type)
+    if not key:
+        return
+    with _IDENTITY_LOCK:
+        _IDENTITY_CACHE.pop(key, None)
+
+
+def get_cached_deal_id(identifier: str, identifier_type: str) -> Optional[str]:
+    """Возвращает deal_id из кэша (или None, если записи нет или она устарела)."""
+    key = _identity_key(identifier, identifier_type)
+    if not key:
+        return None
+    with _IDENTITY_LOCK:
+        entry = _IDENTITY_CACHE.get(key)
+        if not entry:
+            return None
+        deal_id, ts = entry
+        if (time.time() - ts) >= settings.IDENTITY_CACHE_TTL_SECONDS:
+            _IDENTITY_CACHE.pop(key, None)
+            return None
+        return deal_id
+
+
+def resolve_local_deal(
+    db: Session,
+    identifier: str,
+    identifier_type: str,
+    for_update: bool = False,
+    deal_id: Optional[str] = None
+) -> Optional[Deal]:
+    """
+    Находит сделку пользователя в локальной БД без обращения к Bitrix24.
+
+    1. По deal_id из токена сессии (если передан)
+    2. По кэшу идентификатор → deal_id
+    3. По полю Deal.email (исторически в нём хранится email или телефон пользователя)
+
+    Args:
+        db: Сессия БД
+        identifier: Email или телефон
+        identifier_type: "email" или "phone"
+        for_update: Заблокировать строку сделки (SELECT FOR UPDATE)
+        deal_id: Сделка из claim access-токена (User.deal_id)
+
+    Returns:
+        Deal или None, если локальной записи нет
+    """
+    if not identifier:
+        return None
+
+    if deal_id:
+        query = db.query(Deal).filter(Deal.deal_id == str(deal_id))
+        if for_update:
+            query = query.with_for_update()
+        db_deal = query.first()
+        if db_deal:
+            return db_deal
+        # Сделки из токена нет в БД (например, после очистки) — ищем по идентификатору
+
+    deal_id = get_cached_deal_id(identifier, identifier_type)
+    if not deal_id:
+        row = db.query(Deal.deal_id).filter(Deal.email == identifier).first()
+        deal_id = row.deal_id if row else None
+        if deal_id:
+            remember_identity(identifier, identifier_type, deal_id)
+
+    if not deal_id:
+        return None
+
+    query = db.query(Deal).filter(Deal.deal_id == deal_id)
+    if for_update:
+        query = query.with_for_update()
+    db_deal = query.first()
+    if not db_deal:
+        # Сделка удалена из БД (например, после очистки) — кэш больше не актуален
+        forget_identity(identifier, identifier_type)
+    return db_deal
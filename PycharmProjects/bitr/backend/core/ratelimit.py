@@ -0,0 +1,63 @@
+"""
+Ограничение частоты запросов (token bucket) в памяти процесса.
+
+Корзина на ключ (идентификатор, IP) вмещает capacity токенов и пополняется на
+refill_per_minute токенов в минуту; каждый запрос забирает токен. Пустая корзина —
+запрос отклоняется, а вызывающий код получает, через сколько секунд появится токен.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from fastapi import Request
+
+
+class TokenBucketLimiter:
+    def __init__(self, capacity: int, refill_per_minute: float, max_keys: int = 50_000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> Tuple[bool, float]:
+        """
+        Забирает токен для key.
+
+        Returns:
+            (разрешён ли запрос, через сколько секунд появится следующий токен — для Retry-After)
+        """
+        if self.capacity <= 0:
+            return True, 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (float(self.capacity), now))
+            tokens = min(float(self.capacity), tokens + (now - ts) * self.refill_per_second)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        if allowed:
+            return True, 0.0
+        wait = (1.0 - tokens) / self.refill_per_second if self.refill_per_second > 0 else 60.0
+        return False, wait
+
+    def reset(self, key: str = None) -> None:
+        with self._lock:
+            if key is None:
+                self._buckets.clear()
+            else:
+                self._buckets.pop(key, None)
+
+
+def client_ip(request: Request) -> str:
+    """IP клиента: за nginx — из X-Real-IP (nginx перезаписывает заголовок), иначе адрес соединения."""
+    real_ip = request.headers.get("x-real-ip")
+    if real_ip:
+        return real_ip.strip()
+    return request.client.host if request.client else "unknown"
@@ -0,0 +1,28 @@
+"""
+JSON-ответы через orjson (если установлен).
+
+orjson сериализует dict/list в bytes в несколько раз быстрее стандартного json и не требует
+прохода jsonable_encoder: эндпоинт возвращает готовый Response. Без orjson ответ собирается
+обычным JSONResponse — формат тот же.
+"""
+
+from typing import Any, Dict
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson — необязательная зависимость
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Заголовок Server-Timing из {имя источника: мс} — время видно во вкладке Network браузера."""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
@@ -1,20 +1,48 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import Optional
+from typing import FrozenSet, Optional, Tuple
+from collections import OrderedDict
+import hashlib
 import re
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from jose import jwt, JWTError
 from core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Проверенные токены: sha256(токен) → (payload, exp). Подпись и срок проверяются один раз,
+# дальше запрос с тем же токеном берёт payload из кэша, пока не наступит exp, но не дольше
+# _TOKEN_CACHE_TTL_SECONDS (токен без exp не остаётся в кэше навсегда).
+_TOKEN_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_TOKEN_CACHE_LOCK = threading.Lock()
+_TOKEN_CACHE_MAX_SIZE = 10_000
+_TOKEN_CACHE_TTL_SECONDS = 300
+
+# Админы из ADMIN_IDENTIFIERS: (нормализованные телефоны, email в нижнем регистре).
+# Строится один раз (init_admin_identifiers при старте) — проверка за O(1).
+_ADMIN_SETS: Optional[Tuple[FrozenSet[str], FrozenSet[str]]] = None
+
+# Перебор сделок Bitrix24 по телефону (get_installment_deal_by_phone) — блокирующий и долгий:
+# свой маленький пул, чтобы медленный Bitrix24 не занял пул потоков всего приложения
+_PHONE_FALLBACK_POOL = ThreadPoolExecutor(
+    max_workers=max(1, settings.PHONE_FALLBACK_CONCURRENCY), thread_name_prefix="phone-fallback"
+)
+
 security = HTTPBearer(auto_error=False)  # Не требует обязательного токена
 
 class User:
-    def __init__(self, identifier: str, identifier_type: str = "email", is_admin: bool = False):
+    def __init__(self, identifier: str, identifier_type: str = "email", is_admin: bool = False,
+                 deal_id: Optional[str] = None, deal_ids=(), contact_id: Optional[str] = None):
         self.identifier = identifier  # Email или телефон
         self.identifier_type = identifier_type
         self.is_admin = bool(is_admin)
+        # Из access-токена сессии (для magic link и админ-токенов — пусто)
+        self.deal_id = deal_id
+        self.deal_ids = tuple(deal_ids or ())
+        self.contact_id = contact_id
         # Для обратной совместимости
         self.email = identifier if identifier_type == "email" else None
         self.phone = identifier if identifier_type == "phone" else None
@@ -32,24 +60,52 @@ def _parse_admin_identifiers(raw: Optional[str]) -> list[str]:
     parts = [p.strip() for p in raw.split(",")]
     return [p for p in parts if p]
 
-def is_admin_identifier(identifier: str, identifier_type: str) -> bool:
+def init_admin_identifiers() -> Tuple[FrozenSet[str], FrozenSet[str]]:
+    """(Пере)строит множества админов из ADMIN_IDENTIFIERS."""
+    global _ADMIN_SETS
     admins = _parse_admin_identifiers(getattr(settings, "ADMIN_IDENTIFIERS", None))
-    if not admins:
-        return False
+    phones = frozenset(p for p in (_normalize_phone_for_compare(a) for a in admins) if p)
+    emails = frozenset(a.lower() for a in admins)
+    _ADMIN_SETS = (phones, emails)
+    return _ADMIN_SETS
+
+def is_admin_identifier(identifier: str, identifier_type: str) -> bool:
+    phones, emails = _ADMIN_SETS if _ADMIN_SETS is not None else init_admin_identifiers()
     if identifier_type == "phone":
         needle = _normalize_phone_for_compare(identifier)
-        if not needle:
-            return False
-        for a in admins:
-            if _normalize_phone_for_compare(a) == needle:
-                return True
-        return False
+        return bool(needle) and needle in phones
     # email/string compare (case-insensitive)
-    needle = (identifier or "").strip().lower()
-    for a in admins:
-        if a.strip().lower() == needle:
-            return True
-    return False
+    return (identifier or "").strip().lower() in emails
+
+def decode_token(token: str) -> dict:
+    """
+    jwt.decode с кэшем проверенных токенов (LRU, запись живёт до exp токена, не дольше _TOKEN_CACHE_TTL_SECONDS).
+
+    Raises:
+        JWTError: неверная подпись или истёкший токен
+    """
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    now = time.time()
+    with _TOKEN_CACHE_LOCK:
+        entry = _TOKEN_CACHE.get(key)
+        if entry is not None:
+            payload, expires_at = entry
+            if now < expires_at:
+                _TOKEN_CACHE.move_to_end(key)
+                return payload
+            del _TOKEN_CACHE[key]
+
+    payload = jwt.decode(token, settings.JWT_SECRET, algorithms=["HS256"])
+    expires_at = now + _TOKEN_CACHE_TTL_SECONDS
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        expires_at = min(expires_at, float(exp))
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[key] = (payload, expires_at)
+        _TOKEN_CACHE.move_to_end(key)
+        while len(_TOKEN_CACHE) > _TOKEN_CACHE_MAX_SIZE:
+            _TOKEN_CACHE.popitem(last=False)
+    return payload
 
 def validate_email(email: str) -> bool:
     """
@@ -81,12 +137,27 @@ def validate_email(email: str) -> bool:
     
     return True
 
-def get_current_user(
+def _check_local_deal(identifier: str, identifier_type: str) -> bool:
+    """Есть ли сделка пользователя в локальной БД (выполняется в пуле потоков)."""
+    from core.identity import resolve_local_deal
+    from models.payment_log import SessionLocal
+    db = SessionLocal()
+    try:
+        return resolve_local_deal(db, identifier, identifier_type) is not None
+    finally:
+        db.close()
+
+async def get_current_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ) -> User:
     """
     Получает текущего пользователя из JWT токена.
     Проверяет, что пользователь существует в Bitrix24.
+
+    Асинхронная зависимость: токены сессии, админы и пользователи из кэша идентификаторов
+    проверяются прямо в event loop, в пул потоков уходит только запрос к локальной БД,
+    а Bitrix24 опрашивается неблокирующим клиентом — медленный Bitrix24 не занимает
+    потоки, нужные остальным эндпоинтам.
     """
     if not credentials:
         raise HTTPException(
@@ -96,60 +167,113 @@ def get_current_user(
     
     token = credentials.credentials
     try:
-        payload = jwt.decode(
-            token,
-            settings.JWT_SECRET,
-            algorithms=["HS256"]
+        payload = decode_token(token)
+    except JWTError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Неверный или истекший токен: {str(e)}"
         )
-        identifier = payload.get("sub")
-        identifier_type = payload.get("type", "email")  # По умолчанию email для обратной совместимости
-        is_admin = bool(payload.get("is_admin")) or is_admin_identifier(identifier, identifier_type)
-        
-        if not identifier:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Неверный токен: идентификатор не найден"
-            )
 
-        # Админ-токены не должны зависеть от наличия рассрочки в Bitrix24
-        if is_admin:
-            return User(identifier=identifier, identifier_type=identifier_type, is_admin=True)
-        
+    identifier = payload.get("sub")
+    identifier_type = payload.get("type", "email")  # По умолчанию email для обратной совместимости
+    
+    if not identifier:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Неверный токен: идентификатор не найден"
+        )
+    is_admin = bool(payload.get("is_admin")) or is_admin_identifier(identifier, identifier_type)
+
+    token_use = payload.get("token_use")
+    if token_use == "refresh":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh-токен нельзя использовать для доступа, обновите сессию через /api/auth/refresh"
+        )
+    # Access-токен сессии: рассрочка проверена при выдаче/обновлении сессии и записана в claims —
+    # ни БД, ни Bitrix24 не нужны
+    if token_use == "access":
+        return User(
+            identifier=identifier,
+            identifier_type=identifier_type,
+            is_admin=is_admin,
+            deal_id=payload.get("deal_id"),
+            deal_ids=payload.get("deal_ids") or (),
+            contact_id=payload.get("contact_id"),
+        )
+
+    # Админ-токены не должны зависеть от наличия рассрочки в Bitrix24
+    if is_admin:
+        return User(identifier=identifier, identifier_type=identifier_type, is_admin=True)
+
+    from core.identity import get_cached_deal_id, is_known_missing, remember_identity, remember_missing
+
+    # Сделка пользователя недавно найдена (вход, /my, платёж) — проверять нечего
+    if get_cached_deal_id(identifier, identifier_type):
+        return User(identifier=identifier, identifier_type=identifier_type, is_admin=is_admin)
+
+    # Быстрый путь: сделка пользователя уже есть в локальной БД — Bitrix24 не нужен
+    try:
+        from fastapi.concurrency import run_in_threadpool
+        if await run_in_threadpool(_check_local_deal, identifier, identifier_type):
+            return User(identifier=identifier, identifier_type=identifier_type, is_admin=is_admin)
+    except Exception as e:
+        logger.warning(f"Ошибка при проверке пользователя в локальной БД: {e}")
+
+    identifier_display = f"телефон {identifier}" if identifier_type == "phone" else f"email {identifier}"
+    # Недавно уже искали и не нашли — не повторяем поиск в Bitrix24
+    if is_known_missing(identifier, identifier_type):
+        deal_ids = []
+    else:
         # Проверяем, что пользователь существует в Bitrix24 (есть сделка с рассрочкой)
-        try:
-            from bitrix.client import get_installment_deal, get_installment_deal_by_phone
-            
-            if identifier_type == "phone":
-                deal = get_installment_deal_by_phone(identifier)
-            else:
-                deal = get_installment_deal(identifier)
-            
-            if not deal:
-                identifier_display = f"телефон {identifier}" if identifier_type == "phone" else f"email {identifier}"
-                logger.warning(f"Пользователь с {identifier_display} не найден в Bitrix24 или не имеет рассрочки")
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail=f"Пользователь с {identifier_display} не найден в Bitrix24 или не имеет рассрочки. Обратитесь к администратору."
-                )
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Ошибка при проверке пользователя в Bitrix24: {e}", exc_info=True)
+        from bitrix.client import find_installment_deal_ids_async
+        deal_ids = await find_installment_deal_ids_async(identifier, identifier_type)
+        if deal_ids is None:
             # В случае ошибки подключения к Bitrix24 - блокируем запрос для безопасности
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail="Сервис Bitrix24 временно недоступен. Попробуйте позже."
             )
-        
-        return User(identifier=identifier, identifier_type=identifier_type, is_admin=is_admin)
-    except JWTError as e:
+        if not deal_ids and identifier_type == "phone":
+            # Как при выдаче magic link (_find_user_deal_id): телефон, записанный в контакте в другом
+            # формате, находится только поиском по всем сделкам рассрочки
+            deal_ids = await _find_phone_deal_ids(identifier)
+        if not deal_ids:
+            remember_missing(identifier, identifier_type)
+
+    if not deal_ids:
+        logger.warning(f"Пользователь с {identifier_display} не найден в Bitrix24 или не имеет рассрочки")
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Неверный или истекший токен: {str(e)}"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Пользователь с {identifier_display} не найден в Bitrix24 или не имеет рассрочки. Обратитесь к администратору."
+        )
+
+    remember_identity(identifier, identifier_type, deal_ids[0])
+    return User(identifier=identifier, identifier_type=identifier_type, is_admin=is_admin)
+
+
+async def _find_phone_deal_ids(phone: str) -> list:
+    """
+    get_installment_deal_by_phone в пуле _PHONE_FALLBACK_POOL с ограничением по времени.
+    Не дождались (Bitrix24 медленный или пул занят) — 503, «не найден» не запоминаем.
+    """
+    import asyncio
+    from bitrix.client import get_installment_deal_by_phone
+
+    future = asyncio.get_running_loop().run_in_executor(_PHONE_FALLBACK_POOL, get_installment_deal_by_phone, phone)
+    try:
+        # Отмена по таймауту снимает и ещё не начатую задачу из очереди пула
+        deal = await asyncio.wait_for(future, timeout=settings.PHONE_FALLBACK_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning(f"Поиск телефона {phone} по сделкам Bitrix24 не уложился в {settings.PHONE_FALLBACK_TIMEOUT_SECONDS} сек")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервис Bitrix24 временно недоступен. Попробуйте позже."
         )
+    return [str(deal["ID"])] if deal and deal.get("ID") else []
 
 
-def require_admin(user: User = Depends(get_current_user)) -> User:
+async def require_admin(user: User = Depends(get_current_user)) -> User:
     if not getattr(user, "is_admin", False):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
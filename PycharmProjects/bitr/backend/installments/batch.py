@@ -0,0 +1,201 @@
+"""
+Пакетный расчёт графиков платежей для всего портфеля (NumPy).
+
+normalize_deal строит график одной сделки циклом по месяцам. Для расчётов по всем сделкам
+(сценарии «что если» по параметрам, сверка с сохранённым графиком и т.п.) это N вызовов
+с Python-циклом внутри. Просрочка в /api/admin/deals считается не здесь, а по сохранённому
+графику (installments.reports.overdue_by_deal). Здесь те же
+правила применяются сразу к матрице «сделки × месяцы»: даты, суммы, распределение оплат,
+статусы paid/partial/pending и просрочка считаются векторными операциями.
+
+Результат совпадает с normalize_deal (см. scripts/benchmark_schedule_batch.py).
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from installments.service import MONTH_NAMES
+
+STATUS_PENDING = 0
+STATUS_PARTIAL = 1
+STATUS_PAID = 2
+_STATUS_NAMES = ("pending", "partial", "paid")
+
+
+@dataclass
+class ScheduleBatch:
+    """
+    Графики N сделок. Матрицы имеют форму (N, T), где T — максимальный срок в пакете;
+    ячейки за пределами срока сделки отмечены mask=False.
+    """
+    mask: np.ndarray  # (N, T) bool — месяц входит в график
+    due_dates: np.ndarray  # (N, T) datetime64[D]
+    amounts: np.ndarray  # (N, T) int64
+    paid_in_month: np.ndarray  # (N, T) int64
+    remaining_in_month: np.ndarray  # (N, T) int64
+    statuses: np.ndarray  # (N, T) int8: STATUS_PENDING / STATUS_PARTIAL / STATUS_PAID
+    paid_months: np.ndarray  # (N,) int64
+    overdue_amount: np.ndarray  # (N,) int64 — недоплата по месяцам с датой раньше today
+    overdue_months: np.ndarray  # (N,) int64
+
+    def __len__(self) -> int:
+        return int(self.paid_months.shape[0])
+
+    def payments(self, i: int) -> List[dict]:
+        """График i-й сделки в формате normalize_deal()["payments"]."""
+        row_mask = self.mask[i]
+        term = int(row_mask.sum())
+        if term == 0:
+            return []
+        dates = self.due_dates[i, :term].tolist()
+        amounts = self.amounts[i, :term].tolist()
+        paid = self.paid_in_month[i, :term].tolist()
+        remaining = self.remaining_in_month[i, :term].tolist()
+        statuses = self.statuses[i, :term].tolist()
+        return [
+            {
+                "index": k,
+                "month": f"{MONTH_NAMES[d.month - 1]} {d.year}",
+                "date": f"{d.day:02d}.{d.month:02d}.{d.year}",
+                "amount": amounts[k],
+                "status": _STATUS_NAMES[statuses[k]],
+                "paid_in_month": paid[k],
+                "remaining_in_month": remaining[k],
+            }
+            for k, d in enumerate(dates)
+        ]
+
+
+def _month_tables(first_month: int, last_month: int):
+    """
+    Для месяцев [first_month, last_month] (номер месяца от 1970-01) — день начала месяца
+    (номер дня от 1970-01-01) и длина месяца. Таблица маленькая (сотни строк), дальше —
+    целочисленная индексация вместо преобразований datetime64 по всей матрице.
+    """
+    months = np.arange(first_month, last_month + 2, dtype=np.int64).astype("datetime64[M]")
+    starts = months.astype("datetime64[D]").astype(np.int64)
+    return starts[:-1], np.diff(starts)
+
+
+def compute_schedules_batch(
+    total_amount: Sequence[int],
+    initial_payment: Sequence[int],
+    term_months: Sequence[int],
+    paid_amount: Sequence[int],
+    base_dates: Sequence[Optional[datetime]],
+    schedule_day: Sequence[Optional[int]],
+    allocations: Optional[Sequence[Optional[Dict[int, int]]]] = None,
+    today: Optional[date] = None,
+) -> ScheduleBatch:
+    """
+    Считает графики для всех сделок пакета.
+
+    Args:
+        total_amount: Общая сумма сделки
+        initial_payment: Первоначальный взнос
+        term_months: Срок в месяцах
+        paid_amount: Оплаченная сумма (paid_amount из БД)
+        base_dates: Базовая дата графика (schedule_start_date / дата сделки; None — сейчас)
+        schedule_day: День платежа (None или 0 — по умолчанию 10)
+        allocations: Для каждой сделки {month_index: сумма} из cash_allocations (или None)
+        today: Дата, относительно которой считается просрочка (по умолчанию — сегодня)
+    """
+    n = len(total_amount)
+    total = np.asarray(total_amount, dtype=np.int64).reshape(n)
+    initial = np.maximum(np.asarray(initial_payment, dtype=np.int64).reshape(n), 0)
+    initial = np.where((total > 0) & (initial > total), total, initial)
+    term = np.asarray(term_months, dtype=np.int64).reshape(n)
+    paid = np.asarray(paid_amount, dtype=np.int64).reshape(n)
+
+    installment_total = np.maximum(total - initial, 0)
+    valid = (total > 0) & (term > 0) & (installment_total > 0)
+    term_v = np.where(valid, term, 0)
+    t_max = int(term_v.max()) if n else 0
+
+    months = np.arange(t_max, dtype=np.int64)
+    mask = months[None, :] < term_v[:, None]
+
+    # Суммы: равные платежи, остаток — в последний месяц
+    safe_term = np.where(valid, term, 1)
+    monthly = installment_total // safe_term
+    remainder = installment_total % safe_term
+    is_last = months[None, :] == (term_v - 1)[:, None]
+    amounts = np.where(mask, monthly[:, None] + np.where(is_last, remainder[:, None], 0), 0)
+
+    # Даты: первый платёж — в ближайший schedule_day, дальше — тот же день с клэмпом по длине месяца
+    now = datetime.now()
+    day = np.array([d or 0 for d in schedule_day], dtype=np.int64).reshape(n)
+    day = np.clip(np.where(day == 0, 10, day), 1, 31)
+    base = np.array(
+        [(b.replace(tzinfo=None) if b is not None else now) for b in base_dates],
+        dtype="datetime64[D]"
+    ).reshape(n)
+    base_month = base.astype("datetime64[M]").astype(np.int64)
+    base_day = base.astype(np.int64) - base_month.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) + 1
+    start_month = base_month + (base_day >= day)
+    first_month = int(start_month.min()) if n else 0
+    month_starts, month_lengths = _month_tables(first_month, (int(start_month.max()) if n else 0) + t_max)
+    start_day = np.minimum(day, month_lengths[start_month - first_month])
+    due_months = start_month[:, None] - first_month + months[None, :]
+    pay_day = np.minimum(start_day[:, None], month_lengths[due_months])
+    due_dates = (month_starts[due_months] + pay_day - 1).view("datetime64[D]")
+
+    # Оплаты по месяцам
+    paid_for_schedule = np.clip(paid, 0, installment_total)
+
+    # 1) без распределений — последовательно по месяцам
+    before = np.cumsum(amounts, axis=1) - amounts
+    paid_seq = np.clip(paid_for_schedule[:, None] - before, 0, amounts)
+
+    # 2) с распределениями — по месяцам из cash_allocations + недостающая часть paid последовательно
+    has_alloc = np.zeros(n, dtype=bool)
+    alloc_sum = np.zeros(n, dtype=np.int64)
+    alloc_matrix = np.zeros((n, t_max), dtype=np.int64)
+    if allocations is not None:
+        rows, cols, vals = [], [], []
+        for i, alloc in enumerate(allocations):
+            if not alloc:
+                continue
+            for idx, amt in alloc.items():
+                if idx >= 0 and amt > 0:
+                    rows.append(i)
+                    cols.append(idx)
+                    vals.append(amt)
+        if rows:
+            rows_a = np.asarray(rows, dtype=np.int64)
+            cols_a = np.asarray(cols, dtype=np.int64)
+            vals_a = np.asarray(vals, dtype=np.int64)
+            has_alloc[rows_a] = True
+            np.add.at(alloc_sum, rows_a, vals_a)
+            in_range = cols_a < t_max
+            np.add.at(alloc_matrix, (rows_a[in_range], cols_a[in_range]), vals_a[in_range])
+    alloc_matrix = np.where(mask, alloc_matrix, 0)
+    extra_total = np.maximum(paid_for_schedule - alloc_sum, 0)
+    deficit = np.where(mask, np.maximum(amounts - alloc_matrix, 0), 0)
+    before_deficit = np.cumsum(deficit, axis=1) - deficit
+    extra = np.clip(extra_total[:, None] - before_deficit, 0, deficit)
+    paid_alloc = alloc_matrix + extra
+
+    paid_in_month = np.where(mask, np.where(has_alloc[:, None], paid_alloc, paid_seq), 0)
+    remaining = np.where(mask, np.maximum(amounts - paid_in_month, 0), 0)
+    statuses = np.where(
+        remaining <= 0,
+        STATUS_PAID,
+        np.where(paid_in_month > 0, STATUS_PARTIAL, STATUS_PENDING)
+    ).astype(np.int8)
+
+    overdue = mask & (due_dates < np.datetime64(today or date.today(), "D")) & (remaining > 0)
+    return ScheduleBatch(
+        mask=mask,
+        due_dates=due_dates,
+        amounts=amounts,
+        paid_in_month=paid_in_month,
+        remaining_in_month=remaining,
+        statuses=statuses,
+        paid_months=(mask & (statuses == STATUS_PAID)).sum(axis=1),
+        overdue_amount=np.where(overdue, remaining, 0).sum(axis=1),
+        overdue_months=overdue.sum(axis=1),
+    )
@@ -0,0 +1,370 @@
+"""
+Отчёты по портфелю рассрочек, считаемые целиком в SQL.
+
+Оплата по месяцам восстанавливается оконными функциями по installment_schedule и
+cash_allocations по тем же правилам, что и normalize_deal: распределения по месяцам
++ недостающая часть paid_amount последовательно, без распределений — последовательно
+от первого месяца. Python получает уже агрегированные строки.
+"""
+
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, case, func, literal, null, select, union_all
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.cash_allocation import CashAllocation
+from models.deal import Deal
+from models.installment_schedule import InstallmentSchedule
+from models.payment_log import PaymentLog
+
+logger = logging.getLogger(__name__)
+
+AGING_BUCKETS = ("0-30", "31-60", "61-90", "90+")
+
+_REPORT_CACHE: dict = {}
+_REPORT_CACHE_LOCK = threading.Lock()
+
+
+def _clip(value, upper):
+    """value, ограниченное диапазоном [0, upper]."""
+    return case((value <= 0, 0), (value >= upper, upper), else_=value)
+
+
+def _positive(value):
+    return case((value > 0, value), else_=0)
+
+
+def _schedule_status_cte(deal_ids=None):
+    """
+    CTE со строками графика и оплатой по каждому месяцу:
+    deal_id, due_date, amount, paid_in_month, remaining_in_month.
+
+    deal_ids — ограничить расчёт этими сделками (страница списка в админке), иначе весь портфель.
+
+    Расчёт разбит на слои (оконные суммы → параметры сделки → оплата месяца), чтобы
+    выражения не разворачивались друг в друга: иначе каждая ссылка на paid_in_month
+    повторяет всю цепочку CASE, и запрос замедляется в разы.
+    """
+    S = InstallmentSchedule
+
+    alloc = (
+        select(
+            CashAllocation.deal_id.label("deal_id"),
+            CashAllocation.month_index.label("month_index"),
+            func.sum(CashAllocation.amount).label("amount"),
+        )
+        .where(CashAllocation.month_index >= 0, CashAllocation.amount > 0)
+        .where(*([CashAllocation.deal_id.in_(deal_ids)] if deal_ids is not None else []))
+        .group_by(CashAllocation.deal_id, CashAllocation.month_index)
+        .cte("alloc")
+    )
+    alloc_totals = (
+        select(alloc.c.deal_id, func.sum(alloc.c.amount).label("total"))
+        .group_by(alloc.c.deal_id)
+        .cte("alloc_totals")
+    )
+
+    # 1) Оконные суммы по графику: сколько запланировано и сколько не покрыто распределениями до месяца
+    alloc_amount = func.coalesce(alloc.c.amount, 0)
+    deficit = _positive(S.amount - alloc_amount)
+    by_deal = {"partition_by": S.deal_id, "order_by": S.month_index}
+    schedule_months = (
+        select(
+            S.deal_id.label("deal_id"),
+            S.due_date.label("due_date"),
+            S.amount.label("amount"),
+            alloc_amount.label("alloc_amount"),
+            deficit.label("deficit"),
+            (func.sum(S.amount).over(**by_deal) - S.amount).label("scheduled_before"),
+            (func.sum(deficit).over(**by_deal) - deficit).label("deficit_before"),
+        )
+        .outerjoin(alloc, and_(alloc.c.deal_id == S.deal_id, alloc.c.month_index == S.month_index))
+        .where(*([S.deal_id.in_(deal_ids)] if deal_ids is not None else []))
+        .cte("schedule_months")
+    )
+
+    # 2) Параметры сделки. Сумма рассрочки — как в regenerate_installment_schedule: total - первоначальный взнос
+    total = func.coalesce(Deal.total_amount, 0)
+    initial = func.coalesce(Deal.initial_payment, 0)
+    installment_total = case(
+        (initial <= 0, total),
+        (total > initial, total - initial),
+        else_=0,
+    )
+    paid_for_schedule = _clip(func.coalesce(Deal.paid_amount, 0), installment_total)
+    deal_params = (
+        select(
+            Deal.deal_id.label("deal_id"),
+            paid_for_schedule.label("paid_for_schedule"),
+            alloc_totals.c.deal_id.is_not(None).label("has_alloc"),
+            func.coalesce(alloc_totals.c.total, 0).label("alloc_total"),
+        )
+        .outerjoin(alloc_totals, alloc_totals.c.deal_id == Deal.deal_id)
+        .where(*([Deal.deal_id.in_(deal_ids)] if deal_ids is not None else []))
+        .cte("deal_params")
+    )
+
+    # 3) Оплата месяца: распределения + недостающая часть paid последовательно,
+    #    без распределений — paid последовательно от первого месяца
+    m, p = schedule_months.c, deal_params.c
+    paid_in_month = case(
+        (p.has_alloc, m.alloc_amount + _clip(_positive(p.paid_for_schedule - p.alloc_total) - m.deficit_before, m.deficit)),
+        else_=_clip(p.paid_for_schedule - m.scheduled_before, m.amount),
+    )
+    schedule_paid = (
+        select(m.deal_id, m.due_date, m.amount, paid_in_month.label("paid_in_month"))
+        .join(deal_params, p.deal_id == m.deal_id)
+        .cte("schedule_paid")
+    )
+    sp = schedule_paid.c
+    return (
+        select(
+            sp.deal_id, sp.due_date, sp.amount, sp.paid_in_month,
+            _positive(sp.amount - sp.paid_in_month).label("remaining_in_month"),
+        )
+        .cte("schedule_status")
+    )
+
+
+def overdue_by_deal(today: Optional[date] = None, deal_ids=None):
+    """
+    SELECT deal_id, overdue_amount, overdue_months — сделки с просроченными (не оплаченными
+    к сегодняшнему дню) месяцами графика. Годится и как подзапрос (фильтр status=overdue),
+    и для просрочки строк одной страницы (deal_ids).
+    """
+    today = today or date.today()
+    today_dt = datetime(today.year, today.month, today.day)
+    s = _schedule_status_cte(deal_ids).c
+    return (
+        select(
+            s.deal_id.label("deal_id"),
+            func.sum(s.remaining_in_month).label("overdue_amount"),
+            func.count().label("overdue_months"),
+        )
+        .where(s.due_date < today_dt, s.remaining_in_month > 0)
+        .group_by(s.deal_id)
+    )
+
+
+def _month_start(d: date) -> datetime:
+    return datetime(d.year, d.month, 1)
+
+
+def _add_months(d: datetime, months: int) -> datetime:
+    month = d.month - 1 + months
+    return datetime(d.year + month // 12, month % 12 + 1, 1)
+
+
+def _as_datetime(value) -> datetime:
+    # SQLite отдаёт due_date из агрегата строкой, Postgres — datetime
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def build_aging_report(db: Session, today: Optional[date] = None, months_ahead: int = 12) -> dict:
+    """
+    Просрочка по корзинам (0-30, 31-60, 61-90, 90+ дней) и ожидаемые поступления по месяцам.
+
+    Один запрос: график с оплатами считается один раз, дальше две группировки по нему —
+    по дате платежа (суммы; корзины и месяцы складываются из них в Python) и по сделке
+    (число сделок с просрочкой в каждой корзине).
+
+    Args:
+        db: Сессия БД
+        today: Дата отчёта (по умолчанию — сегодня)
+        months_ahead: Сколько месяцев ожидаемых поступлений показывать, начиная с текущего
+    """
+    today = today or date.today()
+    today_dt = datetime(today.year, today.month, today.day)
+    sched = _schedule_status_cte()
+    s = sched.c
+
+    # (корзина, нижняя граница включительно, верхняя — не включительно)
+    bucket_bounds = (
+        (AGING_BUCKETS[0], today_dt - timedelta(days=30), today_dt),
+        (AGING_BUCKETS[1], today_dt - timedelta(days=60), today_dt - timedelta(days=30)),
+        (AGING_BUCKETS[2], today_dt - timedelta(days=90), today_dt - timedelta(days=60)),
+        (AGING_BUCKETS[3], None, today_dt - timedelta(days=90)),
+    )
+    overdue = and_(s.due_date < today_dt, s.remaining_in_month > 0)
+
+    by_date = (
+        select(
+            s.due_date,
+            func.sum(s.amount),
+            func.sum(s.paid_in_month),
+            func.sum(s.remaining_in_month),
+            func.count(),
+            func.count(case((s.remaining_in_month > 0, 1))),
+            null(),  # выравнивание по числу колонок итоговой строки по сделкам
+        )
+        .group_by(s.due_date)
+    )
+    deal_flags = [func.max(case((overdue, 1), else_=0)).label("overdue")]
+    for i, (_, lower, upper) in enumerate(bucket_bounds):
+        cond = and_(overdue, s.due_date < upper) if lower is None else and_(overdue, s.due_date >= lower, s.due_date < upper)
+        deal_flags.append(func.max(case((cond, 1), else_=0)).label(f"b{i}"))
+    per_deal = select(*deal_flags).group_by(s.deal_id).subquery("per_deal")
+    # Строка итогов по сделкам (due_date = NULL) приклеивается к группировке по датам
+    by_deal = select(
+        null(),
+        func.count(),
+        func.sum(per_deal.c.overdue),
+        *[func.sum(per_deal.c[f"b{i}"]) for i in range(len(bucket_bounds))],
+    )
+    rows = db.execute(union_all(by_date, by_deal)).all()
+
+    period_start = _month_start(today)
+    months = [_add_months(period_start, k) for k in range(max(1, months_ahead))]
+    month_keys = {m.strftime("%Y-%m"): i for i, m in enumerate(months)}
+    aging = [{"bucket": name, "amount": 0, "months": 0, "deals": 0} for name, _, _ in bucket_bounds]
+    collections = [
+        {"month": m.strftime("%Y-%m"), "scheduled": 0, "paid": 0, "expected": 0, "payments": 0}
+        for m in months
+    ]
+    deals_in_report = overdue_deals = total_overdue = scheduled_total = paid_total = 0
+
+    for row in rows:
+        if row[0] is None:
+            deals_in_report, overdue_deals = int(row[1] or 0), int(row[2] or 0)
+            for bucket, deals_count in zip(aging, row[3:]):
+                bucket["deals"] = int(deals_count or 0)
+            continue
+        due = _as_datetime(row[0])
+        scheduled, paid_sum, remaining, count, unpaid_count = (int(v or 0) for v in row[1:6])
+        scheduled_total += scheduled
+        paid_total += paid_sum
+        if due < today_dt:
+            total_overdue += remaining
+            for bucket, (_, lower, upper) in zip(aging, bucket_bounds):
+                if due < upper and (lower is None or due >= lower):
+                    bucket["amount"] += remaining
+                    bucket["months"] += unpaid_count
+                    break
+        idx = month_keys.get(due.strftime("%Y-%m"))
+        if idx is not None:
+            month = collections[idx]
+            month["scheduled"] += scheduled
+            month["paid"] += paid_sum
+            month["expected"] += remaining
+            month["payments"] += count
+
+    return {
+        "as_of": today.isoformat(),
+        "deals_in_report": deals_in_report,
+        "overdue_deals": overdue_deals,
+        "total_overdue": total_overdue,
+        "scheduled_total": scheduled_total,
+        "paid_total": paid_total,
+        "aging": aging,
+        "expected_collections": collections,
+    }
+
+
+def get_aging_report(db: Session, months_ahead: int = 12, refresh: bool = False) -> dict:
+    """build_aging_report с кэшем на REPORTS_CACHE_TTL_SECONDS (отчёт тяжёлый, а данные меняются редко)."""
+    key = ("aging", date.today().isoformat(), months_ahead)
+    ttl = settings.REPORTS_CACHE_TTL_SECONDS
+    now = time.time()
+    if not refresh and ttl > 0:
+        with _REPORT_CACHE_LOCK:
+            entry = _REPORT_CACHE.get(key)
+        if entry and (now - entry[0]) < ttl:
+            return {**entry[1], "cached": True}
+
+    started = time.perf_counter()
+    report = build_aging_report(db, months_ahead=months_ahead)
+    report["generated_at"] = datetime.utcnow().isoformat()
+    logger.info(
+        f"Aging-отчёт построен за {(time.perf_counter() - started) * 1000:.0f} мс "
+        f"({report['deals_in_report']} сделок)"
+    )
+    with _REPORT_CACHE_LOCK:
+        # держим только актуальные ключи (дата отчёта меняется раз в сутки)
+        for stale in [k for k in _REPORT_CACHE if k[1] != key[1]]:
+            del _REPORT_CACHE[stale]
+        _REPORT_CACHE[key] = (now, report)
+    return {**report, "cached": False}
+
+
+def deal_status_expr():
+    """Статус сделки paid / active / pending в SQL — по тем же правилам, что строки экспорта и списка сделок."""
+    total = func.coalesce(Deal.total_amount, 0)
+    paid = func.coalesce(Deal.paid_amount, 0)
+    return case(
+        (and_(total > 0, paid >= total), "paid"),
+        (paid > 0, "active"),
+        (total > 0, "pending"),
+        else_="active",
+    )
+
+
+def build_export_summary(db: Session) -> dict:
+    """
+    Итоги для экспорта и KPI админки по локальной БД одним запросом.
+
+    Две группировки склеены через UNION ALL: сделки по статусу (число, суммы, оплачено, остаток)
+    и журнал платежей по источнику и статусу (число, сумма, число сделок). Python получает
+    несколько агрегированных строк и не держит в памяти ни сделки, ни платежи.
+    """
+    total = func.coalesce(Deal.total_amount, 0)
+    paid = func.coalesce(Deal.paid_amount, 0)
+    status_expr = deal_status_expr()
+    deals_by_status = (
+        select(
+            literal("deal").label("kind"),
+            status_expr.label("k1"),
+            null().label("k2"),
+            func.count(Deal.id).label("cnt"),
+            func.sum(total).label("a1"),
+            func.sum(paid).label("a2"),
+            func.sum(case((total > paid, total - paid), else_=0)).label("a3"),
+        )
+        .group_by(status_expr)
+    )
+    payments_by_source = (
+        select(
+            literal("payment"),
+            func.coalesce(PaymentLog.source, "unknown"),
+            func.coalesce(PaymentLog.status, "unknown"),
+            func.count(PaymentLog.id),
+            func.sum(func.coalesce(PaymentLog.amount, 0)),
+            func.count(func.distinct(PaymentLog.deal_id)),
+            literal(0),
+        )
+        .group_by(PaymentLog.source, PaymentLog.status)
+    )
+    rows = db.execute(union_all(deals_by_status, payments_by_source)).all()
+
+    stats = {
+        "total_deals": 0, "in_db": 0, "paid": 0, "active": 0, "pending": 0,
+        "total_amount": 0, "paid_amount": 0, "remaining_amount": 0,
+    }
+    payments = {"count": 0, "amount": 0, "paid_count": 0, "paid_amount": 0, "by_source": {}}
+    for kind, k1, k2, cnt, a1, a2, a3 in rows:
+        cnt, a1, a2, a3 = (int(v or 0) for v in (cnt, a1, a2, a3))
+        if kind == "deal":
+            stats[k1] = cnt
+            stats["total_deals"] += cnt
+            stats["total_amount"] += a1
+            stats["paid_amount"] += a2
+            stats["remaining_amount"] += a3
+            continue
+        payments["count"] += cnt
+        payments["amount"] += a1
+        if k2 == "paid":
+            payments["paid_count"] += cnt
+            payments["paid_amount"] += a1
+        payments["by_source"].setdefault(k1, {})[k2] = {"count": cnt, "amount": a1, "deals": a2}
+    # Итоги считаются по локальной БД — все сделки в ней
+    stats["in_db"] = stats["total_deals"]
+
+    return {
+        "stats": stats,
+        "payments": payments,
+        "generated_at": datetime.utcnow().isoformat(),
+    }
@@ -1,25 +1,144 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from sqlalchemy.orm import Session
 from models.payment_log import get_db
 from models.deal import Deal
+from models.schemas import DEAL_FIELDS, DEAL_INCLUDES, DEAL_RESPONSE_EXTRA_FIELDS
 from bitrix.client import get_installment_deal
-from installments.service import normalize_deal
+from installments.service import build_normalized_deal
+from core.responses import FastJSONResponse
+from installments.versions import (
+    DB_ONLY_SNAPSHOT, compute_deal_etag, etag_matches, get_bitrix_snapshot, remember_bitrix_snapshot
+)
 from core.security import get_current_user
 import logging
 from bitrix.parsing import parse_int, parse_money_to_int
 from datetime import datetime
+from typing import Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/installment", tags=["installment"])
 
+def _parse_deal_selection(fields: Optional[str], include: Optional[str]) -> Tuple[Optional[tuple], bool]:
+    """
+    Разбирает ?fields= и ?include= для /my.
+    Без обоих параметров — полный ответ; если указан хотя бы один, график отдаётся только при include=payments.
+
+    Returns:
+        (поля карточки сделки или None — все поля; отдавать ли график)
+    """
+    selected = None
+    if fields is not None:
+        selected = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        allowed = DEAL_FIELDS + DEAL_RESPONSE_EXTRA_FIELDS
+        unknown = [f for f in selected if f not in allowed]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Неизвестные поля: {', '.join(unknown)}. Допустимо: {', '.join(allowed)}"
+            )
+
+    if include is None:
+        return selected, fields is None
+    includes = {i.strip() for i in include.split(",") if i.strip()}
+    unknown = sorted(includes - set(DEAL_INCLUDES))
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неизвестные значения include: {', '.join(unknown)}. Допустимо: {', '.join(DEAL_INCLUDES)}"
+        )
+    return selected, "payments" in includes
+
+def _etag_headers(etag: str) -> dict:
+    # no-cache: браузер хранит ответ, но каждый раз перепроверяет его через If-None-Match
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+def _apply_db_fields(bitrix_deal: dict, db_deal: Deal) -> None:
+    """
+    Переносит в данные сделки из Bitrix24 поля локальной БД.
+    БД - источник истины для paid_amount и term_months (обновляются при платежах) и для графика.
+    """
+    deal_id = bitrix_deal.get("ID")
+    bitrix_deal["UF_PAID_AMOUNT"] = str(db_deal.paid_amount)
+    bitrix_deal["UF_TERM_MONTHS"] = str(db_deal.term_months)
+    bitrix_deal["initial_payment"] = int(getattr(db_deal, "initial_payment", 0) or 0)
+    bitrix_deal["SCHEDULE_START_DATE"] = (
+        db_deal.schedule_start_date.isoformat() if getattr(db_deal, "schedule_start_date", None) else None
+    )
+    bitrix_deal["SCHEDULE_DAY"] = int(getattr(db_deal, "schedule_day", 10) or 10)
+    bitrix_deal["EMAIL"] = db_deal.email  # Email из БД
+    bitrix_deal["TITLE"] = db_deal.title  # Title из БД (может быть обновлен)
+
+    # ВАЖНО: Если OPPORTUNITY в Bitrix24 = 0, используем total_amount из БД
+    opportunity = bitrix_deal.get("OPPORTUNITY", "0")
+    if isinstance(opportunity, str):
+        opportunity = opportunity.replace(" ", "").replace(",", "")
+    opportunity_float = float(opportunity) if opportunity else 0
+
+    if opportunity_float == 0 and (db_deal.total_amount or 0) > 0:
+        bitrix_deal["OPPORTUNITY"] = str(db_deal.total_amount)
+        logger.info(f"Используем total_amount из БД: {db_deal.total_amount} вместо OPPORTUNITY=0 для сделки {deal_id}")
+
+def _deal_data_from_db(db_deal: Deal) -> dict:
+    """Минимальные данные сделки только из БД (Bitrix24 недоступен или сделка там не найдена)."""
+    return {
+        "ID": db_deal.deal_id,
+        "TITLE": db_deal.title,
+        "OPPORTUNITY": str(db_deal.total_amount),
+        "UF_TERM_MONTHS": str(db_deal.term_months),
+        "UF_PAID_AMOUNT": str(db_deal.paid_amount),
+        "initial_payment": int(getattr(db_deal, "initial_payment", 0) or 0),
+        "SCHEDULE_START_DATE": (
+            db_deal.schedule_start_date.isoformat() if getattr(db_deal, "schedule_start_date", None) else None
+        ),
+        "SCHEDULE_DAY": int(getattr(db_deal, "schedule_day", 10) or 10),
+        "EMAIL": db_deal.email,
+        # Дополнительные поля для совместимости
+        "CONTACT_ID": None,
+        "STAGE_ID": None,
+        "DATE_CREATE": None,
+        "DATE_MODIFY": None
+    }
+
+def _deal_content(normalized, deal_id, user, selected_fields: Optional[tuple], include_payments: bool) -> dict:
+    """Тело ответа по одной сделке: {"deal": карточка, "payments": график} с учётом ?fields/?include."""
+    # Прокидываем признак админа и ссылку на сделку в CRM (для админ-кнопки на фронте)
+    try:
+        from core.config import settings
+        base = settings.BITRIX_WEBHOOK_URL.split("/rest/")[0].rstrip("/")
+        crm_url = f"{base}/crm/deal/details/{deal_id}/" if deal_id else ""
+    except Exception:
+        crm_url = ""
+
+    extras = {"is_admin": bool(getattr(user, "is_admin", False)), "crm_deal_url": crm_url}
+    if selected_fields is None:
+        deal_dict = normalized.deal.to_dict()
+        deal_dict.update(extras)
+    else:
+        deal_dict = {
+            f: extras[f] if f in extras else getattr(normalized.deal, f)
+            for f in selected_fields
+        }
+    content = {"deal": deal_dict}
+    if include_payments:
+        # строки графика общие с кэшем — сериализуем без копирования и не меняем
+        content["payments"] = normalized.payments
+    return content
+
 @router.get("/my")
 def my_installment(
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     user = Depends(get_current_user)
 ):
     """
     Получает данные о рассрочке для текущего пользователя.
+
+    ?fields=total_amount,paid_amount — только эти поля карточки сделки;
+    ?include=payments — добавить график платежей (без fields/include отдаётся всё).
+    Ответ несёт ETag; на If-None-Match с той же версией — 304 без тела.
     
     Логика поиска рассрочки:
     1. Сначала проверяем локальную БД по email (быстрее и надежнее)
@@ -33,18 +152,30 @@ def my_installment(
     - БД содержит актуальные данные об оплате
     - Bitrix24 используется как источник дополнительной информации
     """
+    selected_fields, include_payments = _parse_deal_selection(fields, include)
     user_identifier = user.email or user.phone or user.identifier
     logger.info(f"Запрос рассрочки для пользователя: {user_identifier} (тип: {user.identifier_type})")
     
     # 1. Сначала проверяем локальную БД (быстрее и надежнее для paid_amount)
     # Ищем по email если есть, иначе по deal_id через Bitrix24
-    db_deal = None
-    if user.email:
-        db_deal = db.query(Deal).filter(Deal.email == user.email).first()
-    elif user.identifier_type == "phone" and user.identifier:
-        # При входе по телефону мы сохраняем идентификатор в поле email (исторически так называется)
-        db_deal = db.query(Deal).filter(Deal.email == user.identifier).first()
+    # При входе по телефону мы сохраняем идентификатор в поле email (исторически так называется);
+    # кэш идентификатор → сделка покрывает случаи, когда в Deal.email записан email контакта
+    from core.identity import resolve_local_deal, remember_identity
+    db_deal = resolve_local_deal(db, user.identifier, user.identifier_type, deal_id=getattr(user, "deal_id", None))
     bitrix_deal = None
+
+    # Условный запрос: версия считается по БД и снимку Bitrix24 — без Bitrix24 и без построения графика
+    variant = (
+        f"{','.join(selected_fields) if selected_fields is not None else '*'}"
+        f"|{int(include_payments)}|{int(bool(getattr(user, 'is_admin', False)))}"
+    )
+    if db_deal and if_none_match:
+        snapshot = get_bitrix_snapshot(db_deal.deal_id)
+        if snapshot is not None:
+            etag = compute_deal_etag(db, db_deal, snapshot, variant)
+            if etag_matches(if_none_match, etag):
+                logger.info(f"Рассрочка {db_deal.deal_id} для {user_identifier} не изменилась (304)")
+                return Response(status_code=304, headers=_etag_headers(etag))
     
     if db_deal:
         logger.info(f"Найдена сделка в БД: {db_deal.deal_id} для {user_identifier}")
@@ -54,6 +185,7 @@ def my_installment(
             import bitrix.client as bitrix_client
             bitrix_deal = bitrix_client._get_full_deal(db_deal.deal_id)
             if bitrix_deal:
+                remember_bitrix_snapshot(db_deal.deal_id, bitrix_deal.get("DATE_MODIFY"))
                 logger.info(
                     f"Получены ПОЛНЫЕ данные из Bitrix24 для сделки {db_deal.deal_id}. "
                     f"Поля: {len(bitrix_deal.keys())} шт."
@@ -73,6 +205,8 @@ def my_installment(
             bitrix_deal = get_installment_deal_by_phone(user.identifier)
         else:
             bitrix_deal = get_installment_deal(user.identifier)
+        if bitrix_deal:
+            remember_bitrix_snapshot(bitrix_deal.get("ID"), bitrix_deal.get("DATE_MODIFY"))
     
     # 3. Если не найдено нигде - ошибка
     if not bitrix_deal and not db_deal:
@@ -89,17 +223,12 @@ def my_installment(
         
         # Если db_deal еще не найден, ищем по deal_id
         if not db_deal:
+            remember_identity(user.identifier, user.identifier_type, deal_id)
             db_deal = db.query(Deal).filter(Deal.deal_id == deal_id).first()
         
         # ВАЖНО: Объединяем данные из Bitrix24 с данными из БД
         # БД - источник истины для paid_amount и term_months (обновляются при платежах)
         if db_deal:
-            # Обновляем данные из Bitrix24 актуальными значениями из БД
-            # paid_amount из БД - это источник истины, так как обновляется при каждом платеже
-            bitrix_deal["UF_PAID_AMOUNT"] = str(db_deal.paid_amount)
-            bitrix_deal["UF_TERM_MONTHS"] = str(db_deal.term_months)
-            bitrix_deal["initial_payment"] = int(getattr(db_deal, "initial_payment", 0) or 0)
-
             # Фиксируем базовую дату графика (один раз), чтобы график не зависел от DATE_CREATE в Bitrix.
             # Если график уже настроен (term_months > 0), но schedule_start_date ещё не задан — ставим "сейчас".
             try:
@@ -112,22 +241,7 @@ def my_installment(
             except Exception:
                 db.rollback()
 
-            bitrix_deal["SCHEDULE_START_DATE"] = (
-                db_deal.schedule_start_date.isoformat() if getattr(db_deal, "schedule_start_date", None) else None
-            )
-            bitrix_deal["SCHEDULE_DAY"] = int(getattr(db_deal, "schedule_day", 10) or 10)
-            bitrix_deal["EMAIL"] = db_deal.email  # Email из БД
-            bitrix_deal["TITLE"] = db_deal.title  # Title из БД (может быть обновлен)
-            
-            # ВАЖНО: Если OPPORTUNITY в Bitrix24 = 0, используем total_amount из БД
-            opportunity = bitrix_deal.get("OPPORTUNITY", "0")
-            if isinstance(opportunity, str):
-                opportunity = opportunity.replace(" ", "").replace(",", "")
-            opportunity_float = float(opportunity) if opportunity else 0
-            
-            if opportunity_float == 0 and db_deal.total_amount > 0:
-                bitrix_deal["OPPORTUNITY"] = str(db_deal.total_amount)
-                logger.info(f"Используем total_amount из БД: {db_deal.total_amount} вместо OPPORTUNITY=0 для сделки {deal_id}")
+            _apply_db_fields(bitrix_deal, db_deal)
             
             logger.info(
                 f"Объединены данные: Bitrix24 (полные поля) + БД (paid_amount={db_deal.paid_amount}, "
@@ -194,20 +308,7 @@ def my_installment(
         # Если есть только db_deal (Bitrix24 недоступен или данные не найдены)
         # Создаем минимальную структуру данных из БД
         logger.info(f"Используем только данные из БД для сделки {db_deal.deal_id} (Bitrix24 недоступен)")
-        deal_data = {
-            "ID": db_deal.deal_id,
-            "TITLE": db_deal.title,
-            "OPPORTUNITY": str(db_deal.total_amount),
-            "UF_TERM_MONTHS": str(db_deal.term_months),
-            "UF_PAID_AMOUNT": str(db_deal.paid_amount),
-            "initial_payment": int(getattr(db_deal, "initial_payment", 0) or 0),
-            "EMAIL": db_deal.email,
-            # Дополнительные поля для совместимости
-            "CONTACT_ID": None,
-            "STAGE_ID": None,
-            "DATE_CREATE": None,
-            "DATE_MODIFY": None
-        }
+        deal_data = _deal_data_from_db(db_deal)
     
     # Нормализуем данные для фронтенда
     try:
@@ -224,22 +325,29 @@ def my_installment(
         except Exception as e:
             logger.debug(f"Could not load allocations for deal: {e}")
 
-        normalized = normalize_deal(deal_data)
+        # Сохранённый график (installment_schedule) — даты и суммы платежей
+        if db_deal:
+            try:
+                from installments.service import load_installment_schedule
+                deal_data["SCHEDULE_ROWS"] = load_installment_schedule(db, db_deal)
+            except Exception as e:
+                logger.debug(f"Could not load installment schedule for deal: {e}")
 
-        # Прокидываем признак админа и ссылку на сделку в CRM (для админ-кнопки на фронте)
-        try:
-            deal_id_for_url = deal_data.get("ID") or normalized.get("deal", {}).get("contract_number")
-            base = settings.BITRIX_WEBHOOK_URL.split("/rest/")[0].rstrip("/")
-            crm_url = f"{base}/crm/deal/details/{deal_id_for_url}/" if deal_id_for_url else ""
-        except Exception:
-            crm_url = ""
+        normalized = build_normalized_deal(deal_data)
 
-        if isinstance(normalized, dict) and isinstance(normalized.get("deal"), dict):
-            normalized["deal"]["is_admin"] = bool(getattr(user, "is_admin", False))
-            normalized["deal"]["crm_deal_url"] = crm_url
+        content = _deal_content(
+            normalized, deal_data.get("ID") or normalized.deal.contract_number,
+            user, selected_fields, include_payments
+        )
 
         logger.info(f"Данные о рассрочке успешно получены для {user_identifier}, сделка {deal_data.get('ID')}")
-        return normalized
+        if not db_deal:
+            return FastJSONResponse(content)
+        snapshot = str(bitrix_deal.get("DATE_MODIFY") or "") if bitrix_deal else DB_ONLY_SNAPSHOT
+        etag = compute_deal_etag(db, db_deal, snapshot, variant)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=_etag_headers(etag))
+        return FastJSONResponse(content, headers=_etag_headers(etag))
     except ValueError as e:
         logger.error(f"Ошибка при нормализации данных сделки: {e}")
         raise HTTPException(
@@ -253,3 +361,93 @@ def my_installment(
             detail="Внутренняя ошибка сервера при обработке данных рассрочки"
         )
 
+
+@router.get("/deals")
+def my_installment_deals(
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    db: Session = Depends(get_db),
+    user = Depends(get_current_user)
+):
+    """
+    Все рассрочки текущего пользователя (у клиента может быть несколько сделок, например два дома).
+
+    ?fields= и ?include= — как в /my, применяются к каждой сделке.
+
+    - Сделки контакта в Bitrix24 находятся одним batch-запросом (find_installment_deal_ids),
+      к ним добавляются сделки пользователя из локальной БД
+    - Полные данные всех сделок — один batch-запрос (get_full_deals) или кэш,
+      распределения оплат и графики — по одному запросу к БД на все сделки
+    - Если Bitrix24 недоступен — отдаются сделки из локальной БД
+    - Новые сделки первыми; записи в БД для сделок, которых там ещё нет, не создаются (это делает /my)
+    """
+    selected_fields, include_payments = _parse_deal_selection(fields, include)
+    user_identifier = user.email or user.phone or user.identifier
+    logger.info(f"Запрос всех рассрочек для пользователя: {user_identifier} (тип: {user.identifier_type})")
+
+    from bitrix.client import find_installment_deal_ids, get_full_deals
+    from core.identity import get_cached_deal_id, remember_identity
+    from installments.service import load_installment_schedules
+    from models.cash_allocation import CashAllocation
+    from sqlalchemy import or_
+
+    bitrix_ids = find_installment_deal_ids(user.identifier, user.identifier_type) or []
+
+    # Локальное зеркало: сделки, записанные на этот идентификатор, и сделка из кэша идентификатора
+    local_filter = [Deal.email == user.identifier]
+    cached_id = get_cached_deal_id(user.identifier, user.identifier_type)
+    if cached_id:
+        local_filter.append(Deal.deal_id == cached_id)
+    if bitrix_ids:
+        local_filter.append(Deal.deal_id.in_(bitrix_ids))
+    db_deals = {
+        str(d.deal_id): d
+        for d in db.query(Deal).filter(or_(*local_filter)).order_by(Deal.created_at.desc(), Deal.id.desc()).all()
+    }
+
+    deal_ids = list(dict.fromkeys(bitrix_ids + list(db_deals)))
+    if not deal_ids:
+        logger.info(f"Рассрочки не найдены ни в Bitrix24, ни в БД для {user_identifier}")
+        return FastJSONResponse({"deals": [], "count": 0})
+
+    bitrix_deals = get_full_deals(deal_ids)
+
+    allocations = {}
+    for a in db.query(CashAllocation).filter(CashAllocation.deal_id.in_(deal_ids)).all():
+        allocations.setdefault(str(a.deal_id), []).append(
+            {"month_index": a.month_index, "amount": a.amount, "payment_id": a.payment_id}
+        )
+    schedules = load_installment_schedules(db, db_deals.values())
+
+    items = []
+    for deal_id in deal_ids:
+        db_deal = db_deals.get(deal_id)
+        bitrix_deal = bitrix_deals.get(deal_id)
+        if bitrix_deal:
+            deal_data = bitrix_deal
+            if db_deal:
+                _apply_db_fields(deal_data, db_deal)
+        elif db_deal:
+            deal_data = _deal_data_from_db(db_deal)
+        else:
+            logger.warning(f"Сделка {deal_id} для {user_identifier} не получена из Bitrix24 и нет в БД")
+            continue
+        deal_data["CASH_ALLOCATIONS"] = allocations.get(deal_id, [])
+        if db_deal:
+            deal_data["SCHEDULE_ROWS"] = schedules.get(deal_id, [])
+        try:
+            normalized = build_normalized_deal(deal_data)
+        except Exception as e:
+            logger.error(f"Ошибка при нормализации данных сделки {deal_id}: {e}", exc_info=True)
+            raise HTTPException(
+                status_code=500,
+                detail="Внутренняя ошибка сервера при обработке данных рассрочки"
+            )
+        items.append(_deal_content(normalized, deal_id, user, selected_fields, include_payments))
+
+    # /my по-прежнему показывает одну сделку — последнюю, как get_installment_deal
+    if not cached_id and deal_ids[0] in db_deals:
+        remember_identity(user.identifier, user.identifier_type, deal_ids[0])
+
+    logger.info(f"Рассрочки для {user_identifier}: {len(items)} шт. ({', '.join(deal_ids)})")
+    return FastJSONResponse({"deals": items, "count": len(items)})
@@ -1,9 +1,24 @@
 from datetime import datetime
 from calendar import monthrange
+from collections import OrderedDict
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Названия месяцев на русском
+MONTH_NAMES = [
+    "Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+    "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"
+]
+
+# LRU-кэш построенных графиков. Ключ включает все входы расчёта (сумма, срок, дата первого
+# платежа, оплачено, распределения по месяцам), поэтому устаревшая запись не может быть
+# выдана; инвалидация при записи лишь сразу освобождает память от старых версий графика.
+_SCHEDULE_CACHE: "OrderedDict[tuple, list]" = OrderedDict()
+_SCHEDULE_CACHE_LOCK = threading.Lock()
+_SCHEDULE_CACHE_MAX_SIZE = 4096
+
 def _parse_iso_dt(value) -> datetime | None:
     if not value or isinstance(value, bool):
         return None
@@ -19,6 +34,140 @@ def _parse_iso_dt(value) -> datetime | None:
     except Exception:
         return None
 
+def invalidate_schedule_cache(deal_id=None) -> None:
+    """Сбрасывает закэшированные графики сделки (или все, если deal_id не указан)."""
+    with _SCHEDULE_CACHE_LOCK:
+        if deal_id is None:
+            _SCHEDULE_CACHE.clear()
+            return
+        deal_id = str(deal_id)
+        for key in [k for k in _SCHEDULE_CACHE if k[0] == deal_id]:
+            del _SCHEDULE_CACHE[key]
+
+def normalize_schedule_day(value) -> int:
+    """День платежа из настроек сделки (по умолчанию 10), ограниченный диапазоном 1..31."""
+    from bitrix.parsing import parse_int
+    schedule_day = parse_int(value) or 10
+    # ограничим до разумного диапазона, чтобы не упасть на 0/31 в феврале
+    if schedule_day < 1:
+        schedule_day = 1
+    if schedule_day > 28:
+        # 29-31 будем обрабатывать через clamp к последнему дню месяца ниже, но базовый "порог" оставим
+        schedule_day = min(schedule_day, 31)
+    return schedule_day
+
+def first_due_date(base_dt: datetime, schedule_day: int) -> datetime:
+    """
+    Первый платёж — в ближайший schedule_day:
+    если базовая дата до дня платежа — в этом месяце, иначе — в следующем.
+    """
+    if base_dt.day < schedule_day:
+        start_year, start_month = base_dt.year, base_dt.month
+    else:
+        if base_dt.month == 12:
+            start_year, start_month = base_dt.year + 1, 1
+        else:
+            start_year, start_month = base_dt.year, base_dt.month + 1
+    # clamp day to month length
+    last_day = monthrange(start_year, start_month)[1]
+    return datetime(start_year, start_month, min(schedule_day, last_day))
+
+def plan_schedule(installment_total: int, term: int, start_date: datetime) -> list:
+    """Плановые (дата, сумма) платежей без учёта оплат."""
+    monthly = installment_total // term
+    remainder = installment_total % term  # Остаток для последнего платежа
+
+    planned = []
+    for i in range(term):
+        # Дата платежа - schedule_day каждого месяца (с клэмпом по длине месяца)
+        year = start_date.year
+        month = start_date.month + i
+        while month > 12:
+            month -= 12
+            year += 1
+        last_day = monthrange(year, month)[1]
+        payment_date = datetime(year, month, min(start_date.day, last_day))
+
+        # Сумма платежа (последний платеж включает остаток)
+        amount = monthly + (remainder if i == term - 1 else 0)
+        planned.append((payment_date, amount))
+    return planned
+
+def _build_schedule(planned: list, paid_for_schedule: int, paid_by_month_index: dict) -> list:
+    payments = []
+
+    # Если есть аллокации, но paid_amount (минус initial) больше суммы аллокаций,
+    # достраиваем "виртуальную" часть (legacy/ручные правки) последовательно по месяцам.
+    alloc_sum = sum(int(v) for v in paid_by_month_index.values()) if paid_by_month_index else 0
+    extra_paid_to_allocate = max(0, paid_for_schedule - alloc_sum)
+
+    remaining_paid_seq = paid_for_schedule  # fallback последовательное распределение
+
+    for i, (payment_date, amount) in enumerate(planned):
+        # Статусы по месяцам:
+        # - если есть распределения по месяцам — используем их + докидываем недостающую часть по paid_for_schedule
+        # - иначе делаем корректный fallback: распределяем paid_for_schedule последовательно, включая partial
+        if paid_by_month_index:
+            base_paid = int(paid_by_month_index.get(i, 0) or 0)
+            # докидываем "лишнее paid" (если в БД нет аллокаций на всю сумму)
+            extra = 0
+            if extra_paid_to_allocate > 0 and base_paid < amount:
+                extra = min(amount - base_paid, extra_paid_to_allocate)
+                extra_paid_to_allocate -= extra
+            paid_in_month = base_paid + extra
+        else:
+            paid_in_month = min(int(amount), int(remaining_paid_seq))
+            remaining_paid_seq -= paid_in_month
+
+        remaining_in_month = max(0, amount - paid_in_month)
+        if remaining_in_month <= 0:
+            status = "paid"
+        elif paid_in_month > 0:
+            status = "partial"
+        else:
+            status = "pending"
+
+        month_name = MONTH_NAMES[payment_date.month - 1]
+
+        payments.append({
+            "index": i,
+            "month": f"{month_name} {payment_date.year}",
+            "date": payment_date.strftime("%d.%m.%Y"),
+            "amount": amount,
+            "status": status,
+            "paid_in_month": paid_in_month,
+            "remaining_in_month": remaining_in_month
+        })
+    return payments
+
+def _get_schedule(deal_id, installment_total: int, term: int, start_date: datetime,
+                  paid_for_schedule: int, paid_by_month_index: dict, planned: list | None = None,
+                  copy: bool = True) -> list:
+    """
+    Возвращает график из кэша или строит и запоминает его (копия, чтобы вызывающий мог её менять).
+    planned — готовые (дата, сумма) из таблицы installment_schedule; если не переданы, считаются здесь.
+    copy=False — строки из кэша без копирования (только для чтения).
+    """
+    key = (
+        str(deal_id), installment_total, term, start_date, paid_for_schedule,
+        tuple(sorted(paid_by_month_index.items())),
+    )
+    with _SCHEDULE_CACHE_LOCK:
+        cached = _SCHEDULE_CACHE.get(key)
+        if cached is not None:
+            _SCHEDULE_CACHE.move_to_end(key)
+    if cached is None:
+        if planned is None:
+            planned = plan_schedule(installment_total, term, start_date)
+        cached = _build_schedule(planned, paid_for_schedule, paid_by_month_index)
+        with _SCHEDULE_CACHE_LOCK:
+            _SCHEDULE_CACHE[key] = cached
+            while len(_SCHEDULE_CACHE) > _SCHEDULE_CACHE_MAX_SIZE:
+                _SCHEDULE_CACHE.popitem(last=False)
+    if not copy:
+        return list(cached)
+    return [dict(p) for p in cached]
+
 def normalize_deal(deal):
     """
     Нормализует данные сделки для фронтенда.
@@ -26,6 +175,16 @@ def normalize_deal(deal):
     Если сумма или срок не заданы — возвращает пустой график платежей и
     выставляет total_amount/term_months как 0.
     """
+    return build_normalized_deal(deal).to_dict()
+
+
+def build_normalized_deal(deal) -> "NormalizedDeal":
+    """
+    То же, что normalize_deal, но возвращает NormalizedDeal (models.schemas).
+    Строки графика в результате общие с кэшем графиков — их нельзя менять на месте.
+    """
+    from models.schemas import DealSummary, NormalizedDeal
+
     try:
         # Единый парсинг значений Bitrix (устойчиво к строкам/числам/пустым)
         from bitrix.parsing import parse_money_to_int, parse_int, parse_iso_date_to_ddmmyyyy, resolve_enum_values
@@ -63,6 +222,50 @@ def normalize_deal(deal):
         project_start_date = deal.get("project_start_date") or parse_iso_date_to_ddmmyyyy(deal.get("UF_CRM_1759329496690"))
         object_location = deal.get("object_location") or (str(deal.get("UF_CRM_1765399691") or "") if deal.get("UF_CRM_1765399691") is not None else "")
 
+        # Карточка сделки одинакова во всех ветках, кроме срока/оплаченных месяцев/missing_fields
+        summary = DealSummary(
+            contract_number=deal.get("ID", "UNKNOWN"),
+            total_amount=total if total > 0 else 0,
+            paid_amount=paid,
+            initial_payment=initial_payment,
+            installment_amount=installment_total,
+            term_months=term if term > 0 else 0,
+            email=deal.get("EMAIL") or deal.get("email"),
+            title=deal.get("TITLE") or deal.get("title"),
+            client_name=deal.get("CONTACT_NAME") or "",
+            client_phone=deal.get("CONTACT_PHONE") or deal.get("client_phone") or "",
+            project_type=project_type,
+            project_start_date=project_start_date,
+            object_location=object_location,
+            contact_id=deal.get("CONTACT_ID"),
+            assigned_by_id=deal.get("ASSIGNED_BY_ID"),
+            stage_id=deal.get("STAGE_ID"),
+            stage_name=deal.get("STAGE_NAME"),
+            date_create=deal.get("DATE_CREATE"),
+            date_modify=deal.get("DATE_MODIFY"),
+            begindate=deal.get("BEGINDATE"),
+            closedate=deal.get("CLOSEDATE"),
+            currency_id=deal.get("CURRENCY_ID", "RUB"),
+            comments=deal.get("COMMENTS"),
+            source_id=deal.get("SOURCE_ID"),
+            source_name=deal.get("SOURCE_NAME"),
+            company_id=deal.get("COMPANY_ID"),
+            company_name=deal.get("COMPANY_TITLE"),
+            category_id=deal.get("CATEGORY_ID"),
+        )
+
+        # Если не задана сумма или срок — нельзя корректно построить график
+        if total_missing or term_missing:
+            if total_missing:
+                summary.missing_fields.append("total_amount")
+            if term_missing:
+                summary.missing_fields.append("term_months")
+            return NormalizedDeal(deal=summary)
+
+        # Если рассрочка по сумме = 0 (всё закрыто первоначальным взносом), график не нужен
+        if installment_total <= 0:
+            return NormalizedDeal(deal=summary)
+
         # Распределения оплат по месяцам (наличные + ЮKassa) из БД
         cash_allocations = deal.get("CASH_ALLOCATIONS") or []
         paid_by_month_index = {}
@@ -75,231 +278,42 @@ def normalize_deal(deal):
         except Exception:
             paid_by_month_index = {}
 
-        # Если не задана сумма или срок — нельзя корректно построить график
-        if total_missing or term_missing:
-            missing_fields = []
-            if total_missing:
-                missing_fields.append("total_amount")
-            if term_missing:
-                missing_fields.append("term_months")
-
-            return {
-                "deal": {
-                    "contract_number": deal.get("ID", "UNKNOWN"),
-                    "total_amount": total if total > 0 else 0,
-                    "paid_amount": paid,
-                    "initial_payment": initial_payment,
-                    "installment_amount": installment_total,
-                    "term_months": term if term > 0 else 0,
-                    "paid_months": 0,
-                    "email": deal.get("EMAIL") or deal.get("email"),
-                    "title": deal.get("TITLE") or deal.get("title"),
-                    "client_name": deal.get("CONTACT_NAME") or "",
-                    "client_phone": deal.get("CONTACT_PHONE") or deal.get("client_phone") or "",
-                    "missing_fields": missing_fields,
-                    # Новые поля
-                    "project_type": project_type,
-                    "project_start_date": project_start_date,
-                    "object_location": object_location,
-                    # Дополнительные поля из Bitrix24
-                    "contact_id": deal.get("CONTACT_ID"),
-                    "assigned_by_id": deal.get("ASSIGNED_BY_ID"),
-                    "stage_id": deal.get("STAGE_ID"),
-                    "stage_name": deal.get("STAGE_NAME"),
-                    "date_create": deal.get("DATE_CREATE"),
-                    "date_modify": deal.get("DATE_MODIFY"),
-                    "begindate": deal.get("BEGINDATE"),
-                    "closedate": deal.get("CLOSEDATE"),
-                    "currency_id": deal.get("CURRENCY_ID", "RUB"),
-                    "comments": deal.get("COMMENTS"),
-                    "source_id": deal.get("SOURCE_ID"),
-                    "source_name": deal.get("SOURCE_NAME"),
-                    "company_id": deal.get("COMPANY_ID"),
-                    "company_name": deal.get("COMPANY_TITLE"),
-                    "category_id": deal.get("CATEGORY_ID")
-                },
-                "payments": []
-            }
-
-        # Если рассрочка по сумме = 0 (всё закрыто первоначальным взносом), график не нужен
-        if installment_total <= 0:
-            paid_months_count = 0
-            return {
-                "deal": {
-                    "contract_number": deal.get("ID", "UNKNOWN"),
-                    "total_amount": total,
-                    "paid_amount": paid,
-                    "initial_payment": initial_payment,
-                    "installment_amount": installment_total,
-                    "term_months": term,
-                    "paid_months": paid_months_count,
-                    "email": deal.get("EMAIL") or deal.get("email"),
-                    "title": deal.get("TITLE") or deal.get("title"),
-                    "client_name": deal.get("CONTACT_NAME") or "",
-                    "client_phone": deal.get("CONTACT_PHONE") or deal.get("client_phone") or "",
-                    "missing_fields": [],
-                    "project_type": project_type,
-                    "project_start_date": project_start_date,
-                    "object_location": object_location,
-                    "contact_id": deal.get("CONTACT_ID"),
-                    "assigned_by_id": deal.get("ASSIGNED_BY_ID"),
-                    "stage_id": deal.get("STAGE_ID"),
-                    "stage_name": deal.get("STAGE_NAME"),
-                    "date_create": deal.get("DATE_CREATE"),
-                    "date_modify": deal.get("DATE_MODIFY"),
-                    "begindate": deal.get("BEGINDATE"),
-                    "closedate": deal.get("CLOSEDATE"),
-                    "currency_id": deal.get("CURRENCY_ID", "RUB"),
-                    "comments": deal.get("COMMENTS"),
-                    "source_id": deal.get("SOURCE_ID"),
-                    "source_name": deal.get("SOURCE_NAME"),
-                    "company_id": deal.get("COMPANY_ID"),
-                    "company_name": deal.get("COMPANY_TITLE"),
-                    "category_id": deal.get("CATEGORY_ID")
-                },
-                "payments": []
-            }
-
-        monthly = installment_total // term
-        remainder = installment_total % term  # Остаток для последнего платежа
-
         # Начальная дата графика:
         # 1) если есть schedule_start_date (фиксируется при настройке графика в нашей БД) — используем её
         # 2) иначе fallback на даты сделки из Bitrix
         # 3) иначе на текущее время
-        schedule_day = parse_int(deal.get("schedule_day") or deal.get("SCHEDULE_DAY")) or 10
-        # ограничим до разумного диапазона, чтобы не упасть на 0/31 в феврале
-        if schedule_day < 1:
-            schedule_day = 1
-        if schedule_day > 28:
-            # 29-31 будем обрабатывать через clamp к последнему дню месяца ниже, но базовый "порог" оставим
-            schedule_day = min(schedule_day, 31)
+        schedule_day = normalize_schedule_day(deal.get("schedule_day") or deal.get("SCHEDULE_DAY"))
 
         base_dt = (
             _parse_iso_dt(deal.get("schedule_start_date") or deal.get("SCHEDULE_START_DATE"))
             or _parse_iso_dt(deal.get("BEGINDATE") or deal.get("DATE_CREATE") or deal.get("DATE_MODIFY"))
             or datetime.now()
         )
+        start_date = first_due_date(base_dt, schedule_day)
+
+        # Сохранённый график из installment_schedule используем, только если он построен
+        # с теми же параметрами (иначе — например, сумма в Bitrix24 изменилась — считаем заново)
+        planned = None
+        schedule_rows = deal.get("SCHEDULE_ROWS") or []
+        if schedule_rows:
+            rows = sorted(schedule_rows, key=lambda r: int(r.get("month_index")))
+            candidate = [(r.get("due_date"), int(r.get("amount") or 0)) for r in rows]
+            if (
+                len(candidate) == term
+                and [int(r.get("month_index")) for r in rows] == list(range(term))
+                and candidate[0][0] == start_date
+                and sum(a for _, a in candidate) == installment_total
+            ):
+                planned = candidate
+
+        payments = _get_schedule(
+            deal.get("ID", "UNKNOWN"), installment_total, term, start_date,
+            paid_for_schedule, paid_by_month_index, planned, copy=False
+        )
 
-        # Первый платёж — в ближайший schedule_day:
-        # если базовая дата до дня платежа — в этом месяце, иначе — в следующем.
-        if base_dt.day < schedule_day:
-            start_year, start_month = base_dt.year, base_dt.month
-        else:
-            if base_dt.month == 12:
-                start_year, start_month = base_dt.year + 1, 1
-            else:
-                start_year, start_month = base_dt.year, base_dt.month + 1
-        # clamp day to month length
-        last_day = monthrange(start_year, start_month)[1]
-        start_date = datetime(start_year, start_month, min(schedule_day, last_day))
-
-        payments = []
-        cumulative_scheduled = 0  # Накопленная сумма по графику
-        
-        # Названия месяцев на русском
-        month_names = [
-            "Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
-            "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"
-        ]
-        
-        # Если есть аллокации, но paid_amount (минус initial) больше суммы аллокаций,
-        # достраиваем "виртуальную" часть (legacy/ручные правки) последовательно по месяцам.
-        alloc_sum = sum(int(v) for v in paid_by_month_index.values()) if paid_by_month_index else 0
-        extra_paid_to_allocate = max(0, paid_for_schedule - alloc_sum)
-
-        remaining_paid_seq = paid_for_schedule  # fallback последовательное распределение
-
-        for i in range(term):
-            # Дата платежа - schedule_day каждого месяца (с клэмпом по длине месяца)
-            year = start_date.year
-            month = start_date.month + i
-            while month > 12:
-                month -= 12
-                year += 1
-            last_day = monthrange(year, month)[1]
-            payment_date = datetime(year, month, min(start_date.day, last_day))
-            
-            # Сумма платежа (последний платеж включает остаток)
-            amount = monthly + (remainder if i == term - 1 else 0)
-
-            # Статусы по месяцам:
-            # - если есть распределения по месяцам — используем их + докидываем недостающую часть по paid_for_schedule
-            # - иначе делаем корректный fallback: распределяем paid_for_schedule последовательно, включая partial
-            if paid_by_month_index:
-                base_paid = int(paid_by_month_index.get(i, 0) or 0)
-                # докидываем "лишнее paid" (если в БД нет аллокаций на всю сумму)
-                extra = 0
-                if extra_paid_to_allocate > 0 and base_paid < amount:
-                    extra = min(amount - base_paid, extra_paid_to_allocate)
-                    extra_paid_to_allocate -= extra
-                paid_in_month = base_paid + extra
-            else:
-                paid_in_month = min(int(amount), int(remaining_paid_seq))
-                remaining_paid_seq -= paid_in_month
-
-            remaining_in_month = max(0, amount - paid_in_month)
-            if remaining_in_month <= 0:
-                status = "paid"
-            elif paid_in_month > 0:
-                status = "partial"
-            else:
-                status = "pending"
-
-            cumulative_scheduled += amount
-            
-            month_name = month_names[payment_date.month - 1]
-            
-            payments.append({
-                "index": i,
-                "month": f"{month_name} {payment_date.year}",
-                "date": payment_date.strftime("%d.%m.%Y"),
-                "amount": amount,
-                "status": status,
-                "paid_in_month": paid_in_month,
-                "remaining_in_month": remaining_in_month
-            })
-        
         # Рассчитываем количество оплаченных месяцев
-        paid_months_count = sum(1 for p in payments if p["status"] == "paid")
-
-        return {
-            "deal": {
-                "contract_number": deal.get("ID", "UNKNOWN"),
-                "total_amount": total,
-                "paid_amount": paid,
-                "initial_payment": initial_payment,
-                "installment_amount": installment_total,
-                "term_months": term,
-                "paid_months": paid_months_count,
-                "email": deal.get("EMAIL") or deal.get("email"),
-                "title": deal.get("TITLE") or deal.get("title"),
-                "client_name": deal.get("CONTACT_NAME") or "",
-                "client_phone": deal.get("CONTACT_PHONE") or deal.get("client_phone") or "",
-                "missing_fields": [],
-                # Новые поля для отображения
-                "project_type": project_type,
-                "project_start_date": project_start_date,
-                "object_location": object_location,
-                # Дополнительные поля из Bitrix24
-                "contact_id": deal.get("CONTACT_ID"),
-                "assigned_by_id": deal.get("ASSIGNED_BY_ID"),
-                "stage_id": deal.get("STAGE_ID"),
-                "stage_name": deal.get("STAGE_NAME"),
-                "date_create": deal.get("DATE_CREATE"),
-                "date_modify": deal.get("DATE_MODIFY"),
-                "begindate": deal.get("BEGINDATE"),
-                "closedate": deal.get("CLOSEDATE"),
-                "currency_id": deal.get("CURRENCY_ID", "RUB"),
-                "comments": deal.get("COMMENTS"),
-                "source_id": deal.get("SOURCE_ID"),
-                "source_name": deal.get("SOURCE_NAME"),
-                "company_id": deal.get("COMPANY_ID"),
-                "company_name": deal.get("COMPANY_TITLE"),
-                "category_id": deal.get("CATEGORY_ID")
-            },
-            "payments": payments
-        }
+        summary.paid_months = sum(1 for p in payments if p["status"] == "paid")
+        return NormalizedDeal(deal=summary, payments=payments)
     except KeyError as e:
         logger.error(f"Отсутствует обязательное поле в данных сделки: {e}")
         raise ValueError(f"Неполные данные сделки: отсутствует поле {e}")
@@ -309,3 +323,170 @@ def normalize_deal(deal):
     except Exception as e:
         logger.error(f"Неожиданная ошибка при нормализации сделки: {e}", exc_info=True)
         raise
+
+
+def _planned_schedule(db_deal) -> list:
+    """[(due_date, amount)] графика сделки из БД; пусто, если дата начала или срок не заданы."""
+    total = int(db_deal.total_amount or 0)
+    term = int(db_deal.term_months or 0)
+    initial_payment = min(max(0, int(getattr(db_deal, "initial_payment", 0) or 0)), total) if total > 0 else 0
+    installment_total = max(0, total - initial_payment)
+    base_dt = getattr(db_deal, "schedule_start_date", None)
+    if total <= 0 or term <= 0 or installment_total <= 0 or base_dt is None:
+        return []
+
+    start_date = first_due_date(base_dt, normalize_schedule_day(getattr(db_deal, "schedule_day", None)))
+    return plan_schedule(installment_total, term, start_date)
+
+
+def regenerate_installment_schedule(db, db_deal) -> int:
+    """
+    Перестраивает строки installment_schedule для сделки из БД (без commit — коммитит вызывающий).
+    График сохраняется только когда зафиксирована дата начала (schedule_start_date) и задан срок;
+    иначе строки сделки удаляются.
+
+    Returns:
+        Количество записанных месяцев
+    """
+    from models.installment_schedule import InstallmentSchedule
+
+    deal_id = str(db_deal.deal_id)
+    db.query(InstallmentSchedule).filter(InstallmentSchedule.deal_id == deal_id).delete(synchronize_session=False)
+
+    planned = _planned_schedule(db_deal)
+    db.bulk_save_objects([
+        InstallmentSchedule(deal_id=deal_id, month_index=i, due_date=due_date, amount=amount)
+        for i, (due_date, amount) in enumerate(planned)
+    ])
+    return len(planned)
+
+
+def regenerate_installment_schedules(db, db_deals) -> int:
+    """
+    regenerate_installment_schedule для нескольких сделок: удаление строк и вставка
+    нового графика — по одному запросу на пачку сделок, а не на каждую (без commit).
+
+    Returns:
+        Количество записанных месяцев
+    """
+    from sqlalchemy import insert
+    from models.installment_schedule import InstallmentSchedule
+
+    by_id = {str(d.deal_id): d for d in db_deals}
+    deal_ids = list(by_id)
+    for start in range(0, len(deal_ids), 500):
+        db.query(InstallmentSchedule).filter(
+            InstallmentSchedule.deal_id.in_(deal_ids[start:start + 500])
+        ).delete(synchronize_session=False)
+
+    rows = [
+        {"deal_id": deal_id, "month_index": i, "due_date": due_date, "amount": amount}
+        for deal_id, db_deal in by_id.items()
+        for i, (due_date, amount) in enumerate(_planned_schedule(db_deal))
+    ]
+    if rows:
+        db.execute(insert(InstallmentSchedule), rows)
+    return len(rows)
+
+
+def _planned_rows(db_deal) -> list:
+    return [
+        {"month_index": i, "due_date": due_date, "amount": amount}
+        for i, (due_date, amount) in enumerate(_planned_schedule(db_deal))
+    ]
+
+
+def load_installment_schedule(db, db_deal) -> list:
+    """
+    Строки installment_schedule сделки в виде dict (для deal["SCHEDULE_ROWS"] в normalize_deal).
+    Если график для сделки ещё не сохранён (старые сделки) — строит его в памяти, не записывая:
+    чтение не пишет в БД, сохраняет такие графики backfill_installment_schedules при старте.
+    """
+    from models.installment_schedule import InstallmentSchedule
+
+    deal_id = str(db_deal.deal_id)
+    rows = (
+        db.query(InstallmentSchedule.month_index, InstallmentSchedule.due_date, InstallmentSchedule.amount)
+        .filter(InstallmentSchedule.deal_id == deal_id)
+        .order_by(InstallmentSchedule.month_index.asc())
+        .all()
+    )
+    if not rows:
+        return _planned_rows(db_deal)
+    return [{"month_index": r.month_index, "due_date": r.due_date, "amount": r.amount} for r in rows]
+
+
+def backfill_installment_schedules(chunk_size: int = 500) -> int:
+    """
+    Сохраняет график сделкам, у которых он задан (срок и дата начала), но строк в
+    installment_schedule нет (сделки до появления таблицы, ручные правки deals).
+    Пачками в отдельных транзакциях; вызывается при старте приложения.
+
+    Returns:
+        Сколько сделок получили график
+    """
+    from sqlalchemy import exists
+    from models.deal import Deal
+    from models.installment_schedule import InstallmentSchedule
+    from models.payment_log import SessionLocal
+
+    db = SessionLocal()
+    try:
+        deal_ids = [
+            str(deal_id) for (deal_id,) in db.query(Deal.deal_id).filter(
+                Deal.term_months > 0,
+                Deal.schedule_start_date.isnot(None),
+                ~exists().where(InstallmentSchedule.deal_id == Deal.deal_id),
+            )
+        ]
+    finally:
+        db.close()
+
+    filled = 0
+    for start in range(0, len(deal_ids), chunk_size):
+        db = SessionLocal()
+        try:
+            chunk = db.query(Deal).filter(Deal.deal_id.in_(deal_ids[start:start + chunk_size])).all()
+            regenerate_installment_schedules(db, chunk)
+            db.commit()
+            filled += len(chunk)
+        except Exception as e:
+            # Другой воркер мог сохранить те же графики одновременно — следующий старт доделает
+            db.rollback()
+            logger.warning(f"Не удалось сохранить графики сделок (пачка с {start}): {e}")
+        finally:
+            db.close()
+    if filled:
+        logger.info(f"Сохранены графики {filled} сделок без строк installment_schedule")
+    return filled
+
+
+def load_installment_schedules(db, db_deals) -> dict:
+    """
+    load_installment_schedule для нескольких сделок: один запрос к installment_schedule на все.
+
+    Returns:
+        {deal_id: строки графика}
+    """
+    from models.installment_schedule import InstallmentSchedule
+
+    by_id = {str(d.deal_id): d for d in db_deals}
+    if not by_id:
+        return {}
+    rows = (
+        db.query(
+            InstallmentSchedule.deal_id, InstallmentSchedule.month_index,
+            InstallmentSchedule.due_date, InstallmentSchedule.amount
+        )
+        .filter(InstallmentSchedule.deal_id.in_(list(by_id)))
+        .order_by(InstallmentSchedule.deal_id.asc(), InstallmentSchedule.month_index.asc())
+        .all()
+    )
+    schedules = {deal_id: [] for deal_id in by_id}
+    for r in rows:
+        schedules[str(r.deal_id)].append({"month_index": r.month_index, "due_date": r.due_date, "amount": r.amount})
+    # Сделки без сохранённого графика — как в load_installment_schedule (строим в памяти)
+    for deal_id, deal_rows in schedules.items():
+        if not deal_rows:
+            schedules[deal_id] = _planned_rows(by_id[deal_id])
+    return schedules
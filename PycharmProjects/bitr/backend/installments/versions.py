@@ -0,0 +1,102 @@
+"""
+Версия данных рассрочки для ETag / If-None-Match в /api/installment/my.
+
+Ответ /my зависит от строки сделки в БД (меняется updated_at), распределений оплат
+(растёт max(id) в cash_allocations) и полей сделки в Bitrix24 (меняется DATE_MODIFY).
+Версия собирается из этих трёх значений без запросов к Bitrix24 и без построения графика:
+DATE_MODIFY берётся из снимка, запомненного при последнем полном ответе. Снимок живёт
+BITRIX_SNAPSHOT_TTL_SECONDS — после этого /my снова идёт в Bitrix24 за актуальными полями.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.cash_allocation import CashAllocation
+from models.deal import Deal
+
+logger = logging.getLogger(__name__)
+
+# Меняется при изменении формата ответа /my — чтобы старые ETag у клиентов не совпали с новыми
+RESPONSE_FORMAT_VERSION = "1"
+
+# Снимок Bitrix24 не получен (Bitrix24 недоступен, ответ собран только из БД)
+DB_ONLY_SNAPSHOT = "db-only"
+
+_BITRIX_SNAPSHOTS: "OrderedDict[str, tuple]" = OrderedDict()
+_BITRIX_SNAPSHOTS_LOCK = threading.Lock()
+_BITRIX_SNAPSHOTS_MAX_SIZE = 10_000
+
+
+def remember_bitrix_snapshot(deal_id, date_modify) -> None:
+    """Запоминает DATE_MODIFY сделки из только что полученных данных Bitrix24."""
+    if not deal_id:
+        return
+    key = str(deal_id)
+    with _BITRIX_SNAPSHOTS_LOCK:
+        _BITRIX_SNAPSHOTS[key] = (str(date_modify or ""), time.time())
+        _BITRIX_SNAPSHOTS.move_to_end(key)
+        while len(_BITRIX_SNAPSHOTS) > _BITRIX_SNAPSHOTS_MAX_SIZE:
+            _BITRIX_SNAPSHOTS.popitem(last=False)
+
+
+def get_bitrix_snapshot(deal_id) -> Optional[str]:
+    """DATE_MODIFY из снимка или None, если снимка нет или он устарел."""
+    if not deal_id:
+        return None
+    key = str(deal_id)
+    with _BITRIX_SNAPSHOTS_LOCK:
+        entry = _BITRIX_SNAPSHOTS.get(key)
+        if not entry:
+            return None
+        date_modify, ts = entry
+        if (time.time() - ts) >= settings.BITRIX_SNAPSHOT_TTL_SECONDS:
+            _BITRIX_SNAPSHOTS.pop(key, None)
+            return None
+        return date_modify
+
+
+def compute_deal_etag(db: Session, db_deal: Deal, date_modify: str, variant: str = "") -> str:
+    """
+    Слабый ETag ответа /my для сделки.
+
+    Args:
+        db: Сессия БД
+        db_deal: Сделка из локальной БД
+        date_modify: DATE_MODIFY из Bitrix24 (или DB_ONLY_SNAPSHOT)
+        variant: Всё, что ещё влияет на тело ответа (выбор полей, признак админа)
+    """
+    max_alloc_id = (
+        db.query(func.max(CashAllocation.id))
+        .filter(CashAllocation.deal_id == str(db_deal.deal_id))
+        .scalar()
+    )
+    updated_at = db_deal.updated_at.isoformat() if db_deal.updated_at else ""
+    raw = "|".join([
+        RESPONSE_FORMAT_VERSION, str(db_deal.deal_id), updated_at,
+        str(max_alloc_id or 0), date_modify or "", variant,
+    ])
+    return f'W/"{hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Сравнение If-None-Match с ETag (слабое сравнение, список через запятую, "*")."""
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
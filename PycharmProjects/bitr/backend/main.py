@@ -79,6 +79,56 @@ def startup_event():
                 logger.error(f"❌ Failed to initialize database after {max_retries} attempts: {e}")
                 raise
 
+    # Графики сделок, ещё не сохранённые в installment_schedule (чтение их не записывает)
+    from installments.service import backfill_installment_schedules
+    try:
+        backfill_installment_schedules()
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить недостающие графики платежей: {e}")
+
+    # Множество админов из ADMIN_IDENTIFIERS — один раз, а не на каждый запрос
+    from core.security import init_admin_identifiers
+    init_admin_identifiers()
+
+    # Фоновая сверка pending-платежей с ЮKassa (на случай потерянных webhook)
+    from payments.reconciliation import start_reconciliation_scheduler
+    start_reconciliation_scheduler()
+
+    # Фоновая доставка magic link (email/SMS)
+    from notifications.magic_link import start_magic_link_worker
+    start_magic_link_worker()
+
+    # Снимок полного списка сделок для админки (пересборка в фоне)
+    from admin.deals_snapshot import start_deals_snapshot_refresher
+    start_deals_snapshot_refresher()
+
+@app.on_event("startup")
+async def configure_threadpool():
+    # Лимит пула потоков AnyIO задаётся из event loop, поэтому отдельный async-обработчик
+    import anyio.to_thread
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = settings.THREADPOOL_SIZE
+    logger.info(f"Пул потоков: {limiter.total_tokens}")
+
+@app.on_event("startup")
+async def start_bitrix_async_client():
+    from bitrix.client import start_async_client
+    await start_async_client()
+
+@app.on_event("shutdown")
+async def close_bitrix_async_client():
+    from bitrix.client import close_async_client
+    await close_async_client()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    from payments.reconciliation import stop_reconciliation_scheduler
+    stop_reconciliation_scheduler()
+    from notifications.magic_link import stop_magic_link_worker
+    stop_magic_link_worker()
+    from admin.deals_snapshot import stop_deals_snapshot_refresher
+    stop_deals_snapshot_refresher()
+
 # Роутеры
 app.include_router(payments_router)
 app.include_router(installments_router)
@@ -94,12 +144,12 @@ def api_root():
     return {"status": "ok", "version": "1.0.0", "message": "Bitrix Installment API"}
 
 @app.get("/health")
-def health_check():
+async def health_check():
     """Health check endpoint для мониторинга"""
     return {"status": "healthy"}
 
 @app.get("/api/health")
-def api_health_check():
+async def api_health_check():
     """Health check endpoint для мониторинга (под /api)"""
     return {"status": "healthy"}
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index, func
 from sqlalchemy.orm import relationship
 from models.payment_log import Base
 from datetime import datetime
@@ -24,3 +24,17 @@ class Deal(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+
+# Keyset-пагинация списка сделок в админке (/api/admin/deals?limit=...): индекс на каждый ключ сортировки.
+# Сортировка идёт по тем же выражениям (COALESCE — чтобы NULL не ломал сравнение с курсором).
+DEAL_LIST_INDEXES = (
+    Index("ix_deals_created_at_id", Deal.created_at, Deal.id),
+    Index("ix_deals_total_amount_id", func.coalesce(Deal.total_amount, 0), Deal.id),
+    Index("ix_deals_paid_amount_id", func.coalesce(Deal.paid_amount, 0), Deal.id),
+    Index(
+        "ix_deals_remaining_amount_id",
+        func.coalesce(Deal.total_amount, 0) - func.coalesce(Deal.paid_amount, 0),
+        Deal.id,
+    ),
+    Index("ix_deals_title_id", func.coalesce(Deal.title, ""), Deal.id),
+)
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from datetime import datetime
+
+from models.payment_log import Base
+
+
+class InstallmentSchedule(Base):
+    """
+    Сохранённый график платежей по сделке (одна строка — один месяц).
+    Перестраивается при изменении параметров графика (сумма, срок, первоначальный взнос, день платежа),
+    чтобы запросы вида «что к оплате в этом месяце по всем сделкам» были индексным диапазоном по due_date.
+    """
+    __tablename__ = "installment_schedule"
+    __table_args__ = (
+        Index("ix_installment_schedule_deal_id_month_index", "deal_id", "month_index", unique=True),
+        Index("ix_installment_schedule_due_date_deal_id", "due_date", "deal_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    deal_id = Column(String, nullable=False)
+    month_index = Column(Integer, nullable=False)  # 0..term-1
+    due_date = Column(DateTime, nullable=False)
+    amount = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, text
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Index, text
 from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime
 import os
@@ -27,11 +27,20 @@ class PaymentLog(Base):
     comment = Column(String, nullable=True)  # комментарий (например, для наличной оплаты)
     created_at = Column(DateTime, default=datetime.utcnow)
     payment_date = Column(DateTime, nullable=True)  # дата фактической оплаты (может отличаться от created_at)
+    idempotency_key = Column(String, unique=True, index=True, nullable=True)  # ключ идемпотентности создания платежа
+    confirmation_url = Column(String, nullable=True)  # URL оплаты ЮKassa (переиспользуется для повторных запросов)
+
+    __table_args__ = (
+        # Keyset-пагинация логов (новые сверху) — общий список и список по сделке
+        Index("ix_payment_logs_created_at_id", "created_at", "id"),
+        Index("ix_payment_logs_deal_id_created_at_id", "deal_id", "created_at", "id"),
+    )
 
 def init_db():
     # Импортируем все модели для создания таблиц
     from models.deal import Deal  # noqa: F401
     from models.cash_allocation import CashAllocation  # noqa: F401
+    from models.installment_schedule import InstallmentSchedule  # noqa: F401
     Base.metadata.create_all(bind=engine)
 
     # Легкая миграция: добавляем колонку comment, если ее нет
@@ -119,6 +128,55 @@ def init_db():
     except Exception:
         pass
 
+    # Миграция: ключ идемпотентности и URL оплаты для повторного использования при создании платежа
+    try:
+        if "sqlite" in str(DATABASE_URL):
+            with engine.connect() as conn:
+                cols = conn.execute(text("PRAGMA table_info(payment_logs)")).fetchall()
+                col_names = {row[1] for row in cols}
+                if "idempotency_key" not in col_names:
+                    conn.execute(text("ALTER TABLE payment_logs ADD COLUMN idempotency_key VARCHAR"))
+                if "confirmation_url" not in col_names:
+                    conn.execute(text("ALTER TABLE payment_logs ADD COLUMN confirmation_url VARCHAR"))
+                conn.execute(text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS ix_payment_logs_idempotency_key ON payment_logs (idempotency_key)"
+                ))
+                conn.commit()
+        else:
+            with engine.connect() as conn:
+                conn.execute(text("ALTER TABLE payment_logs ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR NULL"))
+                conn.execute(text("ALTER TABLE payment_logs ADD COLUMN IF NOT EXISTS confirmation_url VARCHAR NULL"))
+                conn.execute(text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS ix_payment_logs_idempotency_key ON payment_logs (idempotency_key)"
+                ))
+                conn.commit()
+    except Exception:
+        pass
+
+    # Миграция: составные индексы для keyset-пагинации логов платежей
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_payment_logs_created_at_id ON payment_logs (created_at, id)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_payment_logs_deal_id_created_at_id ON payment_logs (deal_id, created_at, id)"
+            ))
+            conn.commit()
+    except Exception:
+        pass
+
+    # Миграция: индексы для сортировки и keyset-пагинации списка сделок в админке
+    try:
+        from sqlalchemy.schema import CreateIndex
+        from models.deal import DEAL_LIST_INDEXES
+        with engine.connect() as conn:
+            for index in DEAL_LIST_INDEXES:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+            conn.commit()
+    except Exception:
+        pass
+
 def get_db():
     db = SessionLocal()
     try:
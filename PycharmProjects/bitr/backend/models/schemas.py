@@ -0,0 +1,70 @@
+"""
+Типизированные модели ответа по рассрочке (результат installments.service.build_normalized_deal).
+
+Обычные dataclass со __slots__: без валидации pydantic и без dict на каждый экземпляр —
+нормализация выполняется на каждый запрос /api/installment/my и для каждой сделки в админке.
+"""
+
+from dataclasses import dataclass, field, fields as dataclass_fields
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+@dataclass(slots=True)
+class DealSummary:
+    """Карточка сделки (ключ "deal" в ответе /api/installment/my)."""
+    contract_number: Any
+    total_amount: int
+    paid_amount: int
+    initial_payment: int
+    installment_amount: int
+    term_months: int
+    paid_months: int = 0
+    email: Optional[str] = None
+    title: Optional[str] = None
+    client_name: str = ""
+    client_phone: str = ""
+    missing_fields: List[str] = field(default_factory=list)
+    project_type: Any = None
+    project_start_date: Any = None
+    object_location: Any = None
+    # Дополнительные поля из Bitrix24
+    contact_id: Any = None
+    assigned_by_id: Any = None
+    stage_id: Any = None
+    stage_name: Any = None
+    date_create: Any = None
+    date_modify: Any = None
+    begindate: Any = None
+    closedate: Any = None
+    currency_id: Any = "RUB"
+    comments: Any = None
+    source_id: Any = None
+    source_name: Any = None
+    company_id: Any = None
+    company_name: Any = None
+    category_id: Any = None
+
+    def to_dict(self, fields: Optional[Iterable[str]] = None) -> dict:
+        names = DEAL_FIELDS if fields is None else fields
+        return {name: getattr(self, name) for name in names}
+
+
+DEAL_FIELDS: Tuple[str, ...] = tuple(f.name for f in dataclass_fields(DealSummary))
+# Поля, которые /api/installment/my добавляет к карточке сделки сам (зависят от пользователя)
+DEAL_RESPONSE_EXTRA_FIELDS: Tuple[str, ...] = ("is_admin", "crm_deal_url")
+DEAL_INCLUDES: Tuple[str, ...] = ("payments",)
+
+
+@dataclass(slots=True)
+class NormalizedDeal:
+    """
+    Сделка с графиком платежей. payments — строки графика в формате
+    {"index", "month", "date", "amount", "status", "paid_in_month", "remaining_in_month"};
+    они общие с кэшем графиков, поэтому менять их можно только в копии (см. to_dict).
+    """
+    deal: DealSummary
+    payments: List[dict] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        """Полный ответ в виде dict; строки графика копируются, их можно менять."""
+        return {"deal": self.deal.to_dict(), "payments": [dict(p) for p in self.payments]}
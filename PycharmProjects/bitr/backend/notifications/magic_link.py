@@ -0,0 +1,246 @@
+"""
+Фоновая доставка magic link (email / SMS).
+
+/api/auth/magic-link только ставит ссылку в очередь и сразу отвечает — время ответа не зависит
+от SMTP-сервера или SMS-шлюза. Фоновый поток берёт сообщения из очереди и передаёт их отправщику
+канала (MAGIC_LINK_EMAIL_SENDER / MAGIC_LINK_SMS_SENDER). Неудачная отправка повторяется до
+MAGIC_LINK_MAX_ATTEMPTS раз с растущей задержкой.
+
+Отправщики:
+- log  — пишет ссылку в лог и хранит последние сообщения в памяти (локальная разработка, get_outbox)
+- smtp — email через SMTP (SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_FROM)
+- http — SMS через HTTP-шлюз: POST SMS_GATEWAY_URL {"to": телефон, "text": текст}
+
+Свой отправщик подключается через register_sender(имя, класс) и настройку с этим именем.
+"""
+
+import inspect
+import logging
+import queue
+import smtplib
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+from typing import Dict, List, Optional, Type
+
+import requests
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MagicLinkMessage:
+    identifier: str
+    identifier_type: str  # "email" или "phone"
+    link: str
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def text(self) -> str:
+        return f"Ссылка для входа в личный кабинет рассрочки (действует 15 минут): {self.link}"
+
+
+class MagicLinkSender(ABC):
+    """Отправщик magic link. send() при неудаче бросает исключение — сообщение будет отправлено повторно."""
+
+    name = "base"
+
+    @abstractmethod
+    def send(self, message: MagicLinkMessage) -> None:
+        ...
+
+
+class LogSender(MagicLinkSender):
+    """Локальная замена транспорта: ссылка пишется в лог и в outbox в памяти."""
+
+    name = "log"
+
+    def send(self, message: MagicLinkMessage) -> None:
+        logger.info(f"Magic link для {message.identifier_type} {message.identifier}: {message.link}")
+        with _OUTBOX_LOCK:
+            _OUTBOX.append({
+                "identifier": message.identifier,
+                "identifier_type": message.identifier_type,
+                "link": message.link,
+                "sent_at": time.time(),
+            })
+
+
+class SmtpEmailSender(MagicLinkSender):
+    name = "smtp"
+
+    def send(self, message: MagicLinkMessage) -> None:
+        if not settings.SMTP_HOST:
+            raise RuntimeError("SMTP не настроен (SMTP_HOST)")
+        email = EmailMessage()
+        email["Subject"] = "Вход в личный кабинет рассрочки"
+        email["From"] = settings.SMTP_FROM or settings.SMTP_USER or ""
+        email["To"] = message.identifier
+        email.set_content(message.text)
+        with smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=10) as smtp:
+            if settings.SMTP_USE_TLS:
+                smtp.starttls()
+            if settings.SMTP_USER:
+                smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD or "")
+            smtp.send_message(email)
+
+
+class HttpSmsSender(MagicLinkSender):
+    name = "http"
+
+    def send(self, message: MagicLinkMessage) -> None:
+        if not settings.SMS_GATEWAY_URL:
+            raise RuntimeError("SMS-шлюз не настроен (SMS_GATEWAY_URL)")
+        headers = {}
+        if settings.SMS_GATEWAY_TOKEN:
+            headers["Authorization"] = f"Bearer {settings.SMS_GATEWAY_TOKEN}"
+        res = requests.post(
+            settings.SMS_GATEWAY_URL,
+            json={"to": message.identifier, "text": message.text},
+            headers=headers,
+            timeout=10,
+        )
+        res.raise_for_status()
+
+
+_SENDER_CLASSES: Dict[str, Type[MagicLinkSender]] = {
+    LogSender.name: LogSender,
+    SmtpEmailSender.name: SmtpEmailSender,
+    HttpSmsSender.name: HttpSmsSender,
+}
+_SENDERS: Dict[str, MagicLinkSender] = {}
+_SENDERS_LOCK = threading.Lock()
+
+# Последние сообщения LogSender (для локальной разработки и проверки)
+_OUTBOX: deque = deque(maxlen=100)
+_OUTBOX_LOCK = threading.Lock()
+
+_queue: "queue.Queue[MagicLinkMessage]" = queue.Queue(maxsize=settings.MAGIC_LINK_QUEUE_SIZE)
+_worker_thread: Optional[threading.Thread] = None
+_worker_stop = threading.Event()
+_worker_lock = threading.Lock()
+
+
+def register_sender(name: str, sender_cls: Type[MagicLinkSender]) -> None:
+    """Подключает отправщик под именем name (используется в MAGIC_LINK_EMAIL_SENDER / MAGIC_LINK_SMS_SENDER)."""
+    if not issubclass(sender_cls, MagicLinkSender) or inspect.isabstract(sender_cls):
+        raise TypeError(f"Отправщик magic link '{name}' должен наследовать MagicLinkSender и реализовать send()")
+    with _SENDERS_LOCK:
+        _SENDER_CLASSES[name] = sender_cls
+        _SENDERS.pop(name, None)
+
+
+def get_sender(identifier_type: str) -> MagicLinkSender:
+    name = settings.MAGIC_LINK_SMS_SENDER if identifier_type == "phone" else settings.MAGIC_LINK_EMAIL_SENDER
+    with _SENDERS_LOCK:
+        sender = _SENDERS.get(name)
+        if sender is None:
+            sender_cls = _SENDER_CLASSES.get(name)
+            if sender_cls is None:
+                logger.error(f"Неизвестный отправщик magic link '{name}', используем log")
+                sender_cls = LogSender
+            sender = _SENDERS[name] = sender_cls()
+        return sender
+
+
+def get_outbox(identifier: Optional[str] = None) -> List[dict]:
+    """Сообщения, «отправленные» LogSender (новые последними)."""
+    with _OUTBOX_LOCK:
+        items = list(_OUTBOX)
+    if identifier is not None:
+        items = [m for m in items if m["identifier"] == identifier]
+    return items
+
+
+def enqueue_magic_link(identifier: str, identifier_type: str, link: str) -> bool:
+    """
+    Ставит magic link в очередь на отправку (не блокирует).
+
+    Returns:
+        False, если очередь переполнена
+    """
+    start_magic_link_worker()
+    try:
+        _queue.put_nowait(MagicLinkMessage(identifier, identifier_type, link))
+    except queue.Full:
+        logger.error(f"Очередь magic link переполнена, ссылка для {identifier} не поставлена")
+        return False
+    return True
+
+
+def _retry_later(message: MagicLinkMessage) -> None:
+    try:
+        _queue.put_nowait(message)
+    except queue.Full:
+        logger.error(f"Очередь magic link переполнена, повтор для {message.identifier} отменён")
+
+
+def _deliver(message: MagicLinkMessage) -> None:
+    message.attempts += 1
+    sender = get_sender(message.identifier_type)
+    try:
+        sender.send(message)
+        logger.info(
+            f"Magic link для {message.identifier} отправлен через {sender.name} "
+            f"(попытка {message.attempts}, в очереди {time.time() - message.created_at:.1f} сек)"
+        )
+    except Exception as e:
+        if message.attempts >= settings.MAGIC_LINK_MAX_ATTEMPTS:
+            logger.error(
+                f"Не удалось отправить magic link для {message.identifier} через {sender.name} "
+                f"после {message.attempts} попыток: {e}"
+            )
+            return
+        delay = settings.MAGIC_LINK_RETRY_DELAY_SECONDS * (2 ** (message.attempts - 1))
+        logger.warning(
+            f"Ошибка отправки magic link для {message.identifier} через {sender.name} "
+            f"(попытка {message.attempts}/{settings.MAGIC_LINK_MAX_ATTEMPTS}), повтор через {delay:g} сек: {e}"
+        )
+        # Повтор не занимает поток доставки: сообщение вернётся в очередь по таймеру
+        timer = threading.Timer(delay, _retry_later, args=(message,))
+        timer.daemon = True
+        timer.start()
+
+
+def _worker_loop():
+    while not _worker_stop.is_set():
+        try:
+            message = _queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        try:
+            _deliver(message)
+        except Exception as e:
+            logger.error(f"Ошибка в потоке доставки magic link: {e}", exc_info=True)
+        finally:
+            _queue.task_done()
+
+
+def start_magic_link_worker():
+    """Запускает фоновый поток доставки magic link (повторный вызов ничего не делает)."""
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread and _worker_thread.is_alive():
+            return
+        _worker_stop.clear()
+        _worker_thread = threading.Thread(target=_worker_loop, name="magic-link-delivery", daemon=True)
+        _worker_thread.start()
+    logger.info(
+        f"Доставка magic link: поток запущен (email: {settings.MAGIC_LINK_EMAIL_SENDER}, "
+        f"телефон: {settings.MAGIC_LINK_SMS_SENDER})"
+    )
+
+
+def stop_magic_link_worker():
+    global _worker_thread
+    _worker_stop.set()
+    if _worker_thread:
+        _worker_thread.join(timeout=5)
+        _worker_thread = None
+        logger.info("Доставка magic link: поток остановлен")
@@ -184,3 +184,23 @@ def format_payment_notification(deal_id: str, amount: int, payment_id: str, sour
         except:
             return f"💳 <b>Новый платеж</b>\n\n📋 Сделка: <b>{deal_id}</b>"
 
+
+def format_cash_import_notification(payments_count: int, deals_count: int, total_amount: int, admin: Optional[str] = None) -> str:
+    """
+    Сводное уведомление о пакетном импорте наличных оплат (одно сообщение на весь файл)
+
+    Args:
+        payments_count: Сколько платежей записано
+        deals_count: По скольким сделкам
+        total_amount: Общая сумма в рублях
+        admin: Кто загрузил файл (опционально)
+    """
+    message = "💵 <b>Импорт наличных оплат</b>\n\n"
+    message += f"💰 Сумма: <b>{int(total_amount or 0):,} ₽</b>\n".replace(",", " ")
+    message += f"🧾 Платежей: <b>{int(payments_count or 0)}</b>\n"
+    message += f"📋 Сделок: <b>{int(deals_count or 0)}</b>"
+    if admin:
+        admin_str = str(admin).strip().replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        if admin_str:
+            message += f"\n👤 Загрузил: {admin_str}"
+    return message
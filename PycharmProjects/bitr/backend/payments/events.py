@@ -0,0 +1,129 @@
+"""
+События о проведённых платежах для SSE-потока /api/payments/events.
+
+process_webhook после коммита публикует событие в in-process шину, и подписчики этой
+сделки в том же процессе получают его сразу. Подписчик, подключённый к другому воркеру
+uvicorn, шину не видит — для него поток раз в PAYMENT_EVENTS_POLL_SECONDS сверяется
+с payment_logs (индекс по deal_id). Так клиенту не нужно опрашивать /api/installment/my
+(и через него Bitrix24), пока ждёт webhook после возврата из ЮKassa.
+"""
+
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from models.deal import Deal
+from models.payment_log import PaymentLog, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Очередь подписчика не должна расти бесконечно, если клиент не читает поток
+_QUEUE_MAX_SIZE = 100
+
+
+class Subscription:
+    """Подписка одного SSE-клиента на события сделки."""
+
+    def __init__(self, deal_id: str, loop: asyncio.AbstractEventLoop):
+        self.deal_id = deal_id
+        self.loop = loop
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=_QUEUE_MAX_SIZE)
+
+    def _put(self, event: dict) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning(f"Очередь событий сделки {self.deal_id} переполнена, событие пропущено")
+
+
+_SUBSCRIBERS: Dict[str, Set[Subscription]] = {}
+_SUBSCRIBERS_LOCK = threading.Lock()
+
+
+def subscribe(deal_id) -> Subscription:
+    """Подписывает текущий event loop на события сделки (вызывать из async-кода)."""
+    sub = Subscription(str(deal_id), asyncio.get_running_loop())
+    with _SUBSCRIBERS_LOCK:
+        _SUBSCRIBERS.setdefault(sub.deal_id, set()).add(sub)
+    return sub
+
+
+def unsubscribe(sub: Subscription) -> None:
+    with _SUBSCRIBERS_LOCK:
+        subs = _SUBSCRIBERS.get(sub.deal_id)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del _SUBSCRIBERS[sub.deal_id]
+
+
+def subscriber_count(deal_id=None) -> int:
+    with _SUBSCRIBERS_LOCK:
+        if deal_id is None:
+            return sum(len(s) for s in _SUBSCRIBERS.values())
+        return len(_SUBSCRIBERS.get(str(deal_id), ()))
+
+
+def publish_payment_event(deal_id, payment_id: str, amount: int, paid_amount: Optional[int] = None) -> int:
+    """
+    Отправляет событие "платёж проведён" подписчикам сделки в этом процессе.
+    Потокобезопасно: process_webhook вызывается и из event loop (webhook), и из потока сверки.
+
+    Returns:
+        Сколько подписчиков получили событие
+    """
+    event = {
+        "type": "payment.succeeded",
+        "deal_id": str(deal_id),
+        "payment_id": payment_id,
+        "amount": amount,
+        "paid_amount": paid_amount,
+    }
+    with _SUBSCRIBERS_LOCK:
+        subs = list(_SUBSCRIBERS.get(str(deal_id), ()))
+    for sub in subs:
+        try:
+            sub.loop.call_soon_threadsafe(sub._put, event)
+        except RuntimeError:
+            # event loop подписчика уже закрыт — подписка умерла вместе с ним
+            unsubscribe(sub)
+    if subs:
+        logger.info(f"Событие о платеже {payment_id} отправлено {len(subs)} подписчикам сделки {deal_id}")
+    return len(subs)
+
+
+def load_paid_payments(deal_id, since: Optional[datetime] = None, payment_id: Optional[str] = None) -> List[dict]:
+    """
+    Проведённые платежи сделки из payment_logs в формате события: только платёж payment_id,
+    если он указан, иначе — созданные не раньше since.
+    Используется потоком для сверки с БД — события, опубликованные другими воркерами.
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(PaymentLog.payment_id, PaymentLog.amount).filter(
+            PaymentLog.deal_id == str(deal_id),
+            PaymentLog.status == "paid",
+        )
+        if payment_id is not None:
+            query = query.filter(PaymentLog.payment_id == payment_id)
+        elif since is not None:
+            query = query.filter(PaymentLog.created_at >= since)
+        rows = query.all()
+        if not rows:
+            return []
+        paid_amount = db.query(Deal.paid_amount).filter(Deal.deal_id == str(deal_id)).scalar()
+        return [
+            {
+                "type": "payment.succeeded",
+                "deal_id": str(deal_id),
+                "payment_id": r.payment_id,
+                "amount": r.amount,
+                "paid_amount": paid_amount,
+            }
+            for r in rows
+        ]
+    finally:
+        db.close()
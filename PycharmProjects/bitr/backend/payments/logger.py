@@ -1,10 +1,21 @@
 from models.payment_log import PaymentLog, SessionLocal
+from sqlalchemy import and_, or_, func
 from datetime import datetime
+from typing import Optional, Tuple, List, Dict, Any
+import base64
 import logging
 
 logger = logging.getLogger(__name__)
 
-def log_payment(deal_id: str, payment_id: str, amount: int, status: str, source: str = "yookassa"):
+def log_payment(
+    deal_id: str,
+    payment_id: str,
+    amount: int,
+    status: str,
+    source: str = "yookassa",
+    idempotency_key: Optional[str] = None,
+    confirmation_url: Optional[str] = None
+):
     """
     Логирование платежа в БД
     
@@ -14,6 +25,8 @@ def log_payment(deal_id: str, payment_id: str, amount: int, status: str, source:
         amount: Сумма платежа в копейках
         status: Статус ("pending", "paid", "failed")
         source: Источник ("yookassa", "admin")
+        idempotency_key: Ключ идемпотентности создания платежа (опционально)
+        confirmation_url: URL оплаты ЮKassa (опционально)
     """
     db = SessionLocal()
     try:
@@ -28,6 +41,8 @@ def log_payment(deal_id: str, payment_id: str, amount: int, status: str, source:
             amount=amount,
             status=status,
             source=source,
+            idempotency_key=idempotency_key,
+            confirmation_url=confirmation_url,
             created_at=datetime.utcnow()
         )
         db.add(log_entry)
@@ -41,25 +56,211 @@ def log_payment(deal_id: str, payment_id: str, amount: int, status: str, source:
     finally:
         db.close()
 
-def get_payment_logs(deal_id: str = None):
+def find_payment_by_idempotency_key(idempotency_key: str) -> Optional[PaymentLog]:
     """
-    Получить логи платежей
+    Найти платеж, созданный с указанным ключом идемпотентности
+    
+    Args:
+        idempotency_key: Ключ идемпотентности
+    
+    Returns:
+        PaymentLog или None
+    """
+    if not idempotency_key:
+        return None
+    db = SessionLocal()
+    try:
+        return db.query(PaymentLog).filter(PaymentLog.idempotency_key == idempotency_key).first()
+    except Exception as e:
+        logger.error(f"Error finding payment by idempotency key: {e}", exc_info=True)
+        return None
+    finally:
+        db.close()
+
+def find_recent_pending_payment(deal_id, amount: int, since: datetime) -> Optional[PaymentLog]:
+    """
+    Последний pending-платеж ЮKassa по сделке на ту же сумму, созданный не раньше since
+    и с сохранённым URL оплаты (повторный запрос без ключа идемпотентности от клиента).
+    """
+    db = SessionLocal()
+    try:
+        return (
+            db.query(PaymentLog)
+            .filter(
+                PaymentLog.deal_id == str(deal_id),
+                PaymentLog.created_at >= since,
+                PaymentLog.amount == int(amount),
+                PaymentLog.status == "pending",
+                PaymentLog.source == "yookassa",
+                PaymentLog.confirmation_url.isnot(None),
+            )
+            .order_by(PaymentLog.created_at.desc(), PaymentLog.id.desc())
+            .first()
+        )
+    except Exception as e:
+        logger.error(f"Error finding recent pending payment for deal {deal_id}: {e}", exc_info=True)
+        return None
+    finally:
+        db.close()
+
+PAYMENT_LOGS_DEFAULT_LIMIT = 50
+PAYMENT_LOGS_MAX_LIMIT = 500
+
+def encode_payment_logs_cursor(created_at: datetime, log_id: int) -> str:
+    """Курсор keyset-пагинации по (created_at, id)"""
+    raw = f"{created_at.isoformat()}|{int(log_id)}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_payment_logs_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Разбирает курсор пагинации
+    
+    Raises:
+        ValueError: если курсор некорректный
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at_raw, log_id_raw = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at_raw), int(log_id_raw)
+    except Exception:
+        raise ValueError("Некорректный курсор пагинации")
+
+def _split_filter(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    return [v.strip() for v in str(value).split(",") if v.strip()]
+
+def apply_payment_log_filters(
+    query,
+    deal_id: Optional[str] = None,
+    source: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+):
+    """
+    Применяет фильтры к запросу по payment_logs.
+    source и status принимают одно значение или несколько через запятую.
+    date_from включительно, date_to — не включительно.
+    """
+    if deal_id:
+        query = query.filter(PaymentLog.deal_id == str(deal_id))
+    sources = _split_filter(source)
+    if sources:
+        query = query.filter(PaymentLog.source.in_(sources))
+    statuses = _split_filter(status)
+    if statuses:
+        query = query.filter(PaymentLog.status.in_(statuses))
+    if date_from:
+        query = query.filter(PaymentLog.created_at >= date_from)
+    if date_to:
+        query = query.filter(PaymentLog.created_at < date_to)
+    return query
+
+PAYMENT_LOG_COLUMNS = (
+    PaymentLog.id,
+    PaymentLog.deal_id,
+    PaymentLog.payment_id,
+    PaymentLog.amount,
+    PaymentLog.status,
+    PaymentLog.source,
+    PaymentLog.comment,
+    PaymentLog.created_at,
+    PaymentLog.payment_date,
+)
+
+def payment_log_row_to_dict(row) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "deal_id": row.deal_id,
+        "payment_id": row.payment_id,
+        "amount": row.amount,
+        "status": row.status,
+        "source": row.source,
+        "comment": row.comment,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "payment_date": row.payment_date.isoformat() if row.payment_date else None,
+    }
+
+def get_payment_logs(
+    deal_id: str = None,
+    source: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = PAYMENT_LOGS_DEFAULT_LIMIT,
+    include_totals: bool = True
+) -> Dict[str, Any]:
+    """
+    Получить страницу логов платежей (новые сверху)
+    
+    Пагинация keyset по (created_at, id) — стоимость запроса не зависит от глубины страницы.
     
     Args:
         deal_id: Опционально - фильтр по ID сделки
+        source: Опционально - фильтр по источнику (через запятую)
+        status: Опционально - фильтр по статусу (через запятую)
+        date_from: Опционально - created_at >= date_from
+        date_to: Опционально - created_at < date_to
+        cursor: Курсор следующей страницы (из next_cursor предыдущего ответа)
+        limit: Размер страницы (не больше PAYMENT_LOGS_MAX_LIMIT)
+        include_totals: Посчитать итоги по всему отфильтрованному набору
     
     Returns:
-        List[PaymentLog]
+        {"items": [...], "next_cursor": str | None, "has_more": bool, "totals": {...} | None}
+    
+    Raises:
+        ValueError: если курсор некорректный
     """
+    limit = max(1, min(int(limit or PAYMENT_LOGS_DEFAULT_LIMIT), PAYMENT_LOGS_MAX_LIMIT))
+    cursor_key = decode_payment_logs_cursor(cursor) if cursor else None
+
     db = SessionLocal()
     try:
-        query = db.query(PaymentLog)
-        if deal_id:
-            query = query.filter(PaymentLog.deal_id == str(deal_id))
-        return query.order_by(PaymentLog.created_at.desc()).all()
+        query = apply_payment_log_filters(
+            db.query(*PAYMENT_LOG_COLUMNS), deal_id, source, status, date_from, date_to
+        )
+        if cursor_key:
+            cursor_created_at, cursor_id = cursor_key
+            query = query.filter(or_(
+                PaymentLog.created_at < cursor_created_at,
+                and_(PaymentLog.created_at == cursor_created_at, PaymentLog.id < cursor_id)
+            ))
+        rows = query.order_by(PaymentLog.created_at.desc(), PaymentLog.id.desc()).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = None
+        if has_more and rows:
+            next_cursor = encode_payment_logs_cursor(rows[-1].created_at, rows[-1].id)
+
+        totals = None
+        if include_totals:
+            # Итоги — одним GROUP BY по отфильтрованному набору (без курсора)
+            grouped = apply_payment_log_filters(
+                db.query(PaymentLog.status, func.count(PaymentLog.id), func.coalesce(func.sum(PaymentLog.amount), 0)),
+                deal_id, source, status, date_from, date_to
+            ).group_by(PaymentLog.status).all()
+            by_status = {
+                (st or "unknown"): {"count": int(cnt), "amount": int(amt or 0)}
+                for st, cnt, amt in grouped
+            }
+            totals = {
+                "count": sum(v["count"] for v in by_status.values()),
+                "amount": sum(v["amount"] for v in by_status.values()),
+                "by_status": by_status,
+            }
+
+        return {
+            "items": [payment_log_row_to_dict(r) for r in rows],
+            "next_cursor": next_cursor,
+            "has_more": has_more,
+            "totals": totals,
+        }
     except Exception as e:
         logger.error(f"Error getting payment logs: {e}", exc_info=True)
-        return []
+        return {"items": [], "next_cursor": None, "has_more": False, "totals": None}
     finally:
         db.close()
 
@@ -0,0 +1,188 @@
+"""
+Сверка зависших pending-платежей с ЮKassa.
+
+Если webhook от ЮKassa потерялся, запись в payment_logs навсегда остаётся в статусе
+"pending", а paid_amount сделки не обновляется. Сверка периодически проходит по
+pending-платежам старше RECONCILE_MIN_AGE_MINUTES, запрашивает их статус в ЮKassa
+и передаёт подтверждённые платежи в тот же идемпотентный обработчик, что и webhook
+(process_webhook). Повторная обработка безопасна: process_webhook блокирует строку
+сделки и не начисляет уже оплаченный платёж второй раз.
+
+Для локальной проверки используйте scripts/fake_yookassa_server.py и YOOKASSA_API_URL.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List
+
+from yookassa import Payment
+
+from core.config import settings
+from models.payment_log import PaymentLog, SessionLocal
+from payments.logger import update_payment_status
+from payments.yookassa import process_webhook
+
+logger = logging.getLogger(__name__)
+
+_scheduler_thread: Optional[threading.Thread] = None
+_scheduler_stop = threading.Event()
+_run_lock = threading.Lock()
+
+
+def _iter_pending_batches(min_age_minutes: int, batch_size: int):
+    """
+    Постранично отдаёт pending-платежи ЮKassa старше min_age_minutes.
+    Пагинация по id (keyset), т.к. набор pending-записей меняется в процессе сверки.
+    """
+    threshold = datetime.utcnow() - timedelta(minutes=min_age_minutes)
+    last_id = 0
+    while True:
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(PaymentLog.id, PaymentLog.payment_id)
+                .filter(
+                    PaymentLog.status == "pending",
+                    PaymentLog.source == "yookassa",
+                    PaymentLog.created_at <= threshold,
+                    PaymentLog.id > last_id,
+                )
+                .order_by(PaymentLog.id.asc())
+                .limit(batch_size)
+                .all()
+            )
+        finally:
+            db.close()
+
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield [r.payment_id for r in rows]
+        if len(rows) < batch_size:
+            return
+
+
+def _fetch_payment(payment_id: str) -> Optional[Dict[str, Any]]:
+    """Получает платёж из ЮKassa (GET /payments/{id}) в виде словаря."""
+    try:
+        return dict(Payment.find_one(payment_id))
+    except Exception as e:
+        logger.warning(f"Reconcile: не удалось получить платёж {payment_id} из ЮKassa: {e}")
+        return None
+
+
+def _apply_payment_state(payment_id: str, obj: Optional[Dict[str, Any]]) -> str:
+    """
+    Применяет статус платежа из ЮKassa к локальному учёту.
+
+    Returns:
+        "paid" | "failed" | "pending" | "error"
+    """
+    if not obj:
+        return "error"
+
+    yk_status = obj.get("status")
+    if yk_status == "succeeded":
+        try:
+            # Тот же путь, что и у webhook — с блокировками и защитой от повторного начисления
+            process_webhook({"event": "payment.succeeded", "object": obj})
+            return "paid"
+        except Exception as e:
+            logger.error(f"Reconcile: ошибка обработки платежа {payment_id}: {e}", exc_info=True)
+            return "error"
+
+    if yk_status == "canceled":
+        try:
+            update_payment_status(payment_id, "failed")
+            logger.info(f"Reconcile: платёж {payment_id} отменён в ЮKassa, статус -> failed")
+            return "failed"
+        except Exception as e:
+            logger.error(f"Reconcile: не удалось обновить статус платежа {payment_id}: {e}", exc_info=True)
+            return "error"
+
+    # pending / waiting_for_capture — ждём дальше
+    return "pending"
+
+
+def reconcile_pending_payments(
+    min_age_minutes: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Сверяет pending-платежи с ЮKassa и доводит учёт до корректного состояния.
+
+    Args:
+        min_age_minutes: Минимальный возраст платежа (по умолчанию RECONCILE_MIN_AGE_MINUTES)
+        batch_size: Размер страницы (по умолчанию RECONCILE_BATCH_SIZE)
+        concurrency: Число параллельных запросов к ЮKassa (по умолчанию RECONCILE_CONCURRENCY)
+
+    Returns:
+        Статистика: checked, paid, failed, pending, errors
+    """
+    min_age = settings.RECONCILE_MIN_AGE_MINUTES if min_age_minutes is None else int(min_age_minutes)
+    page_size = max(1, int(batch_size or settings.RECONCILE_BATCH_SIZE))
+    workers = max(1, int(concurrency or settings.RECONCILE_CONCURRENCY))
+
+    stats = {"checked": 0, "paid": 0, "failed": 0, "pending": 0, "errors": 0}
+
+    # Один прогон на процесс: ручной запуск не должен пересекаться с плановым
+    if not _run_lock.acquire(blocking=False):
+        logger.info("Reconcile: сверка уже выполняется, пропускаем запуск")
+        return {**stats, "skipped": True}
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for payment_ids in _iter_pending_batches(min_age, page_size):
+                fetched: List[Optional[Dict[str, Any]]] = list(pool.map(_fetch_payment, payment_ids))
+                # Применяем последовательно: process_webhook сам берёт блокировки по сделке
+                for payment_id, obj in zip(payment_ids, fetched):
+                    stats["checked"] += 1
+                    outcome = _apply_payment_state(payment_id, obj)
+                    if outcome == "error":
+                        stats["errors"] += 1
+                    else:
+                        stats[outcome] += 1
+    finally:
+        _run_lock.release()
+
+    if stats["checked"]:
+        logger.info(f"Reconcile: сверка завершена: {stats}")
+    else:
+        logger.debug("Reconcile: pending-платежей для сверки нет")
+    return stats
+
+
+def _scheduler_loop(interval_seconds: int):
+    logger.info(f"Reconcile: планировщик запущен (интервал {interval_seconds} сек)")
+    while not _scheduler_stop.wait(interval_seconds):
+        try:
+            reconcile_pending_payments()
+        except Exception as e:
+            logger.error(f"Reconcile: ошибка планового запуска: {e}", exc_info=True)
+    logger.info("Reconcile: планировщик остановлен")
+
+
+def start_reconciliation_scheduler():
+    """Запускает фоновую периодическую сверку (если включена в настройках)."""
+    global _scheduler_thread
+    if not settings.RECONCILE_ENABLED:
+        logger.info("Reconcile: фоновая сверка выключена (RECONCILE_ENABLED=false)")
+        return
+    if _scheduler_thread and _scheduler_thread.is_alive():
+        return
+    _scheduler_stop.clear()
+    _scheduler_thread = threading.Thread(
+        target=_scheduler_loop,
+        args=(max(10, int(settings.RECONCILE_INTERVAL_SECONDS)),),
+        name="yookassa-reconcile",
+        daemon=True,
+    )
+    _scheduler_thread.start()
+
+
+def stop_reconciliation_scheduler():
+    """Останавливает фоновую сверку."""
+    _scheduler_stop.set()
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Request, HTTPException, Depends
+from fastapi import APIRouter, Request, HTTPException, Depends, Header
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Optional
+from datetime import datetime, timezone
 from payments.yookassa import create_payment, process_webhook
-from payments.logger import get_payment_logs
+from payments.logger import get_payment_logs, PAYMENT_LOGS_DEFAULT_LIMIT
+from core.export import stream_export
 from core.config import settings
 from core.security import get_current_user, require_admin
 from bitrix.client import get_installment_deal
@@ -14,20 +16,12 @@ router = APIRouter(prefix="/api/payments", tags=["payments"])
 
 class PaymentRequest(BaseModel):
     amount: int
-
-class PaymentLogResponse(BaseModel):
-    id: int
-    deal_id: str
-    payment_id: str
-    amount: int
-    status: str
-    source: str
-    comment: Optional[str] = None
-    created_at: str
+    idempotency_key: Optional[str] = None  # можно передать и заголовком Idempotency-Key
 
 @router.post("/create")
 def create_payment_endpoint(
     body: PaymentRequest,
+    idempotency_key_header: Optional[str] = Header(None, alias="Idempotency-Key"),
     user = Depends(get_current_user)
 ):
     """
@@ -36,6 +30,13 @@ def create_payment_endpoint(
     Валидация:
     - Сумма должна быть больше 0
     - Сумма не должна превышать остаток по рассрочке
+    
+    Сделка ищется в локальной БД (кэш идентификатора / email); Bitrix24 используется
+    только если локальной записи ещё нет.
+    
+    Идемпотентность: повторный запрос с тем же ключом (body.idempotency_key или заголовок
+    Idempotency-Key), а без ключа — с той же суммой в пределах PAYMENT_IDEMPOTENCY_WINDOW_SECONDS,
+    получает сохранённый URL оплаты без нового обращения к YooKassa.
     """
     user_identifier = user.email or user.phone or user.identifier
     logger.info(f"Запрос на создание платежа от пользователя {user_identifier}, сумма: {body.amount} ₽")
@@ -45,39 +46,50 @@ def create_payment_endpoint(
         logger.warning(f"Попытка создать платеж с некорректной суммой: {body.amount}")
         raise HTTPException(status_code=400, detail="Сумма должна быть больше 0")
     
-    # Получаем данные о рассрочке
-    user_identifier = user.email or user.phone or user.identifier
-    logger.info(f"Получение данных рассрочки для пользователя {user_identifier}")
-    
-    from bitrix.client import get_installment_deal_by_phone
-    if user.identifier_type == "phone":
-        deal = get_installment_deal_by_phone(user.identifier)
-    else:
-        deal = get_installment_deal(user.identifier)
-    
-    if not deal:
-        logger.warning(f"Рассрочка не найдена для пользователя {user_identifier}")
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Рассрочка не найдена для пользователя {user_identifier}"
-        )
-    
-    logger.info(f"Рассрочка найдена: deal_id={deal.get('ID')}")
-    
     # Получаем текущую оплаченную сумму из БД для проверки остатка
     # ВАЖНО: Используем SELECT FOR UPDATE для блокировки строки и предотвращения race condition
     # Это гарантирует, что два одновременных платежа не смогут превысить остаток
     from models.deal import Deal
     from models.payment_log import SessionLocal
+    from core.identity import resolve_local_deal, remember_identity
     db = SessionLocal()
     try:
-        # Блокируем строку для чтения/обновления до конца транзакции
-        # Это предотвращает одновременные платежи, которые могут превысить остаток
-        db_deal = db.query(Deal).filter(Deal.deal_id == deal["ID"]).with_for_update().first()
+        # Быстрый путь: сделка уже есть в локальной БД (по кэшу идентификатора или email) —
+        # Bitrix24 не нужен, время ответа не зависит от его задержек
+        db_deal = resolve_local_deal(
+            db, user.identifier, user.identifier_type, for_update=True, deal_id=getattr(user, "deal_id", None)
+        )
+        
+        if db_deal:
+            deal_id = db_deal.deal_id
+            logger.info(f"Рассрочка найдена в локальной БД: deal_id={deal_id}")
+        else:
+            # Медленный путь: локальной записи нет — ищем рассрочку в Bitrix24
+            logger.info(f"Сделка не найдена в локальной БД для {user_identifier}, ищем в Bitrix24")
+            from bitrix.client import get_installment_deal_by_phone
+            if user.identifier_type == "phone":
+                deal = get_installment_deal_by_phone(user.identifier)
+            else:
+                deal = get_installment_deal(user.identifier)
+            
+            if not deal:
+                logger.warning(f"Рассрочка не найдена для пользователя {user_identifier}")
+                raise HTTPException(
+                    status_code=404, 
+                    detail=f"Рассрочка не найдена для пользователя {user_identifier}"
+                )
+            
+            deal_id = deal["ID"]
+            logger.info(f"Рассрочка найдена в Bitrix24: deal_id={deal_id}")
+            remember_identity(user.identifier, user.identifier_type, deal_id)
+            
+            # Блокируем строку для чтения/обновления до конца транзакции
+            # Это предотвращает одновременные платежи, которые могут превысить остаток
+            db_deal = db.query(Deal).filter(Deal.deal_id == deal_id).with_for_update().first()
         
         if not db_deal:
             # Если сделки нет в БД, создаем её
-            logger.info(f"Сделка {deal['ID']} не найдена в локальной БД, создаем запись")
+            logger.info(f"Сделка {deal_id} не найдена в локальной БД, создаем запись")
             
             # Получаем email из контакта Bitrix24, если пользователь вошел по телефону
             user_email = user.email
@@ -119,7 +131,7 @@ def create_payment_endpoint(
                 term_months = 0
             
             db_deal = Deal(
-                deal_id=deal["ID"],
+                deal_id=deal_id,
                 title=deal.get("TITLE", ""),
                 email=user_email or user.identifier,
                 total_amount=total_amount,
@@ -129,13 +141,13 @@ def create_payment_endpoint(
             db.add(db_deal)
             db.commit()
             db.refresh(db_deal)
-            logger.info(f"Создана запись в БД для сделки {deal['ID']}: total_amount={total_amount}, term_months={term_months}")
+            logger.info(f"Создана запись в БД для сделки {deal_id}: total_amount={total_amount}, term_months={term_months}")
         
         logger.info(f"Данные из БД: total_amount={db_deal.total_amount}, paid_amount={db_deal.paid_amount}")
 
         # Если сумма рассрочки неизвестна — не можем корректно валидировать остаток
         if db_deal.total_amount <= 0:
-            logger.warning(f"Cannot create payment: total_amount is not set for deal {deal['ID']} (OPPORTUNITY=0)")
+            logger.warning(f"Cannot create payment: total_amount is not set for deal {deal_id} (OPPORTUNITY=0)")
             raise HTTPException(
                 status_code=400,
                 detail="Сумма рассрочки не задана в Bitrix24 (OPPORTUNITY=0). Заполните сумму сделки, чтобы принимать платежи."
@@ -146,7 +158,7 @@ def create_payment_endpoint(
         if body.amount > remaining:
             logger.warning(
                 f"Попытка оплаты суммы {body.amount} ₽ превышает остаток {remaining} ₽ "
-                f"для сделки {deal['ID']}"
+                f"для сделки {deal_id}"
             )
             raise HTTPException(
                 status_code=400, 
@@ -154,30 +166,32 @@ def create_payment_endpoint(
             )
         
         if remaining <= 0:
-            logger.warning(f"Попытка оплаты полностью оплаченной рассрочки {deal['ID']}")
+            logger.warning(f"Попытка оплаты полностью оплаченной рассрочки {deal_id}")
             raise HTTPException(
                 status_code=400, 
                 detail="Рассрочка уже полностью оплачена"
             )
         
         logger.info(
-            f"Валидация пройдена. Создание платежа на сумму {body.amount} ₽ для сделки {deal['ID']}. "
+            f"Валидация пройдена. Создание платежа на сумму {body.amount} ₽ для сделки {deal_id}. "
             f"Остаток: {remaining} ₽"
         )
     finally:
         db.close()
     
     try:
-        url = create_payment(
+        url, payment_id = create_payment(
             amount=body.amount,
-            deal_id=deal["ID"],
+            deal_id=deal_id,
             return_url=settings.FRONTEND_URL,
             identifier=user.identifier,
             identifier_type=user.identifier_type,
-            email=user.email
+            email=user.email,
+            idempotency_key=body.idempotency_key or idempotency_key_header
         )
-        logger.info(f"Платеж успешно создан, URL: {url}")
-        return {"url": url}
+        logger.info(f"Платеж {payment_id} успешно создан, URL: {url}")
+        # payment_id — для ожидания этого платежа в /api/payments/events после возврата из ЮKassa
+        return {"url": url, "payment_id": payment_id}
     except HTTPException:
         raise
     except Exception as e:
@@ -264,25 +278,191 @@ async def test_webhook_endpoint(user = Depends(require_admin)):
         "note": "Проверьте, что этот URL указан в настройках YooKassa (Настройки → HTTP уведомления)"
     }
 
-@router.get("/logs", response_model=List[PaymentLogResponse])
+@router.post("/reconcile")
+def reconcile_payments_endpoint(
+    min_age_minutes: Optional[int] = None,
+    user = Depends(require_admin)
+):
+    """
+    Ручной запуск сверки pending-платежей с ЮKassa (для админа).
+    Подтверждённые платежи проводятся тем же путём, что и webhook.
+    """
+    from payments.reconciliation import reconcile_pending_payments
+    logger.info(f"Admin {user.identifier} started payments reconciliation")
+    return reconcile_pending_payments(min_age_minutes=min_age_minutes)
+
+@router.get("/logs")
 def get_payment_logs_endpoint(
-    deal_id: Optional[str] = None
-    , user = Depends(require_admin)
+    deal_id: Optional[str] = None,
+    source: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = PAYMENT_LOGS_DEFAULT_LIMIT,
+    include_totals: Optional[bool] = None,
+    user = Depends(require_admin)
 ):
     """
-    Получить логи платежей (для админа)
+    Получить логи платежей (для админа), постранично — новые сверху.
+    
+    - source / status: одно значение или несколько через запятую
+    - date_from / date_to: YYYY-MM-DD или ISO datetime (date_to не включительно)
+    - cursor: next_cursor из предыдущего ответа
+    - include_totals: итоги по всему отфильтрованному набору (по умолчанию — только на первой странице)
     """
-    logs = get_payment_logs(deal_id=deal_id)
-    return [
-        PaymentLogResponse(
-            id=log.id,
-            deal_id=log.deal_id,
-            payment_id=log.payment_id,
-            amount=log.amount,
-            status=log.status,
-            source=log.source,
-            comment=getattr(log, "comment", None),
-            created_at=log.created_at.isoformat()
+    try:
+        parsed_from = _parse_date_param(date_from, "date_from")
+        parsed_to = _parse_date_param(date_to, "date_to")
+        return get_payment_logs(
+            deal_id=deal_id,
+            source=source,
+            status=status,
+            date_from=parsed_from,
+            date_to=parsed_to,
+            cursor=cursor,
+            limit=limit,
+            include_totals=(cursor is None) if include_totals is None else include_totals
         )
-        for log in logs
-    ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/logs/export")
+def export_payment_logs_endpoint(
+    format: str = "csv",
+    deal_id: Optional[str] = None,
+    source: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    user = Depends(require_admin)
+):
+    """
+    Потоковая выгрузка логов платежей (для админа) в CSV или NDJSON.
+    Фильтры те же, что у /logs; порядок — по возрастанию created_at.
+    """
+    from payments.logger import apply_payment_log_filters, payment_log_row_to_dict, PAYMENT_LOG_COLUMNS
+    from models.payment_log import PaymentLog
+    try:
+        parsed_from = _parse_date_param(date_from, "date_from")
+        parsed_to = _parse_date_param(date_to, "date_to")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    logger.info(f"Admin {user.identifier} exporting payment logs ({format})")
+
+    def build_query(db):
+        query = apply_payment_log_filters(
+            db.query(*PAYMENT_LOG_COLUMNS), deal_id, source, status, parsed_from, parsed_to
+        )
+        return query.order_by(PaymentLog.created_at.asc(), PaymentLog.id.asc())
+
+    return stream_export(
+        build_query,
+        payment_log_row_to_dict,
+        columns=[c.key for c in PAYMENT_LOG_COLUMNS],
+        fmt=format,
+        filename="payment_logs"
+    )
+
+@router.get("/events")
+async def payment_events_stream(
+    request: Request,
+    since: Optional[str] = None,
+    payment_id: Optional[str] = None,
+    user = Depends(get_current_user)
+):
+    """
+    SSE-поток событий о проведённых платежах по сделке текущего пользователя.
+
+    Клиент подключается после возврата из ЮKassa и получает событие `payment`, как только
+    webhook проведёт платёж, — вместо опроса /api/installment/my. payment_id (из ответа
+    /api/payments/create) — ждать этот платёж и сразу отдать его, если он уже проведён (webhook
+    мог прийти раньше, чем клиент подключился). since (ISO datetime) — то же для платежей,
+    созданных с этого момента (сравнивается с временем сервера, поэтому payment_id надёжнее).
+    Поток закрывается после события `payment` или через PAYMENT_EVENTS_MAX_SECONDS (событие `timeout`).
+    """
+    import asyncio
+    import json
+    import time
+    from fastapi.responses import StreamingResponse
+    from starlette.concurrency import run_in_threadpool
+    from payments.events import subscribe, unsubscribe, load_paid_payments
+
+    try:
+        since_dt = _parse_date_param(since, "since")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def _resolve_deal_id():
+        from core.identity import resolve_local_deal
+        from models.payment_log import SessionLocal
+        db = SessionLocal()
+        try:
+            db_deal = resolve_local_deal(db, user.identifier, user.identifier_type, deal_id=getattr(user, "deal_id", None))
+            return db_deal.deal_id if db_deal else None
+        finally:
+            db.close()
+
+    deal_id = await run_in_threadpool(_resolve_deal_id)
+    if not deal_id:
+        raise HTTPException(status_code=404, detail="Рассрочка не найдена. Обратитесь к администратору.")
+
+    # Подписываемся до первой сверки с БД, чтобы не пропустить платёж между ними
+    sub = subscribe(deal_id)
+    # Без since/payment_id уже проведённые платежи не интересны — считаем их показанными
+    payment_id = (payment_id or "").strip() or None
+    seen = set()
+    if since_dt is None and payment_id is None:
+        seen = {e["payment_id"] for e in await run_in_threadpool(load_paid_payments, deal_id)}
+    poll_seconds = max(1, settings.PAYMENT_EVENTS_POLL_SECONDS)
+    deadline = time.monotonic() + max(poll_seconds, settings.PAYMENT_EVENTS_MAX_SECONDS)
+    logger.info(f"SSE: подписка на платежи сделки {deal_id} ({user.identifier})")
+
+    def _sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def stream():
+        try:
+            yield f"retry: {poll_seconds * 1000}\n\n"
+            events = await run_in_threadpool(load_paid_payments, deal_id, since_dt, payment_id)
+            while True:
+                fresh = [e for e in events if e["payment_id"] not in seen]
+                if fresh:
+                    for e in fresh:
+                        seen.add(e["payment_id"])
+                        yield _sse("payment", e)
+                    return
+                if time.monotonic() >= deadline:
+                    yield _sse("timeout", {"deal_id": str(deal_id)})
+                    return
+                if await request.is_disconnected():
+                    return
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=poll_seconds)
+                    events = [event] if payment_id is None or event["payment_id"] == payment_id else []
+                except asyncio.TimeoutError:
+                    # Событие могло быть опубликовано другим воркером — сверяемся с БД
+                    yield ": ping\n\n"
+                    events = await run_in_threadpool(load_paid_payments, deal_id, since_dt, payment_id)
+        finally:
+            unsubscribe(sub)
+            logger.info(f"SSE: поток платежей сделки {deal_id} закрыт")
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _parse_date_param(value: Optional[str], name: str) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Некорректная дата {name}: {value}. Ожидается YYYY-MM-DD или ISO datetime")
+    # created_at хранится в UTC без таймзоны
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
@@ -1,17 +1,44 @@
-import uuid
+import hashlib
+import time
 import logging
+from fastapi import HTTPException
 from yookassa import Payment, Configuration
 import requests
 from core.config import settings
 from bitrix.client import update_paid_amount, _get_full_deal
-from payments.logger import log_payment, update_payment_status, get_payment_logs
+from datetime import datetime, timedelta
+from payments.logger import (
+    log_payment, update_payment_status, get_payment_logs, find_payment_by_idempotency_key, find_recent_pending_payment,
+)
 
 logger = logging.getLogger(__name__)
 
 Configuration.account_id = settings.YOOKASSA_SHOP_ID
 Configuration.secret_key = settings.YOOKASSA_SECRET
+if settings.YOOKASSA_API_URL:
+    Configuration.api_url = settings.YOOKASSA_API_URL.rstrip("/")
 
-def create_payment(amount, deal_id, return_url, identifier=None, identifier_type=None, email=None):
+def _hash_key(*parts) -> str:
+    # ЮKassa ограничивает Idempotence-Key 64 символами — sha256 hex ровно 64
+    raw = ":".join(str(p) for p in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def build_payment_idempotency_key(deal_id, amount, client_key=None) -> str:
+    """
+    Ключ идемпотентности создания платежа.
+
+    - Если клиент передал свой ключ — привязываем его к сделке (ключи разных сделок не пересекаются).
+    - Иначе выводим ключ из (сделка, сумма, временное окно PAYMENT_IDEMPOTENCY_WINDOW_SECONDS).
+      Окна фиксированные, поэтому create_payment сначала ищет недавний pending-платеж
+      (find_recent_pending_payment), а этот ключ — запасной вариант.
+    """
+    if client_key:
+        return _hash_key("client", deal_id, client_key.strip())
+    window = max(1, int(settings.PAYMENT_IDEMPOTENCY_WINDOW_SECONDS))
+    bucket = int(time.time()) // window
+    return _hash_key("derived", deal_id, amount, bucket)
+
+def create_payment(amount, deal_id, return_url, identifier=None, identifier_type=None, email=None, idempotency_key=None):
     """
     Создание платежа в ЮKassa и логирование
     
@@ -20,11 +47,46 @@ def create_payment(amount, deal_id, return_url, identifier=None, identifier_type
         deal_id: ID сделки
         return_url: URL для возврата после оплаты
         email: Email пользователя (для сохранения в metadata)
+        idempotency_key: Ключ идемпотентности от клиента (если не указан — выводится из сделки, суммы и времени)
+
+    Returns:
+        (URL оплаты, payment_id ЮKassa) — для повторного запроса те же, что у уже созданного платежа
     """
     # email в metadata — опционально (у пользователей с входом по телефону его может не быть)
     email_to_save = email if email else None
     
-    idempotence_key = str(uuid.uuid4())
+    client_key = idempotency_key.strip() if idempotency_key and idempotency_key.strip() else None
+    if not client_key:
+        # Двойной клик, попавший на границу окна ключа, получил бы новый ключ и второй платеж —
+        # поэтому сначала ищем pending-платеж той же суммы за последнее окно
+        window = max(1, int(settings.PAYMENT_IDEMPOTENCY_WINDOW_SECONDS))
+        recent = find_recent_pending_payment(deal_id, amount, datetime.utcnow() - timedelta(seconds=window))
+        if recent:
+            logger.info(
+                f"Повторный запрос создания платежа для сделки {deal_id} без ключа: "
+                f"используем pending-платеж {recent.payment_id} от {recent.created_at}"
+            )
+            return recent.confirmation_url, recent.payment_id
+    idempotence_key = build_payment_idempotency_key(deal_id, amount, client_key)
+
+    # Повтор запроса: отдаём сохранённый URL оплаты без обращения к ЮKassa
+    for _ in range(5):
+        existing = find_payment_by_idempotency_key(idempotence_key)
+        if not existing:
+            break
+        if str(existing.deal_id) != str(deal_id) or int(existing.amount or 0) != int(amount):
+            raise HTTPException(
+                status_code=409,
+                detail="Ключ идемпотентности уже использован для другого платежа"
+            )
+        if existing.confirmation_url and (client_key or existing.status == "pending"):
+            logger.info(
+                f"Повторный запрос создания платежа для сделки {deal_id}: "
+                f"используем платеж {existing.payment_id} (status={existing.status})"
+            )
+            return existing.confirmation_url, existing.payment_id
+        # Выведенный ключ, но прошлый платеж уже оплачен/отменен — это новый платеж, берём следующий ключ цепочки
+        idempotence_key = _hash_key(idempotence_key, existing.payment_id)
     
     try:
         payment = Payment.create({
@@ -58,21 +120,24 @@ def create_payment(amount, deal_id, return_url, identifier=None, identifier_type
         raise
 
     payment_id = payment.id
+    confirmation_url = payment.confirmation.confirmation_url
     
-    # Логируем создание платежа
+    # Логируем создание платежа (вместе с ключом и URL — для ответа на повторные запросы)
     try:
         log_payment(
             deal_id=str(deal_id),
             payment_id=payment_id,
             amount=amount,
             status="pending",
-            source="yookassa"
+            source="yookassa",
+            idempotency_key=idempotence_key,
+            confirmation_url=confirmation_url
         )
     except Exception as e:
         logger.error(f"Error logging payment creation: {e}")
         # Не падаем, если логирование не работает
     
-    return payment.confirmation.confirmation_url
+    return confirmation_url, payment_id
 
 def process_webhook(payload: dict):
     """Обработка webhook от ЮKassa с логированием"""
@@ -479,6 +544,17 @@ def process_webhook(payload: dict):
             logger.warning(f"Error getting final paid_amount: {e}")
         db.close()
         logger.info(f"DB session closed for payment {payment_id}")
+        from installments.service import invalidate_schedule_cache
+        invalidate_schedule_cache(deal_id)
+        from admin.deals_snapshot import invalidate_deals_snapshot
+        invalidate_deals_snapshot()
+
+    # Платёж закоммичен — сообщаем SSE-подписчикам сделки до медленного обновления Bitrix24
+    try:
+        from payments.events import publish_payment_event
+        publish_payment_event(deal_id, payment_id, amount, final_paid_amount)
+    except Exception as e:
+        logger.warning(f"Failed to publish payment event for {payment_id}: {e}")
 
     # Обновляем сделку в Bitrix (обновляем полную сумму из БД)
     # Выполняем после закрытия основной транзакции, чтобы не блокировать БД
@@ -0,0 +1,118 @@
+"""
+Бенчмарк пакетного импорта наличных оплат против построчной отметки.
+
+Во временной SQLite-БД создаёт N сделок и записывает по одной наличной оплате на сделку
+двумя способами: POST /api/admin/deals/{deal_id}/cash-payment на каждую строку и один
+POST /api/admin/cash-payments/import. Bitrix24 и Telegram подменяются заглушками с
+задержкой сетевого запроса (реальные запросы не отправляются).
+
+Использование:
+    python scripts/benchmark_cash_import.py
+    python scripts/benchmark_cash_import.py --payments 500 --network-delay 0.15
+"""
+
+import sys
+import os
+import argparse
+import logging
+import tempfile
+import time
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_DB_FILE = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+_DB_FILE.close()
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_FILE.name}"
+os.environ["RECONCILE_ENABLED"] = "false"
+for _name, _value in (("BITRIX_WEBHOOK_URL", "http://127.0.0.1:9/rest/1/benchmark"),
+                      ("YOOKASSA_SHOP_ID", "benchmark"), ("YOOKASSA_SECRET", "benchmark"),
+                      ("FRONTEND_URL", "http://localhost:3000")):
+    os.environ.setdefault(_name, _value)
+
+logging.basicConfig(level=logging.ERROR)
+logging.disable(logging.WARNING)
+
+
+def _patch_network(delay: float, counters: dict):
+    """Bitrix24 и Telegram — заглушки: каждый вызов = один сетевой запрос с задержкой delay."""
+    import bitrix.client as bitrix_client
+    import notifications.telegram as telegram
+
+    def slow(name, result):
+        def call(*args, **kwargs):
+            counters[name] = counters.get(name, 0) + 1
+            time.sleep(delay)
+            return result(*args) if callable(result) else result
+        return call
+
+    bitrix_client.get_all_installment_deals = lambda: []  # фоновый снимок списка сделок в админке
+    bitrix_client.update_paid_amount = slow("bitrix", True)
+    bitrix_client._call_batch = slow("bitrix", lambda cmd, *a: ({k: True for k in cmd}, {}))
+    telegram.send_telegram_notification = slow("telegram", True)
+
+
+def _seed(count: int, prefix: str):
+    from models.payment_log import SessionLocal
+    from models.deal import Deal
+    db = SessionLocal()
+    try:
+        db.add_all([
+            Deal(deal_id=f"{prefix}{i}", title=f"Сделка {i}", total_amount=600_000, paid_amount=0, term_months=6)
+            for i in range(count)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный импорт наличных оплат против построчной отметки")
+    parser.add_argument("--payments", type=int, default=300, help="Сколько оплат (по одной на сделку)")
+    parser.add_argument("--network-delay", type=float, default=0.1, help="Задержка запроса к Bitrix24/Telegram, сек")
+    args = parser.parse_args()
+
+    from fastapi.testclient import TestClient
+    from main import app
+    from auth.magic_link import create_admin_token
+
+    try:
+        counters: dict = {}
+        _patch_network(args.network_delay, counters)
+        with TestClient(app) as client:
+            headers = {"Authorization": f"Bearer {create_admin_token('+70000000000')}"}
+            _seed(args.payments, "single_")
+            _seed(args.payments, "bulk_")
+
+            started = time.perf_counter()
+            for i in range(args.payments):
+                r = client.post(f"/api/admin/deals/single_{i}/cash-payment", headers=headers,
+                                json={"deal_id": f"single_{i}", "amount": 10_000, "idempotency_key": f"single-{i}"})
+                r.raise_for_status()
+            single = time.perf_counter() - started
+            single_calls = dict(counters)
+            counters.clear()
+
+            rows = ["deal_id;amount;month_index;payment_date;idempotency_key"]
+            rows += [f"bulk_{i};10000;0;2026-01-31;bulk-{i}" for i in range(args.payments)]
+            started = time.perf_counter()
+            # TestClient выполняет фоновые задачи до возврата ответа — время включает запись в Bitrix24 и Telegram
+            r = client.post("/api/admin/cash-payments/import", headers=headers,
+                            files={"file": ("cash.csv", "\n".join(rows).encode("utf-8"), "text/csv")})
+            r.raise_for_status()
+            bulk = time.perf_counter() - started
+            result = r.json()
+
+        print(f"Оплат: {args.payments}, задержка Bitrix24/Telegram: {args.network_delay * 1000:.0f} мс")
+        print(f"По одной:  {single:.2f} сек, запросов Bitrix24: {single_calls.get('bitrix', 0)}, "
+              f"Telegram: {single_calls.get('telegram', 0)}")
+        print(f"Импорт:    {bulk:.2f} сек, запросов Bitrix24: {counters.get('bitrix', 0)}, "
+              f"Telegram: {counters.get('telegram', 0)}; записано {result['payments_created']} "
+              f"на {result['total_amount']} ₽")
+        print(f"Ускорение: x{single / bulk:.1f}")
+    finally:
+        os.unlink(_DB_FILE.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Бенчмарк пакетного расчёта графиков (installments.batch) против normalize_deal.
+
+Генерирует N случайных сделок, считает графики обоими способами, проверяет,
+что результаты совпадают, и печатает время и ускорение.
+
+Использование:
+    python scripts/benchmark_schedule_batch.py
+    python scripts/benchmark_schedule_batch.py --deals 10000 --seed 1
+
+    # В Docker контейнере
+    docker compose exec backend python -m scripts.benchmark_schedule_batch
+"""
+
+import sys
+import os
+import argparse
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from installments.service import normalize_deal, invalidate_schedule_cache
+
+try:
+    from installments.batch import compute_schedules_batch
+except ImportError:
+    print("❌ Для пакетного расчёта нужен NumPy: pip install numpy")
+    sys.exit(1)
+
+# normalize_deal пишет warning на каждую переплату — в бенчмарке это только шум
+logging.basicConfig(level=logging.ERROR)
+
+
+def _random_deals(count: int, seed: int) -> list:
+    rnd = random.Random(seed)
+    base = datetime(2024, 1, 1)
+    deals = []
+    for i in range(count):
+        total = rnd.choice([0, 120000, 300000, 450000, 999999, 1500000])
+        term = rnd.choice([0, 1, 3, 6, 12, 24, 36, 60, 120])
+        allocations = None
+        if rnd.random() < 0.3:
+            allocations = {}
+            for _ in range(rnd.randint(1, 6)):
+                idx = rnd.randint(-1, 40)
+                allocations[idx] = allocations.get(idx, 0) + rnd.randint(1, 60000)
+        deals.append({
+            "deal_id": f"bench_{i}",
+            "total_amount": total,
+            "initial_payment": rnd.choice([0, 0, 10000, 50000]),
+            "term_months": term,
+            "paid_amount": rnd.randint(0, total) if total else 0,
+            "base_date": base + timedelta(days=rnd.randint(0, 900)),
+            "schedule_day": rnd.choice([None, 1, 5, 10, 15, 28, 29, 30, 31]),
+            "allocations": allocations,
+        })
+    return deals
+
+
+def _as_bitrix_deal(d: dict) -> dict:
+    deal = {
+        "ID": d["deal_id"],
+        "OPPORTUNITY": str(d["total_amount"]),
+        "UF_PAID_AMOUNT": str(d["paid_amount"]),
+        "UF_TERM_MONTHS": str(d["term_months"]),
+        "initial_payment": d["initial_payment"],
+        "SCHEDULE_START_DATE": d["base_date"].isoformat(),
+        "SCHEDULE_DAY": d["schedule_day"],
+        "project_type": "-",
+        "project_start_date": "-",
+        "object_location": "-",
+    }
+    if d["allocations"]:
+        deal["CASH_ALLOCATIONS"] = [
+            {"month_index": idx, "amount": amt} for idx, amt in d["allocations"].items()
+        ]
+    return deal
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пакетного расчёта графиков")
+    parser.add_argument("--deals", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    deals = _random_deals(args.deals, args.seed)
+    bitrix_deals = [_as_bitrix_deal(d) for d in deals]
+
+    invalidate_schedule_cache()
+    started = time.perf_counter()
+    reference = [normalize_deal(d) for d in bitrix_deals]
+    loop_seconds = time.perf_counter() - started
+    invalidate_schedule_cache()
+
+    started = time.perf_counter()
+    batch = compute_schedules_batch(
+        total_amount=[d["total_amount"] for d in deals],
+        initial_payment=[d["initial_payment"] for d in deals],
+        term_months=[d["term_months"] for d in deals],
+        paid_amount=[d["paid_amount"] for d in deals],
+        base_dates=[d["base_date"] for d in deals],
+        schedule_day=[d["schedule_day"] for d in deals],
+        allocations=[d["allocations"] for d in deals],
+    )
+    batch_seconds = time.perf_counter() - started
+
+    mismatches = 0
+    for i, ref in enumerate(reference):
+        if ref["payments"] != batch.payments(i) or ref["deal"]["paid_months"] != int(batch.paid_months[i]):
+            mismatches += 1
+            if mismatches <= 3:
+                print(f"❌ Расхождение для {deals[i]['deal_id']}: {deals[i]}")
+
+    months_total = int(batch.mask.sum())
+    print(f"Сделок: {len(deals)}, платежей в графиках: {months_total}")
+    print(f"normalize_deal в цикле: {loop_seconds * 1000:.1f} мс")
+    print(f"compute_schedules_batch: {batch_seconds * 1000:.1f} мс")
+    print(f"Ускорение: x{loop_seconds / batch_seconds:.1f}" if batch_seconds > 0 else "Ускорение: —")
+    print(f"Просрочено: {int((batch.overdue_months > 0).sum())} сделок на {int(batch.overdue_amount.sum())} ₽")
+    if mismatches:
+        print(f"❌ Расхождений с normalize_deal: {mismatches}")
+        sys.exit(1)
+    print("✅ Результаты совпадают с normalize_deal")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Локальный fake-сервер ЮKassa для проверки создания платежей и сверки (reconciliation).
+
+Поддерживает:
+- POST /v3/payments                      — создание платежа (status=pending)
+- GET  /v3/payments/{id}                 — получение платежа
+- POST /_fake/payments/{id}/succeed      — перевести платёж в succeeded (имитация оплаты без webhook)
+- POST /_fake/payments/{id}/cancel       — перевести платёж в canceled
+- POST /_fake/payments                   — положить произвольный платёж (JSON объекта платежа)
+
+Использование:
+    python scripts/fake_yookassa_server.py --port 8081
+    # в .env backend:
+    YOOKASSA_API_URL=http://127.0.0.1:8081/v3
+
+Затем создайте платёж через /api/payments/create, «оплатите» его через
+POST /_fake/payments/{id}/succeed и запустите сверку:
+    python scripts/reconcile_payments.py --min-age 0
+"""
+
+import argparse
+import json
+import threading
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_payments = {}
+_idempotence = {}
+_lock = threading.Lock()
+
+
+def _now_iso() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class FakeYooKassaHandler(BaseHTTPRequestHandler):
+    def _send(self, code: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+        except Exception:
+            return {}
+
+    def _not_found(self):
+        self._send(404, {"type": "error", "code": "not_found", "description": "Payment not found"})
+
+    def do_GET(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if len(parts) == 3 and parts[:2] == ["v3", "payments"]:
+            with _lock:
+                payment = _payments.get(parts[2])
+            if not payment:
+                return self._not_found()
+            return self._send(200, payment)
+        self._not_found()
+
+    def do_POST(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        body = self._read_json()
+
+        if parts == ["v3", "payments"]:
+            key = self.headers.get("Idempotence-Key")
+            with _lock:
+                if key and key in _idempotence:
+                    return self._send(200, _payments[_idempotence[key]])
+                payment_id = str(uuid.uuid4())
+                payment = {
+                    "id": payment_id,
+                    "status": "pending",
+                    "paid": False,
+                    "amount": body.get("amount") or {"value": "0.00", "currency": "RUB"},
+                    "description": body.get("description"),
+                    "metadata": body.get("metadata") or {},
+                    "created_at": _now_iso(),
+                    "test": True,
+                    "confirmation": {
+                        "type": "redirect",
+                        "return_url": (body.get("confirmation") or {}).get("return_url"),
+                        "confirmation_url": f"http://{self.headers.get('Host')}/_fake/checkout/{payment_id}",
+                    },
+                }
+                _payments[payment_id] = payment
+                if key:
+                    _idempotence[key] = payment_id
+            return self._send(200, payment)
+
+        if parts == ["_fake", "payments"]:
+            if not body.get("id"):
+                body["id"] = str(uuid.uuid4())
+            body.setdefault("status", "pending")
+            body.setdefault("created_at", _now_iso())
+            with _lock:
+                _payments[body["id"]] = body
+            return self._send(200, body)
+
+        if len(parts) == 4 and parts[:2] == ["_fake", "payments"] and parts[3] in ("succeed", "cancel"):
+            with _lock:
+                payment = _payments.get(parts[2])
+                if not payment:
+                    return self._not_found()
+                if parts[3] == "succeed":
+                    payment["status"] = "succeeded"
+                    payment["paid"] = True
+                    payment["captured_at"] = _now_iso()
+                else:
+                    payment["status"] = "canceled"
+            return self._send(200, payment)
+
+        self._not_found()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake YooKassa API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeYooKassaHandler)
+    print(f"Fake YooKassa: http://{args.host}:{args.port}/v3")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Нагрузочная проверка авторизации при медленном Bitrix24.
+
+Поднимает fake-Bitrix24, который отвечает на каждый запрос с задержкой, и backend
+(uvicorn в отдельном процессе), настроенный на этот fake. Затем отправляет пачку
+запросов к /api/installment/my с magic-токенами неизвестных пользователей (каждый
+такой запрос идёт в Bitrix24) и одновременно замеряет время ответа /health и
+синхронного /api, которым Bitrix24 не нужен.
+
+Пока авторизация ходила в Bitrix24 из пула потоков, 40 зависших запросов занимали
+весь пул и /api ждал вместе с ними. С асинхронной зависимостью /health и /api
+отвечают за миллисекунды независимо от состояния Bitrix24.
+
+--phones N добавляет N неизвестных телефонов: для них после поиска контакта идёт
+перебор всех сделок (get_installment_deal_by_phone) — в отдельном ограниченном пуле
+(PHONE_FALLBACK_CONCURRENCY) и не дольше PHONE_FALLBACK_TIMEOUT_SECONDS, после чего 503.
+
+Использование:
+    python scripts/load_test_auth.py
+    python scripts/load_test_auth.py --users 200 --bitrix-delay 5 --threadpool 40
+    python scripts/load_test_auth.py --users 50 --phones 100 --phone-timeout 10
+
+Требуется httpx и uvicorn.
+"""
+
+import sys
+import os
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+try:
+    import httpx
+except ImportError:
+    print("❌ Для нагрузочной проверки нужен httpx: pip install httpx")
+    sys.exit(1)
+
+from jose import jwt
+
+JWT_SECRET = "load-test-secret"
+
+
+def _start_slow_bitrix(port: int, delay: float) -> ThreadingHTTPServer:
+    """Fake-Bitrix24: любой метод через delay секунд отвечает «ничего не найдено»."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self.rfile.read(length)
+            time.sleep(delay)
+            if self.path.split("?")[0].endswith("/batch"):
+                result = {"result": {}, "result_error": {}}
+            else:
+                result = []  # crm.contact.list, crm.deal.list
+            body = json.dumps({"result": result}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _start_backend(port: int, bitrix_port: int, threadpool: int, db_path: str,
+                   phone_timeout: float) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "BITRIX_WEBHOOK_URL": f"http://127.0.0.1:{bitrix_port}/rest/1/load-test",
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "JWT_SECRET": JWT_SECRET,
+        "THREADPOOL_SIZE": str(threadpool),
+        "PHONE_FALLBACK_TIMEOUT_SECONDS": str(phone_timeout),
+        "RECONCILE_ENABLED": "false",
+        "YOOKASSA_SHOP_ID": env.get("YOOKASSA_SHOP_ID", "load-test"),
+        "YOOKASSA_SECRET": env.get("YOOKASSA_SECRET", "load-test"),
+        "FRONTEND_URL": env.get("FRONTEND_URL", "http://localhost:3000"),
+        "LOG_LEVEL": "ERROR",
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "error"],
+        cwd=os.path.join(os.path.dirname(__file__), '..'),
+        env=env,
+    )
+
+
+def _magic_token(identifier: str, identifier_type: str = "email") -> str:
+    expire = datetime.utcnow() + timedelta(minutes=15)
+    return jwt.encode({"sub": identifier, "type": identifier_type, "exp": expire}, JWT_SECRET, algorithm="HS256")
+
+
+async def _wait_ready(client: httpx.AsyncClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("backend не запустился")
+
+
+async def _probe(client: httpx.AsyncClient, path: str, stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            await client.get(path, timeout=60)
+            samples.append(time.perf_counter() - started)
+        except httpx.HTTPError:
+            samples.append(float("inf"))
+        await asyncio.sleep(0.1)
+
+
+def _describe(samples: list) -> str:
+    if not samples:
+        return "нет замеров"
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (f"{len(samples)} запросов, медиана {statistics.median(ordered) * 1000:.1f} мс, "
+            f"p95 {p95 * 1000:.1f} мс, макс {ordered[-1] * 1000:.1f} мс")
+
+
+async def _run(args, base_url: str):
+    limits = httpx.Limits(max_connections=args.users + args.phones + 10)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        await _wait_ready(client)
+
+        stop = asyncio.Event()
+        health, unrelated = [], []
+        probes = [
+            asyncio.create_task(_probe(client, "/health", stop, health)),
+            asyncio.create_task(_probe(client, "/api", stop, unrelated)),
+        ]
+
+        run_id = int(time.time())
+        tokens = [_magic_token(f"load-{run_id}-{i}@example.com") for i in range(args.users)]
+        # Неизвестные телефоны (уникальные по запуску — кэш «не найден» не срабатывает)
+        phone_tokens = [_magic_token(f"+7900{run_id % 1000:03d}{i:04d}", "phone") for i in range(args.phones)]
+
+        async def _auth(token: str):
+            started_at = time.perf_counter()
+            r = await client.get("/api/installment/my", headers={"Authorization": f"Bearer {token}"})
+            return r, time.perf_counter() - started_at
+
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[_auth(t) for t in tokens + phone_tokens], return_exceptions=True)
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await asyncio.gather(*probes)
+
+    def _codes(results) -> dict:
+        codes = {}
+        for r in results:
+            key = r[0].status_code if isinstance(r, tuple) else type(r).__name__
+            codes[key] = codes.get(key, 0) + 1
+        return codes
+
+    email_results, phone_results = responses[:args.users], responses[args.users:]
+    print(f"Запросы авторизации: {args.users + args.phones} за {elapsed:.1f} сек")
+    print(f"  email:    {_codes(email_results)}, {_describe([r[1] for r in email_results if isinstance(r, tuple)])}")
+    if args.phones:
+        print(f"  телефоны: {_codes(phone_results)}, {_describe([r[1] for r in phone_results if isinstance(r, tuple)])}")
+    print(f"/health: {_describe(health)}")
+    print(f"/api:    {_describe(unrelated)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Авторизация при медленном Bitrix24")
+    parser.add_argument("--users", type=int, default=100, help="Сколько одновременных запросов неизвестных пользователей")
+    parser.add_argument("--bitrix-delay", type=float, default=3.0, help="Задержка ответа fake-Bitrix24, сек")
+    parser.add_argument("--threadpool", type=int, default=40, help="THREADPOOL_SIZE для backend")
+    parser.add_argument("--phones", type=int, default=0,
+                        help="Сколько одновременных запросов неизвестных телефонов (перебор сделок Bitrix24)")
+    parser.add_argument("--phone-timeout", type=float, default=10.0, help="PHONE_FALLBACK_TIMEOUT_SECONDS для backend")
+    parser.add_argument("--port", type=int, default=8765, help="Порт backend")
+    parser.add_argument("--bitrix-port", type=int, default=8766, help="Порт fake-Bitrix24")
+    args = parser.parse_args()
+
+    bitrix = _start_slow_bitrix(args.bitrix_port, args.bitrix_delay)
+    db_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+    db_file.close()
+    backend = _start_backend(args.port, args.bitrix_port, args.threadpool, db_file.name, args.phone_timeout)
+    try:
+        print(f"Bitrix24 отвечает через {args.bitrix_delay:g} сек, пул потоков: {args.threadpool}")
+        asyncio.run(_run(args, f"http://127.0.0.1:{args.port}"))
+    finally:
+        backend.terminate()
+        backend.wait(timeout=10)
+        bitrix.shutdown()
+        os.unlink(db_file.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Перестраивает таблицу installment_schedule для всех сделок из локальной БД.
+Нужен один раз после обновления (для сделок, график которых ещё не сохранён)
+или после ручных правок таблицы deals.
+
+Использование:
+    python scripts/rebuild_installment_schedule.py
+
+    # В Docker контейнере
+    docker compose exec backend python -m scripts.rebuild_installment_schedule
+"""
+
+import sys
+import os
+import logging
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from models.payment_log import init_db, SessionLocal
+from models.deal import Deal
+from installments.service import regenerate_installment_schedule
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    init_db()
+    db = SessionLocal()
+    deals_count = 0
+    months_count = 0
+    try:
+        for db_deal in db.query(Deal).order_by(Deal.id.asc()).all():
+            months_count += regenerate_installment_schedule(db, db_deal)
+            deals_count += 1
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    print(f"✅ График перестроен: {deals_count} сделок, {months_count} платежей")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Ручной запуск сверки pending-платежей с ЮKassa.
+
+Использование:
+    python scripts/reconcile_payments.py
+    python scripts/reconcile_payments.py --min-age 0 --batch-size 50 --concurrency 10
+
+    # В Docker контейнере
+    docker compose exec backend python -m scripts.reconcile_payments
+"""
+
+import sys
+import os
+import argparse
+import json
+import logging
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from models.payment_log import init_db
+from payments.reconciliation import reconcile_pending_payments
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка pending-платежей с ЮKassa")
+    parser.add_argument("--min-age", type=int, default=None, help="Минимальный возраст платежа в минутах")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=None)
+    args = parser.parse_args()
+
+    init_db()
+    stats = reconcile_pending_payments(
+        min_age_minutes=args.min_age,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+    )
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,7 @@ from models.deal import Deal
 from bitrix.client import get_all_installment_deals
 from bitrix.client import _get_full_deal
 from bitrix.parsing import parse_money_to_int, parse_int
+from installments.service import regenerate_installment_schedule
 from core.config import settings
 import requests
 
@@ -99,6 +100,7 @@ def sync_deal_to_db(db, bitrix_deal: dict) -> Tuple[bool, str]:
                 )
                 paid_amount = db_deal.paid_amount
             
+            schedule_before = (db_deal.total_amount, db_deal.initial_payment, db_deal.term_months)
             db_deal.title = title
             db_deal.email = email or db_deal.email  # Обновляем email, если он есть в Bitrix
             db_deal.total_amount = total_amount
@@ -106,6 +108,10 @@ def sync_deal_to_db(db, bitrix_deal: dict) -> Tuple[bool, str]:
             db_deal.initial_payment = initial_payment
             db_deal.term_months = term_months
             db_deal.updated_at = datetime.utcnow()
+            # Сохранённый график (installment_schedule) — источник просрочки и отчётов: перестраиваем,
+            # если изменились сумма, взнос или срок
+            if (db_deal.total_amount, db_deal.initial_payment, db_deal.term_months) != schedule_before:
+                regenerate_installment_schedule(db, db_deal)
             
             action = "обновлена"
         else:
@@ -0,0 +1,85 @@
+"""
+Проверка пересборки deals из Bitrix24 (admin/db_rebuild.py) на временной SQLite-БД.
+
+Сценарий из ревью: у сделок есть пропуски в id, Bitrix24 отдаёт новую сделку, а сессия,
+загрузившая сделку до пересборки, записывает её после подмены. Запись должна попасть в ту же
+сделку, id существующих сделок — не меняться, новая сделка — получить id после всех существующих.
+Bitrix24 подменяется заглушкой (реальные запросы не отправляются).
+
+Использование:
+    python scripts/test_db_rebuild.py
+"""
+
+import sys
+import os
+import logging
+import tempfile
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+_DB_FILE = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+_DB_FILE.close()
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_FILE.name}"
+for _name, _value in (("BITRIX_WEBHOOK_URL", "http://127.0.0.1:9/rest/1/test"),
+                      ("YOOKASSA_SHOP_ID", "test"), ("YOOKASSA_SECRET", "test"),
+                      ("FRONTEND_URL", "http://localhost:3000")):
+    os.environ.setdefault(_name, _value)
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def _patch_bitrix(deals: dict):
+    import bitrix.client as bitrix_client
+    bitrix_client.get_all_installment_deals_paged = lambda: [{"ID": d, "TITLE": v["TITLE"]} for d, v in deals.items()]
+    bitrix_client.get_full_deals = lambda ids, use_cache=True: {str(d): deals[str(d)] for d in ids if str(d) in deals}
+
+
+def test_ids_survive_rebuild():
+    from models.payment_log import SessionLocal, init_db
+    from models.deal import Deal
+    from admin.db_rebuild import rebuild_deals_from_bitrix
+
+    init_db()
+    db = SessionLocal()
+    db.add_all([
+        Deal(id=1, deal_id="1", title="Сделка 1", total_amount=100_000, paid_amount=0, term_months=10),
+        Deal(id=3, deal_id="3", title="Сделка 3", total_amount=300_000, paid_amount=0, term_months=10),
+    ])
+    db.commit()
+    db.close()
+
+    _patch_bitrix({
+        d: {"ID": d, "TITLE": f"Сделка {d}", "OPPORTUNITY": str(total), "UF_TERM_MONTHS": "10"}
+        for d, total in (("1", 100_000), ("3", 300_000), ("4", 400_000))
+    })
+
+    # Сессия, открытая во время подмены: сделка загружена до пересборки, записана после
+    open_session = SessionLocal()
+    deal_3 = open_session.query(Deal).filter(Deal.deal_id == "3").one()
+    open_session.commit()  # отпускаем транзакцию чтения (SQLite), объект остаётся в сессии
+
+    result = rebuild_deals_from_bitrix()
+    assert result["deals"] == 3 and result["created"] == 1, result
+
+    deal_3.paid_amount = 777
+    open_session.commit()
+    open_session.close()
+
+    db = SessionLocal()
+    try:
+        ids = {d.deal_id: d.id for d in db.query(Deal)}
+        paid = {d.deal_id: d.paid_amount for d in db.query(Deal)}
+    finally:
+        db.close()
+    assert ids["1"] == 1 and ids["3"] == 3, ids
+    assert ids["4"] > 3, ids
+    assert paid["3"] == 777 and paid["4"] == 0, paid
+    print(f"✓ id сохранены после пересборки: {ids}; запись открытой сессии попала в сделку 3")
+
+
+if __name__ == "__main__":
+    try:
+        test_ids_survive_rebuild()
+    finally:
+        os.unlink(_DB_FILE.name)
@@ -3,91 +3,57 @@
 import { useDeals } from "@/modules/admin/deals/hooks";
 import DealsTable from "@/components/admin/DealsTable";
 import { Loader, ErrorState, EmptyState } from "@/components/ui/State";
-import { ClipboardList, DollarSign, Wallet, Banknote, Search, Download, TestTube, Trash2 } from "lucide-react";
-import { useMemo, useState } from "react";
+import { ClipboardList, DollarSign, Wallet, Banknote, Search, Download, TestTube, RefreshCw } from "lucide-react";
+import { useEffect, useMemo, useState } from "react";
 import { testWebhook } from "@/modules/admin/payments/api";
-import { clearDatabase } from "@/modules/admin/deals/api";
+import { rebuildDatabase, getRebuildStatus } from "@/modules/admin/deals/api";
+
+const STATUS_OPTIONS = [
+  { value: "", label: "Все статусы" },
+  { value: "overdue", label: "Просрочена" },
+  { value: "active", label: "В процессе" },
+  { value: "pending", label: "Не оплачено" },
+  { value: "paid", label: "Завершена" },
+];
+
+const SORT_OPTIONS = [
+  { value: "-created_at", label: "Сначала новые" },
+  { value: "created_at", label: "Сначала старые" },
+  { value: "-remaining_amount", label: "Больший остаток" },
+  { value: "-total_amount", label: "Большая сумма" },
+  { value: "title", label: "По имени" },
+];
 
 export default function AdminDealsPage() {
-  const { deals, loading, error, refetch } = useDeals();
   const [searchQuery, setSearchQuery] = useState("");
+  const [debouncedQuery, setDebouncedQuery] = useState("");
+  const [statusFilter, setStatusFilter] = useState("");
+  const [sort, setSort] = useState("-created_at");
+  // Поиск, фильтр и сортировка выполняются на сервере (список приходит постранично)
+  const { deals, totals, nextCursor, loading, loadingMore, error, refetch, loadMore } = useDeals({
+    q: debouncedQuery,
+    status: statusFilter,
+    sort,
+  });
   const [testingWebhook, setTestingWebhook] = useState(false);
   const [webhookTestResult, setWebhookTestResult] = useState(null);
-  const [showClearConfirm, setShowClearConfirm] = useState(false);
-  const [clearing, setClearing] = useState(false);
-
-  const installmentDeals = useMemo(() => {
-    if (!deals) return [];
-    // ВАЖНО: список уже приходит из Bitrix как "TYPE_PAYMENT=Рассрочка",
-    // поэтому не фильтруем по term_months (он может быть 0 до настройки/синхронизации UF-поля).
-    // Оставляем только базовую проверку на сумму рассрочки > 0.
-    return deals.filter((d) => {
-      const totalAmount = Number(d.total_amount) || 0;
-      const initialPayment = Number(d.initial_payment) || 0;
-      const installmentAmount = Math.max(0, totalAmount - initialPayment);
-      return installmentAmount > 0;
-    });
-  }, [deals]);
-
-  const filteredDeals = useMemo(() => {
-    if (!installmentDeals) return [];
-    if (!searchQuery.trim()) return installmentDeals;
-    
-    const query = searchQuery.toLowerCase();
-    return installmentDeals.filter(d => {
-      const title = (d.title || "").toLowerCase();
-      const email = (d.email || "").toLowerCase();
-      const dealId = (d.deal_id || "").toLowerCase();
-      return title.includes(query) || email.includes(query) || dealId.includes(query);
-    });
-  }, [installmentDeals, searchQuery]);
-
-  const stats = useMemo(() => {
-    if (!deals || deals.length === 0) {
-      return {
-        installmentsCount: 0,
-        installmentTotal: 0,
-        installmentPaid: 0,
-        installmentRemaining: 0,
-      };
-    }
+  const [showRebuildConfirm, setShowRebuildConfirm] = useState(false);
+  const [rebuilding, setRebuilding] = useState(false);
 
-    // Метрики считаем по сумме РАССРОЧКИ (total_amount - initial_payment), а не по общей сумме сделки
-    const normalized = deals.map((d) => {
-      const totalAmount = Number(d.total_amount) || 0;
-      const paidAmount = Number(d.paid_amount) || 0;
-      const initialPayment = Number(d.initial_payment) || 0;
-      const termMonths = Number(d.term_months) || 0;
+  useEffect(() => {
+    const timer = setTimeout(() => setDebouncedQuery(searchQuery.trim()), 300);
+    return () => clearTimeout(timer);
+  }, [searchQuery]);
 
-      const installmentAmount = Math.max(0, totalAmount - initialPayment);
-      // initial_payment не является фактом оплаты => оплачено по графику = paid_amount (с ограничением суммой рассрочки)
-      const paidInstallment = Math.min(installmentAmount, Math.max(0, paidAmount));
-      const remainingInstallment = Math.max(0, installmentAmount - paidInstallment);
+  const filtersActive = Boolean(debouncedQuery || statusFilter);
 
-      // "Рассрочка" для KPI = реально настроенная рассрочка (есть срок и сумма > 0).
-      // Сделки с term_months=0 показываем в таблице, но в KPI не считаем.
-      const isInstallment = installmentAmount > 0 && termMonths > 0;
-
-      return {
-        isInstallment,
-        installmentAmount,
-        paidInstallment,
-        remainingInstallment,
-      };
-    });
-
-    const installmentsCount = normalized.filter((x) => x.isInstallment).length;
-    const installmentTotal = normalized.reduce((sum, x) => sum + (x.isInstallment ? x.installmentAmount : 0), 0);
-    const installmentPaid = normalized.reduce((sum, x) => sum + (x.isInstallment ? x.paidInstallment : 0), 0);
-    const installmentRemaining = normalized.reduce((sum, x) => sum + (x.isInstallment ? x.remainingInstallment : 0), 0);
-
-    return {
-      installmentsCount,
-      installmentTotal,
-      installmentPaid,
-      installmentRemaining,
-    };
-  }, [deals]);
+  // Метрики считаются на сервере по сумме РАССРОЧКИ (total_amount - initial_payment) по всем найденным сделкам
+  const stats = useMemo(() => ({
+    installmentsCount: totals?.installments_count || 0,
+    installmentTotal: totals?.installment_total || 0,
+    installmentPaid: totals?.installment_paid || 0,
+    installmentRemaining: totals?.installment_remaining || 0,
+  }), [totals]);
 
   const handleTestWebhook = async () => {
     setTestingWebhook(true);
@@ -109,7 +75,7 @@ export default function AdminDealsPage() {
     // Простой экспорт в CSV
     const csv = [
       ["ID", "Клиент", "Email", "Сумма", "Оплачено", "Остаток", "Срок", "Статус"].join(","),
-      ...filteredDeals.map(d => [
+      ...deals.map(d => [
         // Экспортируем по сумме рассрочки (total - initial)
         d.deal_id,
         `"${d.title || ""}"`,
@@ -129,21 +95,35 @@ export default function AdminDealsPage() {
     link.click();
   };
 
-  const handleClearDatabase = async () => {
-    setClearing(true);
+  const handleRebuildDatabase = async () => {
+    setRebuilding(true);
     try {
-      await clearDatabase();
-      alert("База данных успешно очищена!");
-      setShowClearConfirm(false);
+      try {
+        await rebuildDatabase();
+      } catch (error) {
+        // 409 — пересборка уже идёт: просто дожидаемся её
+        if (error.status !== 409) throw error;
+      }
+      setShowRebuildConfirm(false);
+      let state = await getRebuildStatus();
+      while (state.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        state = await getRebuildStatus();
+      }
+      if (state.status === "failed") {
+        throw new Error(state.error);
+      }
+      const result = state.result || {};
+      alert(`База данных обновлена из Bitrix24: ${result.deals ?? 0} сделок (новых ${result.created ?? 0}, обновлено ${result.updated ?? 0})`);
       refetch();
     } catch (error) {
-      alert(`Ошибка при очистке базы данных: ${error.message || "Неизвестная ошибка"}`);
+      alert(`Ошибка при обновлении базы данных: ${error.message || "Неизвестная ошибка"}`);
     } finally {
-      setClearing(false);
+      setRebuilding(false);
     }
   };
 
-  if (loading) {
+  if (loading && !totals) {
     return (
       <main className="min-h-screen bg-gradient-to-br from-slate-900 via-purple-900/20 to-slate-900">
         <div className="max-w-7xl mx-auto px-4 sm:px-6 lg:px-8 py-8">
@@ -153,7 +133,7 @@ export default function AdminDealsPage() {
     );
   }
 
-  if (error) {
+  if (error && !totals) {
     return (
       <main className="min-h-screen bg-gradient-to-br from-slate-900 via-purple-900/20 to-slate-900">
         <div className="max-w-7xl mx-auto px-4 sm:px-6 lg:px-8 py-8">
@@ -163,18 +143,8 @@ export default function AdminDealsPage() {
     );
   }
 
-  if (!deals || deals.length === 0) {
-    return (
-      <main className="min-h-screen bg-gradient-to-br from-slate-900 via-purple-900/20 to-slate-900">
-        <div className="max-w-7xl mx-auto px-4 sm:px-6 lg:px-8 py-8">
-          <EmptyState text="Сделки не найдены" icon="📋" />
-        </div>
-      </main>
-    );
-  }
-
   // По умолчанию показываем только рассрочки: если их нет — выводим пустое состояние
-  if (installmentDeals.length === 0) {
+  if (!filtersActive && totals && totals.count === 0) {
     return (
       <main className="min-h-screen bg-gradient-to-br from-slate-900 via-purple-900/20 to-slate-900">
         <div className="max-w-7xl mx-auto px-4 sm:px-6 lg:px-8 py-8">
@@ -217,6 +187,24 @@ export default function AdminDealsPage() {
             />
           </div>
           <div className="flex gap-3">
+            <select
+              value={statusFilter}
+              onChange={(e) => setStatusFilter(e.target.value)}
+              className="px-3 py-3 bg-slate-800/50 border border-slate-700 rounded-lg text-white focus:outline-none focus:ring-2 focus:ring-purple-500"
+            >
+              {STATUS_OPTIONS.map((o) => (
+                <option key={o.value} value={o.value}>{o.label}</option>
+              ))}
+            </select>
+            <select
+              value={sort}
+              onChange={(e) => setSort(e.target.value)}
+              className="px-3 py-3 bg-slate-800/50 border border-slate-700 rounded-lg text-white focus:outline-none focus:ring-2 focus:ring-purple-500"
+            >
+              {SORT_OPTIONS.map((o) => (
+                <option key={o.value} value={o.value}>{o.label}</option>
+              ))}
+            </select>
             <button 
               onClick={handleTestWebhook}
               disabled={testingWebhook}
@@ -233,11 +221,12 @@ export default function AdminDealsPage() {
               Экспорт
             </button>
             <button 
-              onClick={() => setShowClearConfirm(true)}
-              className="px-4 py-3 bg-red-600 text-white rounded-lg hover:bg-red-700 transition-colors flex items-center gap-2 font-medium"
+              onClick={() => setShowRebuildConfirm(true)}
+              disabled={rebuilding}
+              className="px-4 py-3 bg-red-600 text-white rounded-lg hover:bg-red-700 transition-colors flex items-center gap-2 font-medium disabled:opacity-50 disabled:cursor-not-allowed"
             >
-              <Trash2 className="w-4 h-4" />
-              Очистить БД
+              <RefreshCw className={`w-4 h-4 ${rebuilding ? "animate-spin" : ""}`} />
+              {rebuilding ? "Обновление БД..." : "Обновить БД"}
             </button>
           </div>
         </div>
@@ -304,63 +293,78 @@ export default function AdminDealsPage() {
           <div className="px-6 py-4 border-b border-slate-700">
             <h2 className="text-lg font-semibold text-white">Список рассрочек</h2>
             <p className="text-sm text-slate-400 mt-1">
-              Найдено: {filteredDeals.length} из {installmentDeals.length}
+              {loading ? "Загрузка..." : `Найдено: ${totals?.count ?? deals.length}, показано: ${deals.length}`}
             </p>
           </div>
-          <DealsTable deals={filteredDeals} onRefresh={refetch} />
+          {error ? (
+            <ErrorState message={error} onRetry={refetch} />
+          ) : deals.length === 0 ? (
+            <EmptyState text="Ничего не найдено" icon="🔍" />
+          ) : (
+            <DealsTable deals={deals} onRefresh={refetch} />
+          )}
+          {nextCursor && (
+            <div className="flex justify-center px-6 py-4 border-t border-slate-700">
+              <button
+                onClick={loadMore}
+                disabled={loadingMore}
+                className="px-4 py-2 rounded-lg border border-slate-700 text-slate-300 hover:bg-slate-800 disabled:opacity-50"
+              >
+                {loadingMore ? "Загрузка..." : "Показать ещё"}
+              </button>
+            </div>
+          )}
         </div>
       </div>
 
-      {/* Модальное окно подтверждения очистки БД */}
-      {showClearConfirm && (
+      {/* Модальное окно подтверждения пересборки БД */}
+      {showRebuildConfirm && (
         <div className="fixed inset-0 bg-black/70 backdrop-blur-sm flex items-center justify-center z-50">
           <div className="bg-slate-800 border border-red-500/50 rounded-xl p-6 max-w-md w-full mx-4 shadow-2xl">
             <div className="flex items-center gap-3 mb-4">
               <div className="p-2 bg-red-500/20 rounded-lg">
-                <Trash2 className="w-6 h-6 text-red-400" />
+                <RefreshCw className="w-6 h-6 text-red-400" />
               </div>
-              <h2 className="text-xl font-semibold text-white">Очистка базы данных</h2>
+              <h2 className="text-xl font-semibold text-white">Обновление базы данных</h2>
             </div>
             
             <div className="mb-6">
               <p className="text-slate-300 mb-2">
-                Вы уверены, что хотите очистить всю базу данных?
-              </p>
-              <p className="text-sm text-red-400 font-medium">
-                ⚠️ Это действие удалит:
+                Загрузить все сделки из Bitrix24 заново?
               </p>
               <ul className="text-sm text-slate-400 mt-2 ml-4 list-disc space-y-1">
-                <li>Все сделки (deals)</li>
-                <li>Все логи платежей (payment_logs)</li>
-                <li>Все распределения платежей (cash_allocations)</li>
+                <li>Название, сумма, срок и взнос сделок берутся из Bitrix24</li>
+                <li>Оплаченные суммы не уменьшаются</li>
+                <li>Логи платежей и распределения оплат сохраняются</li>
               </ul>
-              <p className="text-sm text-red-400 font-medium mt-4">
-                Это действие нельзя отменить!
+              <p className="text-sm text-slate-400 mt-4">
+                Загрузка идёт в фоне: клиенты и админка продолжают работать с текущими данными,
+                новые подменяют их в конце одним шагом.
               </p>
             </div>
 
             <div className="flex gap-3 justify-end">
               <button
-                onClick={() => setShowClearConfirm(false)}
-                disabled={clearing}
+                onClick={() => setShowRebuildConfirm(false)}
+                disabled={rebuilding}
                 className="px-4 py-2 border border-slate-600 text-slate-300 rounded-lg hover:bg-slate-700 disabled:opacity-50 transition-colors"
               >
                 Отмена
               </button>
               <button
-                onClick={handleClearDatabase}
-                disabled={clearing}
+                onClick={handleRebuildDatabase}
+                disabled={rebuilding}
                 className="px-4 py-2 bg-red-600 text-white rounded-lg hover:bg-red-700 disabled:opacity-50 flex items-center gap-2 transition-colors"
               >
-                {clearing ? (
+                {rebuilding ? (
                   <>
                     <div className="w-4 h-4 border-2 border-white border-t-transparent rounded-full animate-spin"></div>
-                    Очистка...
+                    Запуск...
                   </>
                 ) : (
                   <>
-                    <Trash2 className="w-4 h-4" />
-                    Очистить БД
+                    <RefreshCw className="w-4 h-4" />
+                    Обновить БД
                   </>
                 )}
               </button>
@@ -4,7 +4,7 @@ export const dynamic = 'force-dynamic';
 
 import { useEffect, Suspense, useState } from "react";
 import { useSearchParams, useRouter } from "next/navigation";
-import { setToken } from "@/lib/auth";
+import { setToken, setSession } from "@/lib/auth";
 import { apiClient } from "@/lib/apiClient";
 
 function MagicLinkContent() {
@@ -32,6 +32,8 @@ function MagicLinkContent() {
         // Валидируем токен, делая тестовый запрос к API
         // Это также создаст сессию пользователя в БД если её нет
         try {
+          // Меняем одноразовую ссылку на сессию (access + refresh), затем проверяем доступ к рассрочке
+          setSession(await apiClient.post('/api/auth/session', { token }));
           await apiClient.get('/api/installment/my');
           // Если запрос успешен, токен валидный
           setStatus('success');
@@ -19,6 +19,8 @@ export default function DealsTable({ deals, onRefresh }) {
     let actualStatus = status;
     if (paidPercent >= 100) {
       actualStatus = "paid";
+    } else if (status === "overdue") {
+      actualStatus = "overdue";
     } else if (paidPercent > 0) {
       actualStatus = "active";
     } else {
@@ -6,6 +6,9 @@ import { getPaymentLogs } from "@/modules/admin/payments/api";
 export default function PaymentLogs({ dealId }) {
   const [logs, setLogs] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [totals, setTotals] = useState(null);
 
   useEffect(() => {
     loadLogs();
@@ -15,7 +18,9 @@ export default function PaymentLogs({ dealId }) {
     setLoading(true);
     try {
       const data = await getPaymentLogs(dealId);
-      setLogs(data);
+      setLogs(data?.items || []);
+      setNextCursor(data?.next_cursor || null);
+      setTotals(data?.totals || null);
     } catch (error) {
       console.error("Error loading payment logs:", error);
     } finally {
@@ -23,6 +28,20 @@ export default function PaymentLogs({ dealId }) {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const data = await getPaymentLogs(dealId, { cursor: nextCursor });
+      setLogs((prev) => [...prev, ...(data?.items || [])]);
+      setNextCursor(data?.next_cursor || null);
+    } catch (error) {
+      console.error("Error loading payment logs:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   if (loading) {
     return <div className="text-slate-400 p-4">Загрузка истории платежей...</div>;
   }
@@ -79,6 +98,20 @@ export default function PaymentLogs({ dealId }) {
           </tbody>
         </table>
       </div>
+      <div className="flex items-center justify-between px-6 py-3 text-xs text-slate-500">
+        <span>
+          {totals ? `Показано ${logs.length} из ${totals.count}` : `Показано ${logs.length}`}
+        </span>
+        {nextCursor && (
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="px-3 py-1 rounded-md border border-slate-700 text-slate-300 hover:bg-slate-800 disabled:opacity-50"
+          >
+            {loadingMore ? "Загрузка..." : "Показать ещё"}
+          </button>
+        )}
+      </div>
     </div>
   );
 }
@@ -1,7 +1,14 @@
 import { apiClient } from "@/lib/apiClient";
 
-export function getDeals() {
-  return apiClient.get("/api/admin/deals");
+export function getDeals({ cursor = null, limit = 50, sort = null, q = null, status = null, onlyInstallments = true } = {}) {
+  const params = new URLSearchParams();
+  if (cursor) params.set("cursor", cursor);
+  if (limit) params.set("limit", String(limit));
+  if (sort) params.set("sort", sort);
+  if (q) params.set("q", q);
+  if (status) params.set("status", status);
+  if (onlyInstallments) params.set("only_installments", "true");
+  return apiClient.get(`/api/admin/deals?${params.toString()}`);
 }
 
 export function getDeal(id) {
@@ -29,6 +36,11 @@ export function updateDealSettings(dealId, settings) {
   return apiClient.put(`/api/admin/deals/${dealId}/settings`, settings);
 }
 
-export function clearDatabase() {
-  return apiClient.post("/api/admin/database/clear");
+// Пересборка deals из Bitrix24 в фоне (сервис работает, журнал платежей не трогается)
+export function rebuildDatabase() {
+  return apiClient.post("/api/admin/database/rebuild");
+}
+
+export function getRebuildStatus() {
+  return apiClient.get("/api/admin/database/rebuild");
 }
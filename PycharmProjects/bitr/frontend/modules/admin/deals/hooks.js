@@ -1,30 +1,56 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { getDeals, getDeal } from "./api";
 
-export function useDeals() {
+export function useDeals({ q = "", status = "", sort = "-created_at" } = {}) {
   const [deals, setDeals] = useState([]);
+  const [totals, setTotals] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState(null);
+  const requestId = useRef(0);
 
   useEffect(() => {
     loadDeals();
-  }, []);
+  }, [q, status, sort]);
 
   const loadDeals = async () => {
+    // Ответ на устаревший запрос (поиск уже изменился) не должен перезаписать список
+    const current = ++requestId.current;
     setLoading(true);
     setError(null);
     try {
-      const data = await getDeals();
-      setDeals(data);
+      const data = await getDeals({ q: q || null, status: status || null, sort });
+      if (current !== requestId.current) return;
+      setDeals(data?.items || []);
+      setTotals(data?.totals || null);
+      setNextCursor(data?.next_cursor || null);
     } catch (err) {
+      if (current !== requestId.current) return;
       setError(err.message || "Ошибка загрузки сделок");
       console.error("deals_load_error", { error: err.message });
     } finally {
-      setLoading(false);
+      if (current === requestId.current) setLoading(false);
+    }
+  };
+
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    const current = requestId.current;
+    setLoadingMore(true);
+    try {
+      const data = await getDeals({ cursor: nextCursor, q: q || null, status: status || null, sort });
+      if (current !== requestId.current) return;
+      setDeals((prev) => [...prev, ...(data?.items || [])]);
+      setNextCursor(data?.next_cursor || null);
+    } catch (err) {
+      console.error("deals_load_more_error", { error: err.message });
+    } finally {
+      setLoadingMore(false);
     }
   };
 
-  return { deals, loading, error, refetch: loadDeals };
+  return { deals, totals, nextCursor, loading, loadingMore, error, refetch: loadDeals, loadMore };
 }
 
 export function useDeal(id) {
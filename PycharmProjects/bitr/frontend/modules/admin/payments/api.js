@@ -1,8 +1,16 @@
 import { apiClient } from "@/lib/apiClient";
 
-export async function getPaymentLogs(dealId = null) {
-  const url = dealId ? `/api/payments/logs?deal_id=${dealId}` : "/api/payments/logs";
-  return apiClient.get(url);
+export async function getPaymentLogs(dealId = null, { cursor = null, limit = 50, source = null, status = null, dateFrom = null, dateTo = null } = {}) {
+  const params = new URLSearchParams();
+  if (dealId) params.set("deal_id", dealId);
+  if (cursor) params.set("cursor", cursor);
+  if (limit) params.set("limit", String(limit));
+  if (source) params.set("source", source);
+  if (status) params.set("status", status);
+  if (dateFrom) params.set("date_from", dateFrom);
+  if (dateTo) params.set("date_to", dateTo);
+  const query = params.toString();
+  return apiClient.get(query ? `/api/payments/logs?${query}` : "/api/payments/logs");
 }
 
 export async function testWebhook() {
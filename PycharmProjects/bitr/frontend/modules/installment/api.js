@@ -1,10 +1,58 @@
 import { apiClient } from "@/lib/apiClient";
+import { getToken } from "@/lib/auth";
+
+const API_URL = process.env.NEXT_PUBLIC_API_URL || '';
 
 export async function getMyInstallment() {
   return apiClient.get("/api/installment/my");
 }
 
+/** Все рассрочки пользователя (если сделок несколько). */
+export async function getMyInstallments() {
+  return apiClient.get("/api/installment/deals");
+}
+
 export async function createPayment(amount) {
   return apiClient.post("/api/payments/create", { amount });
 }
 
+/**
+ * Ждёт событие о проведённом платеже paymentId (SSE /api/payments/events).
+ * fetch вместо EventSource — EventSource не умеет передавать заголовок Authorization.
+ * Возвращает данные события payment или null (таймаут сервера / обрыв соединения).
+ */
+export async function waitForPaymentEvent(paymentId, signal) {
+  const params = paymentId ? `?payment_id=${encodeURIComponent(paymentId)}` : "";
+  const response = await fetch(`${API_URL}/api/payments/events${params}`, {
+    headers: { Authorization: `Bearer ${getToken()}` },
+    signal,
+  });
+  if (!response.ok || !response.body) {
+    return null;
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) return null;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) >= 0) {
+      const block = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      const lines = block.split("\n");
+      const event = lines.find((l) => l.startsWith("event: "))?.slice(7);
+      const data = lines.find((l) => l.startsWith("data: "))?.slice(6);
+      if (event === "payment" && data) {
+        reader.cancel();
+        return JSON.parse(data);
+      }
+      if (event === "timeout") {
+        reader.cancel();
+        return null;
+      }
+    }
+  }
+}
@@ -1,8 +1,11 @@
 import { useEffect, useState } from "react";
-import { getMyInstallment, createPayment } from "./api";
+import { getMyInstallment, createPayment, waitForPaymentEvent } from "./api";
 import { mapDeal } from "./mapper";
 import { logger } from "@/lib/logger";
 
+// Платёж, на оплату которого ушли в ЮKassa: после возврата ждём его webhook по SSE вместо повторных запросов
+const PAYMENT_PENDING_KEY = "payment_pending_id";
+
 export function useInstallment() {
   const [deal, setDeal] = useState(null);
   const [loading, setLoading] = useState(true);
@@ -13,6 +16,27 @@ export function useInstallment() {
     loadDeal();
   }, []);
 
+  useEffect(() => {
+    const paymentId = sessionStorage.getItem(PAYMENT_PENDING_KEY);
+    if (!paymentId) return;
+    const controller = new AbortController();
+    waitForPaymentEvent(paymentId, controller.signal)
+      .then((event) => {
+        sessionStorage.removeItem(PAYMENT_PENDING_KEY);
+        if (event) {
+          logger.info("payment_event_received", { paymentId: event.payment_id });
+        }
+        // И после таймаута обновляем один раз — на случай, если событие не дошло
+        loadDeal();
+      })
+      .catch((err) => {
+        if (err.name !== "AbortError") {
+          logger.warn("payment_event_error", { error: err.message });
+        }
+      });
+    return () => controller.abort();
+  }, []);
+
   const loadDeal = async () => {
     setLoading(true);
     setError(null);
@@ -78,8 +102,12 @@ export function useInstallment() {
     setPaymentLoading(true);
     try {
       logger.info("payment_attempt", { amount });
-      const { url } = await createPayment(amount);
-      logger.info("payment_redirect", { url, amount });
+      // payment_id сервера, а не время браузера: повторный запрос может вернуть уже созданный платёж
+      const { url, payment_id: paymentId } = await createPayment(amount);
+      logger.info("payment_redirect", { url, amount, paymentId });
+      if (paymentId) {
+        sessionStorage.setItem(PAYMENT_PENDING_KEY, paymentId);
+      }
       window.location.href = url;
     } catch (err) {
       const errorMsg = err.message || "Ошибка создания платежа";